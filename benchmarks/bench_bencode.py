@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Compare bencode_util with bencode.py on the messages nodes send
+
+Each message is encoded and decoded many times with both, and fed to
+bencode_util's incremental decoder in 64 KiB pieces as it would arrive from
+a socket.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+
+import bencode  # type: ignore
+
+from syncr_backend.constants import DEFAULT_CHUNK_SIZE
+from syncr_backend.util import bencode_util
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--seconds", type=float, default=1.0,
+        help="How long to run each measurement for",
+    )
+    parser.add_argument(
+        "--files", type=int, default=5000,
+        help="Number of files in the drop metadata",
+    )
+    return parser
+
+
+def messages(files: int) -> Dict[str, Any]:
+    rng = random.Random(0)
+    paths = ['dir%d/file%d.txt' % (i % 50, i) for i in range(files)]
+    return {
+        'chunk_response': {
+            'status': 'ok', 'response': os.urandom(DEFAULT_CHUNK_SIZE),
+        },
+        'drop_metadata': {
+            'drop_id': os.urandom(64), 'version': 3, 'version_nonce': 42,
+            'name': 'photos', 'owner': os.urandom(32), 'other_owners': {},
+            'signed_by': os.urandom(32), 'signature': os.urandom(256),
+            'files': {p: os.urandom(32) for p in paths},
+        },
+        'timestamp_file': {
+            p: [rng.getrandbits(20), rng.getrandbits(60), rng.getrandbits(30)]
+            for p in paths
+        },
+        'peer_list': [
+            [os.urandom(32), '10.0.%d.%d' % (i // 256, i % 256), 2000 + i]
+            for i in range(200)
+        ],
+    }
+
+
+def rate(f: Callable[[], Any], seconds: float, rounds: int=9) -> float:
+    """How many times per second f runs, the median of a few rounds, so a
+    round slowed or sped up by other load on the machine does not move the
+    result"""
+    f()
+    rates = []
+    for _ in range(rounds):
+        n = 0
+        start = time.perf_counter()
+        while True:
+            f()
+            n += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= seconds / rounds:
+                break
+        rates.append(n / elapsed)
+    return statistics.median(rates)
+
+
+def decode_incremental(data: bytes) -> Any:
+    decoder = bencode_util.Decoder()
+    for i in range(0, len(data), 2**16):
+        decoder.feed(data[i:i + 2**16])
+        (done, value) = decoder.next_value()
+    assert done
+    return value
+
+
+def run(seconds: float, files: int) -> Dict[str, float]:
+    """
+    Run the benchmark
+
+    :param seconds: How long to run each measurement for
+    :param files: Number of files in the drop metadata
+    :return: Encodes and decodes per second of each message with each codec
+    """
+    results = {}  # type: Dict[str, float]
+    for (name, message) in messages(files).items():
+        data = bencode.encode(message)
+        assert bencode_util.encode(message) == data
+        assert bencode_util.decode(data) == bencode.decode(data)
+
+        results['%s_encode_bencode_per_s' % name] = rate(
+            lambda: bencode.encode(message), seconds,
+        )
+        results['%s_encode_bencode_util_per_s' % name] = rate(
+            lambda: bencode_util.encode(message), seconds,
+        )
+        results['%s_decode_bencode_per_s' % name] = rate(
+            lambda: bencode.decode(data), seconds,
+        )
+        results['%s_decode_bencode_util_per_s' % name] = rate(
+            lambda: bencode_util.decode(data), seconds,
+        )
+        results['%s_decode_incremental_per_s' % name] = rate(
+            lambda: decode_incremental(data), seconds,
+        )
+    return results
+
+
+def main() -> None:
+    args = parser().parse_args()
+    results = run(args.seconds, args.files)
+    for (name, value) in sorted(results.items()):
+        print("{}: {:.0f}".format(name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Compare how many bytes fixed and content-defined chunks transfer
+
+A random file is edited in a few typical ways.  For each edit, the bytes of
+the new version's chunks that the old version did not have are what a peer
+would download, with fixed DEFAULT_CHUNK_SIZE chunks and with content-defined
+chunks.
+"""
+import argparse
+import hashlib
+import io
+import random
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from syncr_backend.constants import DEFAULT_CHUNK_SIZE
+from syncr_backend.util import chunk_util
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--size", type=int, default=32, help="Size of the file in MiB",
+    )
+    return parser
+
+
+def fixed_chunks(data: bytes) -> List[bytes]:
+    return [
+        data[i:i + DEFAULT_CHUNK_SIZE]
+        for i in range(0, len(data), DEFAULT_CHUNK_SIZE)
+    ]
+
+
+def cdc_chunks(data: bytes) -> List[bytes]:
+    return list(chunk_util.iter_chunks(io.BytesIO(data)))
+
+
+def transferred(old: List[bytes], new: List[bytes]) -> int:
+    """Bytes of the chunks of new whose hash is not in old"""
+    have = {hashlib.sha256(c).digest() for c in old}
+    return sum(len(c) for c in new if hashlib.sha256(c).digest() not in have)
+
+
+def edits(size: int) -> Dict[str, Callable[[bytes], bytes]]:
+    rng = random.Random(0)
+    patch = bytes(rng.getrandbits(8) for _ in range(100))
+    middle = size // 2
+    return {
+        'insert_start': lambda d: patch + d,
+        'insert_middle': lambda d: d[:middle] + patch + d[middle:],
+        'delete_middle': lambda d: d[:middle] + d[middle + 4096:],
+        'overwrite_middle': lambda d: d[:middle] + patch + d[middle + 100:],
+        'append': lambda d: d + patch,
+    }
+
+
+def run(size: int) -> Dict[str, float]:
+    """
+    Run the benchmark
+
+    :param size: Size of the file in bytes
+    :return: Bytes transferred after each edit with each kind of chunks, \
+            and how fast content-defined chunks are found, in MB/s
+    """
+    data = random.Random(1).getrandbits(size * 8).to_bytes(size, 'little')
+    results = {}  # type: Dict[str, float]
+
+    old_fixed = fixed_chunks(data)
+    start = time.perf_counter()
+    old_cdc = cdc_chunks(data)
+    results['cdc_mb_per_s'] = size / 1e6 / (time.perf_counter() - start)
+
+    for (name, edit) in edits(size).items():
+        new = edit(data)
+        results['fixed_%s_bytes' % name] = transferred(
+            old_fixed, fixed_chunks(new),
+        )
+        results['cdc_%s_bytes' % name] = transferred(old_cdc, cdc_chunks(new))
+    return results
+
+
+def main() -> None:
+    args = parser().parse_args()
+    results = run(args.size * 2**20)
+    for (name, value) in sorted(results.items()):
+        print("{}: {:.0f}".format(name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Benchmark DropPeerDHTStorage as held by a DHT node storing many drops
+
+Every drop gets a few peers, then the storage is read the way kademlia reads
+it while the peers are being renewed, and finally every peer expires.
+"""
+import argparse
+import os
+import random
+import time
+from typing import Dict
+from unittest import mock
+
+from syncr_backend.constants import TRACKER_DROP_AVAILABILITY_TTL
+from syncr_backend.external_interface.dht_util import DropPeerDHTStorage
+from syncr_backend.util import crypto_util
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--drops", type=int, default=100000, help="Number of drops to store",
+    )
+    parser.add_argument(
+        "--peers", type=int, default=3, help="Number of peers per drop",
+    )
+    parser.add_argument(
+        "--reads", type=int, default=100000, help="Number of reads to time",
+    )
+    return parser
+
+
+def run(drops: int, peers: int, reads: int) -> Dict[str, float]:
+    """
+    Run the benchmark
+
+    :param drops: Number of drops to store
+    :param peers: Number of peers per drop
+    :param reads: Number of reads and renewals to time
+    :return: Operations per second of each phase
+    """
+    rng = random.Random(0)
+    drop_ids = [os.urandom(64) for _ in range(drops)]
+    announcements = [
+        crypto_util.encode_peerlist(
+            [(os.urandom(32), '10.0.%d.%d' % (i // 256, i % 256), 2000 + i)],
+        )
+        for i in range(peers)
+    ]
+    clock = [0.0]
+
+    class FakeTime(object):
+        """Stands in for the time module, to expire peers without waiting"""
+
+        def time(self) -> float:
+            return clock[0]
+
+    results = {}  # type: Dict[str, float]
+    with mock.patch(
+        'syncr_backend.external_interface.dht_util.time', new=FakeTime(),
+    ):
+        storage = DropPeerDHTStorage()
+
+        start = time.perf_counter()
+        for (i, drop_id) in enumerate(drop_ids):
+            for announcement in announcements:
+                clock[0] = i / drops
+                storage[drop_id] = announcement
+        results['set_per_s'] = drops * peers / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(reads):
+            clock[0] = 1 + i / reads
+            drop_id = rng.choice(drop_ids)
+            storage.get(drop_id)
+            storage[drop_id] = announcements[i % peers]
+        results['get_set_per_s'] = reads / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        clock[0] = 3 + TRACKER_DROP_AVAILABILITY_TTL
+        storage.cull()
+        results['expire_per_s'] = drops * peers / (time.perf_counter() - start)
+        assert not storage.peers
+
+    return results
+
+
+def main() -> None:
+    args = parser().parse_args()
+    results = run(args.drops, args.peers, args.reads)
+    for (name, value) in sorted(results.items()):
+        print("{}: {:.0f}".format(name, value))
+
+
+if __name__ == '__main__':
+    main()
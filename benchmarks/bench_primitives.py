@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""Time the primitives that dominate profiles of a node
+
+Hashing, signing and verifying metadata, reading and writing chunks, making
+file metadata, decoding drop metadata, walking a drop and calling cached
+coroutines, each on data sized like a drop with --files files.  Everything
+runs in a temporary directory, and nothing touches the node's own files.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from unittest import mock
+
+from syncr_backend.constants import CDC_PROTOCOL_VERSION
+from syncr_backend.constants import DEFAULT_CHUNK_SIZE
+from syncr_backend.metadata.drop_metadata import DropMetadata
+from syncr_backend.metadata.drop_metadata import DropVersion
+from syncr_backend.metadata.drop_metadata import gen_drop_id
+from syncr_backend.metadata.file_metadata import make_file_metadata
+from syncr_backend.util import crypto_util
+from syncr_backend.util import fileio_util
+from syncr_backend.util.async_util import async_cache
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--seconds", type=float, default=1.0,
+        help="How long to run each measurement for",
+    )
+    parser.add_argument(
+        "--files", type=int, default=1000,
+        help="Number of files in the drop",
+    )
+    parser.add_argument(
+        "--size", type=int, default=16,
+        help="Size of the file to read, write and make metadata of, in MiB",
+    )
+    return parser
+
+
+def rate(
+    f: Callable[[], Awaitable[Any]], seconds: float, rounds: int=9,
+) -> float:
+    """How many times per second the coroutine made by f runs, the median of
+    a few rounds, so a round slowed or sped up by other load on the machine
+    does not move the result"""
+    async def repeat() -> float:
+        await f()
+        rates = []
+        for _ in range(rounds):
+            n = 0
+            start = time.perf_counter()
+            while True:
+                await f()
+                n += 1
+                elapsed = time.perf_counter() - start
+                if elapsed >= seconds / rounds:
+                    break
+            rates.append(n / elapsed)
+        return statistics.median(rates)
+
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(repeat())
+
+
+def make_drop(path: str, files: int) -> None:
+    """Files in directories of 50, with some that are ignored"""
+    for i in range(files):
+        dirpath = os.path.join(path, 'dir%d' % (i // 50))
+        os.makedirs(dirpath, exist_ok=True)
+        name = 'file%d.tmp' % i if i % 10 == 0 else 'file%d.txt' % i
+        with open(os.path.join(dirpath, name), 'wb') as f:
+            f.write(b'%d' % i)
+    os.makedirs(os.path.join(path, 'build'))
+    for i in range(files // 10):
+        with open(os.path.join(path, 'build', 'out%d' % i), 'wb') as f:
+            f.write(b'%d' % i)
+
+
+async def make_drop_metadata(
+    files: int, private_key: crypto_util.rsa.RSAPrivateKey,
+) -> DropMetadata:
+    owner = await crypto_util.node_id_from_private_key(private_key)
+    dm = DropMetadata(
+        drop_id=gen_drop_id(owner), name='bench', version=DropVersion(1, 1),
+        previous_versions=[], primary_owner=owner, other_owners={},
+        signed_by=owner, files={
+            'dir%d/file%d.txt' % (i // 50, i): os.urandom(32)
+            for i in range(files)
+        },
+    )
+    dm.sig = await crypto_util.sign_dictionary(
+        private_key, await dm.unsigned_header,
+    )
+    return dm
+
+
+def run(seconds: float, files: int, size: int) -> Dict[str, float]:
+    """
+    Run the benchmark
+
+    :param seconds: How long to run each measurement for
+    :param files: Number of files in the drop
+    :param size: Size of the file to read, write and make metadata of, in MiB
+    :return: Operations per second, or MB per second for the ones on files
+    """
+    # log calls still cost a level check, but nothing is written
+    logging.disable(logging.INFO)
+    loop = asyncio.get_event_loop()
+    results = {}  # type: Dict[str, float]
+    mb = size * 2**20 / 1e6
+
+    chunk = os.urandom(DEFAULT_CHUNK_SIZE)
+    results['hash_chunk_mb_per_s'] = rate(
+        lambda: crypto_util.hash(chunk), seconds,
+    ) * len(chunk) / 1e6
+
+    private_key = crypto_util._generate_private_key()
+    dm = loop.run_until_complete(make_drop_metadata(files, private_key))
+    header = loop.run_until_complete(dm.unsigned_header)
+    results['hash_dict_files_per_s'] = rate(
+        lambda: crypto_util.hash_dict(dm.files), seconds,
+    )
+    results['sign_dictionary_per_s'] = rate(
+        lambda: crypto_util.sign_dictionary(private_key, header), seconds,
+    )
+    public_key = private_key.public_key()
+    signature = loop.run_until_complete(
+        crypto_util.sign_dictionary(private_key, header),
+    )
+    results['verify_signed_dictionary_per_s'] = rate(
+        lambda: crypto_util.verify_signed_dictionary(
+            public_key, signature, header,
+        ),
+        seconds,
+    )
+
+    async def get_pub_key(node_id: bytes) -> crypto_util.rsa.RSAPublicKey:
+        return public_key
+
+    encoded = loop.run_until_complete(dm.encode())
+    with mock.patch(
+        'syncr_backend.metadata.drop_metadata.get_pub_key', new=get_pub_key,
+    ), mock.patch(
+        'syncr_backend.metadata.drop_metadata.get_node_journal',
+        return_value=None,
+    ):
+        results['drop_metadata_decode_per_s'] = rate(
+            lambda: DropMetadata.decode(encoded, reverify=True), seconds,
+        )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'file')
+        data = random.Random(0).getrandbits(size * 2**23).to_bytes(
+            size * 2**20, 'little',
+        )
+        chunks = [
+            data[i:i + DEFAULT_CHUNK_SIZE]
+            for i in range(0, len(data), DEFAULT_CHUNK_SIZE)
+        ]
+        hashes = [crypto_util._hash(c) for c in chunks]
+        loop.run_until_complete(fileio_util.create_file(path, len(data)))
+
+        async def write_chunks() -> None:
+            for (i, (c, h)) in enumerate(zip(chunks, hashes)):
+                await fileio_util.write_chunk(path, i, c, h)
+
+        async def read_chunks() -> None:
+            for (i, h) in enumerate(hashes):
+                await fileio_util.read_chunk(path, i, h)
+
+        results['write_chunk_mb_per_s'] = rate(write_chunks, seconds) * mb
+        fileio_util.mark_file_complete(path)
+        results['read_chunk_mb_per_s'] = rate(read_chunks, seconds) * mb
+        results['make_file_metadata_mb_per_s'] = rate(
+            lambda: make_file_metadata(path, dm.id), seconds,
+        ) * mb
+        results['make_file_metadata_cdc_mb_per_s'] = rate(
+            lambda: make_file_metadata(
+                path, dm.id, protocol_version=CDC_PROTOCOL_VERSION,
+            ),
+            seconds,
+        ) * mb
+
+        drop = os.path.join(tmp, 'drop')
+        make_drop(drop, files)
+
+        async def walk() -> None:
+            for _ in fileio_util.walk_with_ignore(drop, ['*.tmp', 'build']):
+                pass
+
+        results['walk_with_ignore_files_per_s'] = rate(walk, seconds) * files
+
+    async def plain(x: int) -> int:
+        return x
+
+    cached = async_cache(maxsize=16)(plain)
+    results['async_call_per_s'] = rate(lambda: plain(1), seconds)
+    results['async_cache_hit_per_s'] = rate(lambda: cached(1), seconds)
+    return results
+
+
+def main() -> None:
+    args = parser().parse_args()
+    results = run(args.seconds, args.files, args.size)
+    for (name, value) in sorted(results.items()):
+        print("{}: {:.0f}".format(name, value))
+
+
+if __name__ == '__main__':
+    main()
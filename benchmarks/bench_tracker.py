@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""Load test a tracker
+
+Simulated nodes announce their drops to a tracker and look up peers, once
+with one request per connection, then pipelined on persistent connections,
+then with bulk POST_PEERS requests.  Without --ip and --port, a tracker is
+started in this process.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+from typing import Any
+from typing import Dict
+from typing import List  # noqa
+from typing import Optional  # noqa
+
+from syncr_backend.constants import TRACKER_MAX_PENDING_REQUESTS
+from syncr_backend.constants import TrackerRequest
+from syncr_backend.external_interface.drop_peer_store import TrackerPeerStore
+from syncr_backend.external_interface.tracker_server import \
+    start_tracker_server
+from syncr_backend.external_interface.tracker_server import TrackerStorage
+from syncr_backend.external_interface.tracker_util import \
+    send_request_to_tracker
+from syncr_backend.external_interface.tracker_util import TrackerClient
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--ip", type=str, help="IP of a running tracker to test",
+    )
+    parser.add_argument(
+        "--port", type=int, help="Port of a running tracker to test",
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=10, help="Number of simulated nodes",
+    )
+    parser.add_argument(
+        "--drops", type=int, default=1000, help="Number of drops per node",
+    )
+    return parser
+
+
+def _post_peer(drop_id: bytes, node_id: bytes, port: int) -> Dict[str, Any]:
+    return {
+        'request_type': int(TrackerRequest.POST_PEER),
+        'drop_id': drop_id,
+        'data': [node_id, '10.0.0.1', port],
+    }
+
+
+async def run_async(
+    nodes: int, drops: int, ip: Optional[str]=None, port: Optional[int]=None,
+) -> Dict[str, float]:
+    """
+    Run the load test
+
+    :param nodes: Number of simulated nodes
+    :param drops: Number of drops per node
+    :param ip: IP of the tracker, or None to start one
+    :param port: Port of the tracker, or None to start one
+    :return: Requests or announcements per second of each phase
+    """
+    server = None
+    if ip is None or port is None:
+        server = await start_tracker_server('127.0.0.1', 0, TrackerStorage())
+        (ip, port) = server.sockets[0].getsockname()[:2]  # type: ignore
+
+    node_ids = [hashlib.sha256(os.urandom(32)).digest() for _ in range(nodes)]
+    drop_ids = [
+        [os.urandom(64) for _ in range(drops)] for _ in range(nodes)
+    ]  # type: List[List[bytes]]
+    total = nodes * drops
+    results = {}  # type: Dict[str, float]
+
+    semaphore = asyncio.Semaphore(TRACKER_MAX_PENDING_REQUESTS)
+
+    async def one_shot(request: Dict[str, Any]) -> None:
+        async with semaphore:
+            await send_request_to_tracker(request, ip, port)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            one_shot(_post_peer(drop_id, node_id, n))
+            for (n, node_id) in enumerate(node_ids)
+            for drop_id in drop_ids[n]
+        ]
+    )
+    results['one_shot_post_peer_per_s'] = \
+        total / (time.perf_counter() - start)
+
+    clients = [TrackerClient(ip, port) for _ in range(nodes)]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            clients[n].request(_post_peer(drop_id, node_id, n))
+            for (n, node_id) in enumerate(node_ids)
+            for drop_id in drop_ids[n]
+        ]
+    )
+    results['pipelined_post_peer_per_s'] = \
+        total / (time.perf_counter() - start)
+
+    stores = [
+        TrackerPeerStore(node_id, ip, port) for node_id in node_ids
+    ]
+    start = time.perf_counter()
+    added = await asyncio.gather(
+        *[
+            store.add_drop_peers(drop_ids[n], '10.0.0.2', n)
+            for (n, store) in enumerate(stores)
+        ]
+    )
+    assert sum(added) == total
+    results['bulk_post_peers_per_s'] = total / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            stores[n].request_peers(drop_id)
+            for n in range(nodes)
+            for drop_id in drop_ids[n]
+        ]
+    )
+    results['pipelined_get_peers_per_s'] = \
+        total / (time.perf_counter() - start)
+
+    for client in clients:
+        client.close()
+    for store in stores:
+        store.client.close()
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    return results
+
+
+def run(nodes: int, drops: int) -> Dict[str, float]:
+    """Run the load test against a tracker in this process"""
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(run_async(nodes, drops))
+
+
+def main() -> None:
+    args = parser().parse_args()
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(
+        run_async(args.nodes, args.drops, args.ip, args.port),
+    )
+    for (name, value) in sorted(results.items()):
+        print("{}: {:.0f}".format(name, value))
+
+
+if __name__ == '__main__':
+    main()
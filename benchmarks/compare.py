@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""Run benchmark suites and compare the results with a stored baseline
+
+A suite is a module in benchmarks/ whose run() takes the options of its
+parser(); each is run --repeat times with its default options, and each
+result is the median of the runs.  How far apart the runs were is kept as
+the noise of the result.  Results named ``*per_s`` are better when higher,
+and all others when lower.  A result that is worse than the baseline by
+more than --threshold, and by more than its noise in the baseline or in
+this run, is reported as a regression.
+
+Baselines depend on the machine they were made on, so none is kept in the
+repository: make one with --save on a quiet machine before changing the
+code, then compare with it.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+#: Suites run by default
+SUITES = ['bench_bencode', 'bench_primitives']
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+#: Results of the same code on a shared machine were up to 45% apart, even
+#: as medians of repeated runs, so smaller changes are not reported by default
+DEFAULT_THRESHOLD = 0.5
+
+Results = Dict[str, Dict[str, float]]
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--suite", action='append', choices=SUITES,
+        help="Suite to run, can be given more than once (default: all)",
+    )
+    parser.add_argument(
+        "--baseline", type=str, default=DEFAULT_BASELINE,
+        help="Baseline to compare with, or to save to",
+    )
+    parser.add_argument(
+        "--save", action='store_true',
+        help="Save the results of the suites run into the baseline",
+    )
+    parser.add_argument(
+        "--output", type=str, help="Also write the results to this file",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="Fraction worse than the baseline that is a regression, if it "
+        "is also more than the noise",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="Number of times to run each suite",
+    )
+    parser.add_argument(
+        "--fail", action='store_true',
+        help="Exit with an error if there are regressions",
+    )
+    return parser
+
+
+def environment() -> Dict[str, str]:
+    """What the results depend on besides the code"""
+    return {
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'system': platform.system(),
+    }
+
+
+def run_suite(
+    name: str, repeat: int=1,
+) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """
+    Run a suite with its default options
+
+    :param name: The suite's module in benchmarks/
+    :param repeat: Number of times to run it
+    :return: The median of each result, and how far apart the runs were as \
+            a fraction of it
+    """
+    module = importlib.import_module('benchmarks.%s' % name)
+    args = module.parser().parse_args([])  # type: ignore
+    runs = [
+        module.run(**vars(args)) for _ in range(repeat)  # type: ignore
+    ]  # type: List[Dict[str, float]]
+    results = {}
+    noise = {}
+    for key in runs[0]:
+        values = [r[key] for r in runs]
+        median = statistics.median(values)
+        results[key] = round(median, 2)
+        noise[key] = round(
+            (max(values) - min(values)) / median if median else 0.0, 3,
+        )
+    return (results, noise)
+
+
+def higher_is_better(name: str) -> bool:
+    return name.endswith('per_s')
+
+
+def compare(
+    baseline: Dict[str, float], results: Dict[str, float], threshold: float,
+    noise: Optional[Dict[str, float]]=None,
+) -> List[Tuple[str, bool]]:
+    """
+    Compare the results of a suite with its baseline
+
+    >>> from benchmarks.compare import compare
+    >>> compare({'a_per_s': 100, 'b_bytes': 10}, {'a_per_s': 50}, 0.2)
+    [('a_per_s: 100 -> 50 (-50.0%) REGRESSION', True)]
+    >>> compare({'a_per_s': 100}, {'a_per_s': 50}, 0.2, {'a_per_s': 0.6})
+    [('a_per_s: 100 -> 50 (-50.0%) within noise', False)]
+
+    :param baseline: The baseline results
+    :param results: The new results
+    :param threshold: Fraction worse than the baseline that is a regression
+    :param noise: How much each result varies, as a fraction; a result \
+            must be worse by more than this to be a regression
+    :return: A report line for each result, and whether it regressed
+    """
+    report = []
+    for (name, value) in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            report.append(("{}: {:.0f} (new)".format(name, value), False))
+            continue
+        change = (value - old) / old if old else 0.0
+        worse = -change if higher_is_better(name) else change
+        noisy = worse <= (noise or {}).get(name, 0.0)
+        regressed = worse > threshold and not noisy
+        line = "{}: {:.0f} -> {:.0f} ({:+.1%})".format(
+            name, old, value, change,
+        )
+        if regressed:
+            line += " REGRESSION"
+        elif worse > threshold:
+            line += " within noise"
+        elif -worse > threshold:
+            line += " improved"
+        report.append((line, regressed))
+    return report
+
+
+def load(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {'environment': {}, 'results': {}}
+    data.setdefault('noise', {})
+    return data
+
+
+def dump(data: Dict[str, Any], path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main() -> None:
+    args = parser().parse_args()
+    results = {}  # type: Results
+    noise = {}  # type: Results
+    for name in args.suite or SUITES:
+        (results[name], noise[name]) = run_suite(name, args.repeat)
+    current = {
+        'environment': environment(), 'results': results, 'noise': noise,
+    }
+    if args.output:
+        dump(current, args.output)
+
+    stored = load(args.baseline)
+    if args.save:
+        stored['environment'] = current['environment']
+        stored['results'].update(results)
+        stored['noise'].update(noise)
+        dump(stored, args.baseline)
+        print("saved baseline to {}".format(args.baseline))
+        return
+    if not stored['results']:
+        print(
+            "no baseline in {}, make one with --save first".format(
+                args.baseline,
+            ),
+        )
+        return
+
+    if stored['environment'] != current['environment']:
+        print(
+            "baseline was made on {}, results may not be comparable".format(
+                stored['environment'] or "nothing",
+            ),
+        )
+    regressions = 0
+    for (name, suite_results) in sorted(results.items()):
+        print(name)
+        suite_noise = {
+            key: max(value, stored['noise'].get(name, {}).get(key, 0.0))
+            for (key, value) in noise[name].items()
+        }
+        report = compare(
+            stored['results'].get(name, {}), suite_results, args.threshold,
+            suite_noise,
+        )
+        for (line, regressed) in report:
+            print("  " + line)
+            regressions += regressed
+    print("{} regressions".format(regressions))
+    if args.fail and regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,9 +23,11 @@ setup(
             'sync_drop = syncr_backend.bin.sync_drop:main',
             'make_dht_configs = syncr_backend.bin.make_dht_configs:main',
             'make_tracker_configs = syncr_backend.bin.make_tracker_configs:main',  # noqa
+            'metadata_store = syncr_backend.bin.metadata_store:main',
             'node_init = syncr_backend.bin.node_init:main',
             'run_backend = syncr_backend.bin.run_backend:run_backend',
             'run_dht_server = syncr_backend.bin.run_dht_server:main',
+            'run_tracker = syncr_backend.bin.run_tracker:main',
             'new_version = syncr_backend.bin.new_version:main',
             'update_drop = syncr_backend.bin.update_drop:main',
             'check_for_updates = syncr_backend.bin.check_for_updates:main',
@@ -98,4 +100,8 @@ setup(
         "urllib3==1.22",
         "virtualenv==15.2.0",
     ],
+    extras_require={
+        # compress responses between nodes with zstd as well as zlib
+        'zstd': ["zstandard==0.9.1"],
+    },
 )
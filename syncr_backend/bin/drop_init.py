@@ -4,6 +4,8 @@ import asyncio
 import os
 import sys
 
+from syncr_backend.constants import CDC_PROTOCOL_VERSION
+from syncr_backend.constants import FIXED_CHUNKS_PROTOCOL_VERSION
 from syncr_backend.init import drop_init
 
 
@@ -17,6 +19,13 @@ def parser() -> argparse.ArgumentParser:
         type=str,
         help="Directory to create a drop from",
     )
+    parser.add_argument(
+        "--content-defined-chunks",
+        action="store_true",
+        help="Split files into chunks by their contents, so edits to large "
+        "files only change the chunks around them.  Needs every node syncing "
+        "the drop to support file metadata protocol version 2",
+    )
     return parser
 
 
@@ -25,7 +34,13 @@ def main() -> None:
 
     loop = asyncio.get_event_loop()
     path = os.path.abspath(args.directory)
-    id = loop.run_until_complete(drop_init.initialize_drop(path))
+    if args.content_defined_chunks:
+        file_protocol_version = CDC_PROTOCOL_VERSION
+    else:
+        file_protocol_version = FIXED_CHUNKS_PROTOCOL_VERSION
+    id = loop.run_until_complete(
+        drop_init.initialize_drop(path, file_protocol_version),
+    )
     sys.stdout.write("%s" % id.decode('utf-8'))
     sys.stdout.flush()
 
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import argparse
+import asyncio
+import os
+from typing import List
+from typing import Optional  # noqa
+
+from syncr_backend.constants import DEFAULT_INIT_DIR
+from syncr_backend.metadata import metadata_store
+from syncr_backend.metadata.drop_metadata import get_drop_location
+from syncr_backend.metadata.drop_metadata import list_drops
+from syncr_backend.util import crypto_util
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Manage where this node stores drop and file metadata. "
+        "'import' copies metadata from the file layout into sqlite, 'export' "
+        "copies it from sqlite back to the file layout, and 'use' converts "
+        "every drop then switches the node to a backend.",
+    )
+    parser.add_argument(
+        "action",
+        type=str,
+        choices=['import', 'export', 'use'],
+        help="What to do",
+    )
+    parser.add_argument(
+        "store_type",
+        type=str,
+        nargs='?',
+        choices=sorted(metadata_store.STORE_TYPES),
+        help="Backend to switch to, for 'use'",
+    )
+    parser.add_argument(
+        "--drop_id",
+        type=str,
+        required=False,
+        help="Only import or export this drop, instead of every drop",
+    )
+    return parser
+
+
+async def convert_drops(
+    src_type: str, dst_type: str, drop_ids: List[bytes],
+) -> None:
+    """
+    Copy the metadata of some drops from one backend to another
+
+    :param src_type: The store type to copy from
+    :param dst_type: The store type to copy to
+    :param drop_ids: The drops to copy
+    """
+    for drop_id in drop_ids:
+        metadata_dir = os.path.join(
+            await get_drop_location(drop_id), DEFAULT_INIT_DIR,
+        )
+        src = metadata_store.make_metadata_store(metadata_dir, src_type)
+        dst = metadata_store.make_metadata_store(metadata_dir, dst_type)
+        try:
+            count = await metadata_store.copy_metadata(src, dst)
+        finally:
+            src.close()
+            dst.close()
+        print(
+            "Copied {} items of {} from {} to {}".format(
+                count, crypto_util.b64encode(drop_id).decode('utf-8'),
+                src_type, dst_type,
+            ),
+        )
+
+
+def main() -> None:
+    args = parser().parse_args()
+    loop = asyncio.get_event_loop()
+
+    drop_ids = list_drops()
+    if args.drop_id:
+        drop_ids = [crypto_util.b64decode(args.drop_id.encode('utf-8'))]
+
+    store_type = None  # type: Optional[str]
+    if args.action == 'import':
+        (src_type, dst_type) = (
+            metadata_store.FILE_STORE, metadata_store.SQLITE_STORE,
+        )
+    elif args.action == 'export':
+        (src_type, dst_type) = (
+            metadata_store.SQLITE_STORE, metadata_store.FILE_STORE,
+        )
+    else:
+        store_type = args.store_type
+        if store_type is None:
+            print("A store type must be given")
+            exit(1)
+        (src_type, dst_type) = (metadata_store.get_store_type(), store_type)
+
+    if src_type != dst_type:
+        loop.run_until_complete(convert_drops(src_type, dst_type, drop_ids))
+    if store_type is not None:
+        metadata_store.set_store_type(store_type)
+        print("This node now uses the {} metadata store".format(store_type))
+
+
+if __name__ == '__main__':
+    main()
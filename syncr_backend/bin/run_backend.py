@@ -4,7 +4,10 @@ import asyncio
 import threading
 from typing import List
 
+from syncr_backend.constants import MAX_STORED_PEERS
+from syncr_backend.external_interface.dht_util import get_dht_state_path
 from syncr_backend.external_interface.dht_util import initialize_dht
+from syncr_backend.external_interface.dht_util import shutdown_dht
 from syncr_backend.external_interface.drop_peer_store import send_drops_to_dps
 from syncr_backend.init import drop_init
 from syncr_backend.init import node_init
@@ -14,6 +17,7 @@ from syncr_backend.network.listen_requests import start_listen_server
 from syncr_backend.network.send_requests import set_my_ip
 from syncr_backend.util import crypto_util
 from syncr_backend.util import drop_util
+from syncr_backend.util import watch_util
 from syncr_backend.util.fileio_util import load_config_file
 from syncr_backend.util.log_util import get_logger
 # from syncr_backend.network import send_requests
@@ -58,6 +62,12 @@ def parser() -> argparse.ArgumentParser:
         type=str,
         help="Command file to send debug commands",
     )
+    input_args_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Watch drops for local changes instead of rescanning them "
+        "every time they are checked",
+    )
     return input_args_parser
 
 
@@ -78,6 +88,7 @@ def run_backend() -> None:
     loop = asyncio.get_event_loop()
 
     set_my_ip(ext_addr, ext_port)
+    loop.run_until_complete(node_init.load_identity())
 
     # initilize dht
     config_file = loop.run_until_complete(load_config_file())
@@ -88,10 +99,17 @@ def run_backend() -> None:
                 config_file['bootstrap_ports'],
             ),
         )
-        initialize_dht(ip_port_list, config_file['listen_port'])
+        initialize_dht(
+            ip_port_list, config_file['listen_port'],
+            int(config_file.get('max_stored_peers', MAX_STORED_PEERS)),
+            get_dht_state_path(config_file['listen_port']),
+        )
 
     loop.create_task(send_my_pub_key())
 
+    if arguments.watch:
+        watch_util.enable_watching()
+
     shutdown_flag = threading.Event()
     listen_server = loop.run_until_complete(
         start_listen_server(arguments.ip[0], arguments.port[0]),
@@ -123,6 +141,8 @@ def run_backend() -> None:
         frontend_server.close()
         dps_send.cancel()
         sync_processor.cancel()
+        shutdown_dht()
+        watch_util.stop_watching()
         loop.run_until_complete(loop.shutdown_asyncgens())
         loop.stop()
         loop.close()
@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 import argparse
 import asyncio
+import os
 from typing import List  # NOQA
+from typing import Optional  # NOQA
 
+from syncr_backend.constants import MAX_STORED_PEERS
+from syncr_backend.external_interface.dht_util import get_dht_state_path
 from syncr_backend.external_interface.dht_util import initialize_dht
+from syncr_backend.external_interface.dht_util import shutdown_dht
 
 
 def parser() -> argparse.ArgumentParser:
@@ -25,6 +30,26 @@ def parser() -> argparse.ArgumentParser:
             'Usage: --bootstrap-peers ip:port,ip2:port2,...'
         ),
     )
+    parser.add_argument(
+        "--max-stored-peers",
+        type=int,
+        default=MAX_STORED_PEERS,
+        help="Most peers of a drop to store",
+    )
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        help=(
+            "Where to save the node's storage and routing table, and "
+            "restore them from on start.  Defaults to a file in the init "
+            "directory named after the port"
+        ),
+    )
+    parser.add_argument(
+        "--no-state",
+        action="store_true",
+        help="Do not save or restore the node's state",
+    )
     return parser
 
 
@@ -45,9 +70,23 @@ def main() -> None:
             exit(1)
 
     bootstrap_list = list(zip(iplist, portlist))
-    initialize_dht(bootstrap_list, args.port[0])
+    state_path = None  # type: Optional[str]
+    if not args.no_state:
+        state_path = args.state_file or get_dht_state_path(args.port[0])
+        os.makedirs(
+            os.path.dirname(os.path.abspath(state_path)), exist_ok=True,
+        )
+
+    initialize_dht(
+        bootstrap_list, args.port[0], args.max_stored_peers, state_path,
+    )
     loop = asyncio.get_event_loop()
-    loop.run_forever()
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_dht()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+import argparse
+import asyncio
+
+from syncr_backend.constants import MAX_STORED_PEERS
+from syncr_backend.constants import TRACKER_DROP_AVAILABILITY_TTL
+from syncr_backend.external_interface.tracker_server import \
+    start_tracker_server
+from syncr_backend.external_interface.tracker_server import TrackerStorage
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Run a tracker, keeping public keys and drop peers in "
+        "memory",
+    )
+    parser.add_argument(
+        "ip",
+        type=str,
+        help="IP to listen on",
+    )
+    parser.add_argument(
+        "port",
+        type=int,
+        help="Port to listen on",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=int,
+        default=TRACKER_DROP_AVAILABILITY_TTL,
+        help="Seconds to keep a peer after it announces a drop",
+    )
+    parser.add_argument(
+        "--max-stored-peers",
+        type=int,
+        default=MAX_STORED_PEERS,
+        help="Most peers of a drop to keep",
+    )
+    return parser
+
+
+def main() -> None:
+    args = parser().parse_args()
+    loop = asyncio.get_event_loop()
+    storage = TrackerStorage(args.ttl, args.max_stored_peers)
+    server = loop.run_until_complete(
+        start_tracker_server(args.ip, args.port, storage),
+    )
+    print("Tracker listening on {}:{}".format(args.ip, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+
+
+if __name__ == '__main__':
+    main()
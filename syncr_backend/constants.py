@@ -14,6 +14,7 @@ class TrackerRequest(IntEnum):
     POST_KEY = 1  #: Add a key
     GET_PEERS = 2  #: Geet peers
     POST_PEER = 3  #: Add a peer
+    POST_PEERS = 4  #: Add a peer to many drops
 
     def __str__(self) -> str:
         return str(self.name)
@@ -28,6 +29,21 @@ TRACKER_DROP_TIMESTAMP_INDEX = 3
 
 #: TTL for drops in the DPS.  Also used for other TTLs throughout the code
 TRACKER_DROP_AVAILABILITY_TTL = 300
+#: Most peers of a drop for a DHT node to store.  Can be overridden with
+#: ``max_stored_peers`` in the dps config
+MAX_STORED_PEERS = 64
+#: Most peers of a drop to try when syncing.  Can be overridden with
+#: ``max_returned_peers`` in the dps config
+MAX_RETURNED_PEERS = 16
+#: How often a DHT node saves its storage and routing table, in seconds
+DHT_SNAPSHOT_INTERVAL = 60
+#: Maximum number of drops to announce in one POST_PEERS request
+TRACKER_MAX_DROPS_PER_REQUEST = 512
+#: Maximum number of one-shot tracker requests to have pending at a time
+TRACKER_MAX_PENDING_REQUESTS = 32
+#: Seconds to wait for a tracker to answer the first request on a persistent
+#: connection, before assuming it only takes one request per connection
+TRACKER_PROBE_TIMEOUT = 5
 # Tracker server result responses
 TRACKER_OK_RESULT = 'OK'  #: OK text response from tracker
 TRACKER_ERROR_RESULT = 'ERROR'  #: Error text response from tracker
@@ -41,8 +57,29 @@ DEFAULT_PUB_KEY_LOOKUP_LOCATION = "pub_keys"
 DEFAULT_PKS_CONFIG_FILE = "PublicKeyStore.config"
 #: DPS config file name (in init dir)
 DEFAULT_DPS_CONFIG_FILE = "DropPeerStore.config"
-#: Location of metadata lookup dir (in init dir)
+#: Metadata store config file name (in init dir)
+DEFAULT_METADATA_STORE_CONFIG_FILE = "MetadataStore.config"
+#: Location of the old one file per drop location lookup dir (in init dir).
+#: Only read to migrate to DEFAULT_DROP_LOCATIONS_FILE
 DEFAULT_METADATA_LOOKUP_LOCATION = "drops"
+#: Journal of drop locations (in init dir)
+DEFAULT_DROP_LOCATIONS_FILE = "drops.journal"
+#: Journal of drop metadata whose signature was verified (in init dir)
+DEFAULT_VERIFIED_METADATA_FILE = "verified_metadata.journal"
+#: Ledger of drop versions whose whole history was verified (in init dir)
+DEFAULT_VERIFIED_VERSIONS_FILE = "verified_versions.journal"
+#: Ledger of the last drop version each drop was completely synced to, and
+#: whose timestamp file was written then (in init dir)
+DEFAULT_SYNCED_VERSIONS_FILE = "synced_versions.journal"
+#: Snapshot of a DHT node's storage and routing table (in init dir).  Takes
+#: the node's listen port
+DEFAULT_DHT_STATE_FILE = "dht_{}.state"
+#: Index of where chunks are on disk, shared by every drop (in init dir)
+DEFAULT_CHUNK_INDEX_FILE = "chunks.sqlite"
+#: Number of chunks the chunk index's Bloom filter is sized for at first
+CHUNK_INDEX_BLOOM_CAPACITY = 2**16
+#: False positive rate of the chunk index's Bloom filter
+CHUNK_INDEX_BLOOM_ERROR_RATE = 0.01
 
 # file_metadata constants
 DEFAULT_CHUNK_SIZE = 2**23  #: Default chunk size. Don't change this
@@ -50,15 +87,28 @@ DEFAULT_CHUNK_SIZE = 2**23  #: Default chunk size. Don't change this
 DEFAULT_FILE_METADATA_LOCATION = os.path.join(DEFAULT_INIT_DIR, "files")
 #: directory of drop metadata files in the drop
 DEFAULT_DROP_METADATA_LOCATION = os.path.join(DEFAULT_INIT_DIR, "drop")
+#: database of drop and file metadata in the drop, if the node uses sqlite
+DEFAULT_METADATA_DB_LOCATION = os.path.join(
+    DEFAULT_INIT_DIR, "metadata.sqlite",
+)
 #: filename of timestamp file that detects updates
 DEFAULT_TIMESTAMP_LOCATION = os.path.join(DEFAULT_INIT_DIR, "timestamp")
+#: directory in the drop holding the previous contents of files being updated
+DEFAULT_OLD_FILES_LOCATION = os.path.join(DEFAULT_INIT_DIR, "old")
 
 #: Default set of files/folders to ignore when creating/updating a drop
 DEFAULT_IGNORE = [DEFAULT_INIT_DIR]
+#: File in a drop with more patterns to ignore, one per line
+DEFAULT_IGNORE_FILE = ".syncrignore"
 
 # File constants
 DEFAULT_INCOMPLETE_EXT = ".part"  #: Extension to add to incomplete files
 
+# Change detection
+#: How often drops are rescanned for changes when inotify is not available,
+#: in seconds
+WATCH_POLL_INTERVAL = 2
+
 # Request types
 # TODO: make an enum
 REQUEST_TYPE_DROP_METADATA = 1
@@ -68,7 +118,33 @@ REQUEST_TYPE_CHUNK = 4
 REQUEST_TYPE_NEW_DROP_METADATA = 5
 
 #: The protocol version; not currently well used
-PROTOCOL_VERSION = 1
+PROTOCOL_VERSION = 2
+#: Protocol version from which requests can ask for compressed responses,
+#: with ``accept_encoding``
+COMPRESSION_PROTOCOL_VERSION = 2
+#: Responses shorter than this are never compressed
+COMPRESSION_MIN_SIZE = 1024
+#: Bytes of a response compressed first, to guess whether the rest is worth
+#: compressing
+COMPRESSION_SAMPLE_SIZE = 2**16
+#: Responses that do not compress to less than this fraction of their size
+#: are sent uncompressed
+COMPRESSION_MAX_RATIO = 0.9
+#: Largest decompressed response to accept
+MAX_DECOMPRESSED_SIZE = 2**26
+
+# File metadata protocol versions
+#: Files are split into chunks of DEFAULT_CHUNK_SIZE
+FIXED_CHUNKS_PROTOCOL_VERSION = 1
+#: Files are split into content-defined chunks, whose lengths are in the file
+#: metadata
+CDC_PROTOCOL_VERSION = 2
+#: Smallest content-defined chunk, except the last chunk of a file
+CDC_MIN_CHUNK_SIZE = 2**18
+#: Average content-defined chunk to aim for
+CDC_AVG_CHUNK_SIZE = 2**20
+#: Largest content-defined chunk
+CDC_MAX_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
 
 # Errnos
 # TODO: make an enum
@@ -77,6 +153,12 @@ ERR_INCOMPAT = 1
 ERR_INVINPUT = 2
 ERR_EXCEPTION = 3
 
+# Caches
+#: Number of parsed public keys to keep in memory
+PUB_KEY_CACHE_SIZE = 1024
+#: How long to remember that a public key could not be found, in seconds
+MISSING_PUB_KEY_TTL = 30
+
 # Concurrency
 #: Maximum number of files to download at once
 MAX_CONCURRENT_FILE_DOWNLOADS = 4
@@ -84,6 +166,10 @@ MAX_CONCURRENT_FILE_DOWNLOADS = 4
 MAX_CHUNKS_PER_PEER = 8
 #: Maximum number of chunks to download at a time per file
 MAX_CONCURRENT_CHUNK_DOWNLOADS = 8
+#: Maximum number of drops to announce to the dps at a time
+MAX_CONCURRENT_ANNOUNCEMENTS = 8
+#: Maximum number of directories to scan at a time when looking for changes
+MAX_CONCURRENT_SCANS = 4
 
 
 class StrEnum(str, Enum):
@@ -1,14 +1,24 @@
 import asyncio
+import heapq
+import itertools
+import os
+import pickle
 import time
 from typing import Any
 from typing import Dict  # NOQA
+from typing import Iterator
 from typing import List
+from typing import Optional
 from typing import Tuple
 
 from kademlia.network import Server  # type: ignore
 from kademlia.storage import ForgetfulStorage  # type: ignore
 
+from syncr_backend.constants import DEFAULT_DHT_STATE_FILE
+from syncr_backend.constants import DHT_SNAPSHOT_INTERVAL
+from syncr_backend.constants import MAX_STORED_PEERS
 from syncr_backend.constants import TRACKER_DROP_AVAILABILITY_TTL
+from syncr_backend.init.node_init import get_full_init_directory
 from syncr_backend.util import crypto_util
 from syncr_backend.util.log_util import get_logger
 
@@ -16,6 +26,11 @@ from syncr_backend.util.log_util import get_logger
 logger = get_logger(__name__)
 
 _node_instance = None
+_state_path = None  # type: Optional[str]
+_bootstrap_task = None  # type: Optional[asyncio.Future]
+
+#: Version of the DHT state snapshot format
+DHT_STATE_VERSION = 1
 
 
 def get_dht() -> Server:
@@ -31,32 +46,175 @@ def get_dht() -> Server:
     return _node_instance
 
 
+def get_dht_state_path(listen_port: int) -> str:
+    """
+    Where a DHT node listening on a port keeps its snapshot
+
+    :param listen_port: port the node listens on
+    :return: The path of the snapshot, in the init directory
+    """
+    return os.path.join(
+        get_full_init_directory(None),
+        DEFAULT_DHT_STATE_FILE.format(listen_port),
+    )
+
+
 def initialize_dht(
     bootstrap_ip_port_pair_list: List[Tuple[str, int]],
     listen_port: int,
+    max_peers: int=MAX_STORED_PEERS,
+    state_path: Optional[str]=None,
 ) -> None:
     """
     connects to the distributed hash table
     if no bootstrap ip port pair list is given, it starts a new dht
 
+    If state_path is given, the node's id, storage and neighbors are
+    restored from it if it exists, and saved to it every
+    DHT_SNAPSHOT_INTERVAL seconds.  Bootstrapping happens in the background,
+    so the node serves what it has right away.
+
     :param bootstrap_ip_port_pair_list: list of ip port tuples to connect to \
             the dht
     :param listen_port: port to listen on
-    :return: instance of server
+    :param max_peers: most peers to store for each drop
+    :param state_path: where to keep snapshots of the node
     """
-    global _node_instance
+    global _node_instance, _state_path, _bootstrap_task
 
     get_logger("kademlia")
 
     logger.debug("set up DHT: %s", str(bootstrap_ip_port_pair_list))
 
-    node = Server(storage=DropPeerDHTStorage())
+    storage = DropPeerDHTStorage(max_peers=max_peers)
+    bootstrap_list = list(bootstrap_ip_port_pair_list)
+    state = load_dht_state(state_path) if state_path is not None else None
+    if state is not None:
+        storage.restore(state['storage'])
+        node = Server(
+            ksize=state['ksize'], alpha=state['alpha'], node_id=state['id'],
+            storage=storage,
+        )
+        bootstrap_list.extend(
+            tuple(addr) for addr in state['neighbors']
+            if tuple(addr) not in bootstrap_list
+        )
+    else:
+        node = Server(storage=storage)
     node.listen(listen_port)
-    loop = asyncio.get_event_loop()
-    if len(bootstrap_ip_port_pair_list) > 0:
-        loop.run_until_complete(node.bootstrap(bootstrap_ip_port_pair_list))
+    _bootstrap_task = None
+    if len(bootstrap_list) > 0:
+        _bootstrap_task = asyncio.ensure_future(
+            bootstrap_dht(node, bootstrap_list),
+        )
 
     _node_instance = node
+    _state_path = state_path
+    if state_path is not None:
+        # Server.stop cancels this
+        node.save_state_loop = asyncio.ensure_future(
+            save_dht_state_regularly(node, state_path),
+        )
+
+
+async def bootstrap_dht(node: Server, addrs: List[Tuple[str, int]]) -> None:
+    """
+    Bootstrap a DHT node, logging instead of raising if it fails
+
+    :param node: The DHT node
+    :param addrs: ip port tuples of nodes to bootstrap from
+    """
+    try:
+        found = await node.bootstrap(addrs)
+    except Exception as e:
+        logger.warning("DHT bootstrap failed: %s", e)
+    else:
+        logger.info("DHT bootstrapped, found %s nodes", len(found))
+
+
+async def wait_for_bootstrap() -> None:
+    """Wait until the DHT node has tried to bootstrap, if it is still trying
+    """
+    if _bootstrap_task is not None:
+        await asyncio.shield(_bootstrap_task)
+
+
+def save_dht_state(node: Server, path: str) -> None:
+    """
+    Save a snapshot of a DHT node's id, storage and neighbors
+
+    :param node: The DHT node
+    :param path: Where to save it
+    """
+    state = {
+        'version': DHT_STATE_VERSION,
+        'ksize': node.ksize,
+        'alpha': node.alpha,
+        'id': node.node.id,
+        'neighbors': node.bootstrappableNeighbors(),
+        'storage': node.storage.snapshot(),
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    logger.debug("saved DHT state to %s", path)
+
+
+def load_dht_state(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a snapshot saved by save_dht_state
+
+    :param path: Where it was saved
+    :return: The snapshot, or None if there is no usable snapshot
+    """
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        logger.warning("could not read DHT state from %s: %s", path, e)
+        return None
+    if not isinstance(state, dict) or \
+            state.get('version') != DHT_STATE_VERSION:
+        logger.warning("ignoring DHT state of unknown version in %s", path)
+        return None
+    logger.info("loaded DHT state from %s", path)
+    return state
+
+
+async def save_dht_state_regularly(
+    node: Server, path: str, interval: float=DHT_SNAPSHOT_INTERVAL,
+) -> None:
+    """
+    Save a snapshot of a DHT node every interval seconds
+
+    :param node: The DHT node
+    :param path: Where to save it
+    :param interval: Seconds between snapshots
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            save_dht_state(node, path)
+        except OSError as e:
+            logger.warning("could not save DHT state to %s: %s", path, e)
+
+
+def shutdown_dht() -> None:
+    """Save a last snapshot of the DHT node, if it keeps them, and stop it"""
+    global _node_instance
+    if _node_instance is None:
+        return
+    node = _node_instance
+    _node_instance = None
+    if _state_path is not None:
+        try:
+            save_dht_state(node, _state_path)
+        except OSError as e:
+            logger.warning("could not save DHT state: %s", e)
+    node.stop()
 
 
 class DropPeerDHTStorage(ForgetfulStorage):
@@ -64,59 +222,113 @@ class DropPeerDHTStorage(ForgetfulStorage):
     Extension of the default kademlia storage module
 
     It is different in that when given a list of bytes, it checks to see if
-    it is an encoded set. If it is, it unions it with the rest of the
-    sets
+    it is an encoded peerlist. If it is, its peers are added to the peers
+    already stored under the key, and each peer is forgotten
+    TRACKER_DROP_AVAILABILITY_TTL seconds after it was last added.  At most
+    max_peers peers are kept per key; when there are more, the peers that
+    were added longest ago are forgotten first.  Peerlists are returned
+    freshest peer first.
+
+    Peers are kept per key, in a dict from peer to expiry time, with a
+    min-heap of expiry times shared by every key.  Expired peers are removed
+    lazily from the top of the heap, so culling costs O(log n) per expired
+    peer, and a peerlist is only encoded when it is read after a change.
     """
 
-    def __init__(self) -> None:
-        self.timeouts = {}  # type: Dict[Tuple[int, Tuple[Any, int, str]], int]
+    def __init__(
+        self, ttl: int=604800, max_peers: int=MAX_STORED_PEERS,
+    ) -> None:
+        """
+        :param ttl: How long to keep values that are not peerlists
+        :param max_peers: Most peers to keep per key
+        """
+        super().__init__(ttl)
+        self.max_peers = max_peers
+        #: key -> peer -> expiry time
+        self.peers = {}  # type: Dict[Any, Dict[Tuple[Any, ...], float]]
+        #: key -> last time a peer was added under it
+        self.peer_birthdays = {}  # type: Dict[Any, float]
+        self._expiry_heap = []  # type: List[Tuple[float, int, Any, Tuple[Any, ...]]]  # noqa
+        self._heap_counter = 0
+        self._encoded = {}  # type: Dict[Any, bytes]
 
-        super().__init__()
+    def cull_peerlists(self) -> None:
+        """Forget every peer that has not been added for the TTL"""
+        now = time.time()
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            (expiry, _, key, peer) = heapq.heappop(heap)
+            key_peers = self.peers.get(key)
+            # the peer may have been added again since this entry was pushed
+            if key_peers is None or key_peers.get(peer) != expiry:
+                continue
+            del key_peers[peer]
+            self._encoded.pop(key, None)
+            if not key_peers:
+                del self.peers[key]
+                del self.peer_birthdays[key]
 
-    def cull_peerlist(self, key: Any) -> None:
-        """
-        Cull peerlist at key of out of date entries
-        If entry at key is not a peerlist, do nothing
+    def cull(self) -> None:
+        """Forget expired peers, and values older than the storage's TTL"""
+        self.cull_peerlists()
+        for _ in ForgetfulStorage.iteritemsOlderThan(self, self.ttl):
+            self.data.popitem(last=False)
 
-        :param key: key of peerlist
-        """
-        current_time = int(time.time())
-        item = self.data[key][1]
-        itempeerlist = crypto_util.decode_peerlist(item)
-        if itempeerlist is not None:
-            itempeerlist = list(
-                filter(
-                    lambda x: (
-                        ((key, x) not in self.timeouts) or
-                        (
-                            current_time - self.timeouts[(key, x)] <
-                            TRACKER_DROP_AVAILABILITY_TTL
-                        )
-                    ),
-                    itempeerlist,
-                ),
-            )
-            timeout_key_list = list(
-                filter(
-                    lambda x: self.timeouts[x] < TRACKER_DROP_AVAILABILITY_TTL,
-                    self.timeouts,
-                ),
+    def _add_peers(
+        self, key: Any, peers: List[Tuple[Tuple[Any, ...], float]],
+        birthday: float,
+    ) -> None:
+        """Add peers with their expiry times under a key, or renew them if
+        they are already there"""
+        if key in self.data:
+            del self.data[key]
+        key_peers = self.peers.setdefault(key, {})
+        for (peer, expiry) in peers:
+            key_peers[peer] = expiry
+            self._heap_counter += 1
+            heapq.heappush(
+                self._expiry_heap, (expiry, self._heap_counter, key, peer),
             )
-            timeout_value_list = list(
-                map(lambda x: self.timeouts[x], timeout_key_list),
+        # the heap entries of evicted peers are skipped when they expire
+        while len(key_peers) > self.max_peers:
+            del key_peers[min(key_peers, key=key_peers.__getitem__)]
+        self.peer_birthdays[key] = birthday
+        self._encoded.pop(key, None)
+
+    def _encoded_peerlist(self, key: Any) -> bytes:
+        """The peers under a key, as an encoded peerlist"""
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            key_peers = self.peers[key]
+            encoded = crypto_util.encode_peerlist(
+                sorted(key_peers, key=key_peers.__getitem__, reverse=True),
             )
-            self.timeouts = dict(zip(timeout_key_list, timeout_value_list))
+            self._encoded[key] = encoded
+        return encoded
 
     def __getitem__(self, key: Any) -> Any:
         """
         Gets item from storage
 
-        If item is an encoded peerlist, it culls outdated values
+        If item is a peerlist, only peers that have not expired are returned
+
+        :param key: key to access value in dht
+        :raises KeyError: If nothing is stored under key
+        """
+        self.cull()
+        if key in self.peers:
+            return self._encoded_peerlist(key)
+        return self.data[key][1]
 
+    def get(self, key: Any, default: Any=None) -> Any:
+        """
         :param key: key to access value in dht
+        :param default: What to return if nothing is stored under key
         """
-        self.cull_peerlist(key)
-        return super().__getitem__(key)
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
     def __setitem__(self, key: Any, value: Any) -> None:
         """
@@ -125,21 +337,82 @@ class DropPeerDHTStorage(ForgetfulStorage):
         """
         valuepeer = crypto_util.decode_peerlist(value)
         if valuepeer is not None:
-            self.timeouts[(key, valuepeer[0])] = int(time.time())
-            if key in self.data:
-                peerlist = crypto_util.decode_peerlist(
-                    self.data[key][1],
-                )
-                if peerlist is not None:
-                    # remove duplicates and encode
-                    new_peerlist = crypto_util.encode_peerlist(
-                        list(set(peerlist + valuepeer)),
-                    )
-                    return super().__setitem__(key, new_peerlist)
-
-            return super().__setitem__(
-                key,
-                crypto_util.encode_peerlist(valuepeer),
-            )
+            now = time.time()
+            expiry = now + TRACKER_DROP_AVAILABILITY_TTL
+            self._add_peers(key, [(peer, expiry) for peer in valuepeer], now)
+            self.cull()
+            return
 
-        return super().__setitem__(key, value)
+        if key in self.peers:
+            del self.peers[key]
+            del self.peer_birthdays[key]
+            self._encoded.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __iter__(self) -> Iterator[Any]:
+        self.cull()
+        return itertools.chain(iter(self.data), iter(list(self.peers)))
+
+    def iteritemsOlderThan(self, secondsOld: float) -> List[Tuple[Any, Any]]:
+        """
+        :param secondsOld: Minimum age of the returned items
+        :return: (key, value) of each item stored at least secondsOld ago
+        """
+        self.cull_peerlists()
+        min_birthday = time.time() - secondsOld
+        items = ForgetfulStorage.iteritemsOlderThan(self, secondsOld)
+        items.extend(
+            (key, self._encoded_peerlist(key))
+            for (key, birthday) in self.peer_birthdays.items()
+            if birthday <= min_birthday
+        )
+        return items
+
+    def items(self) -> List[Tuple[Any, Any]]:
+        """
+        :return: (key, value) of every item stored
+        """
+        self.cull()
+        items = [(key, value) for (key, (_, value)) in self.data.items()]
+        items.extend((key, self._encoded_peerlist(key)) for key in self.peers)
+        return items
+
+    def __repr__(self) -> str:
+        self.cull()
+        return repr((self.data, self.peers))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        :return: Everything stored, in a form that can be pickled and passed \
+                to restore
+        """
+        self.cull()
+        return {
+            'data': [
+                (key, birthday, value)
+                for (key, (birthday, value)) in self.data.items()
+            ],
+            'peers': [
+                (key, self.peer_birthdays[key], list(key_peers.items()))
+                for (key, key_peers) in self.peers.items()
+            ],
+        }
+
+    def restore(self, snapshot: Dict[str, Any]) -> None:
+        """
+        Add everything from a snapshot that has not expired since it was taken
+
+        :param snapshot: A snapshot made by snapshot
+        """
+        for (key, birthday, value) in snapshot['data']:
+            if key in self.peers:
+                continue
+            self.data.pop(key, None)
+            self.data[key] = (birthday, value)
+        for (key, birthday, peers) in snapshot['peers']:
+            self._add_peers(key, peers, birthday)
+        self.cull()
+        logger.info(
+            "restored %s values and %s peerlists", len(self.data),
+            len(self.peers),
+        )
@@ -1,27 +1,35 @@
 """Functionality to get peers from a peer store"""
 import asyncio
+import random
 import threading
 from abc import ABC
 from abc import abstractmethod
+from typing import Any
+from typing import Dict  # noqa
 from typing import List
 from typing import Optional
 from typing import Tuple
 
+from syncr_backend.constants import MAX_CONCURRENT_ANNOUNCEMENTS
 from syncr_backend.constants import TRACKER_DROP_AVAILABILITY_TTL
+from syncr_backend.constants import TRACKER_MAX_DROPS_PER_REQUEST
+from syncr_backend.constants import TRACKER_MAX_PENDING_REQUESTS
 from syncr_backend.constants import TRACKER_OK_RESULT
 from syncr_backend.constants import TrackerRequest
 from syncr_backend.external_interface.dht_util import \
     get_dht
+from syncr_backend.external_interface.dht_util import \
+    wait_for_bootstrap
 from syncr_backend.external_interface.store_exceptions import \
     IncompleteConfigError
 from syncr_backend.external_interface.store_exceptions import \
     UnsupportedOptionError
 from syncr_backend.external_interface.tracker_util import \
-    send_request_to_tracker
-from syncr_backend.init.node_init import load_private_key_from_disk
+    get_tracker_client
+from syncr_backend.init import node_init
 from syncr_backend.metadata.drop_metadata import list_drops
+from syncr_backend.util import async_util
 from syncr_backend.util import crypto_util
-from syncr_backend.util.crypto_util import node_id_from_private_key
 from syncr_backend.util.fileio_util import load_config_file
 from syncr_backend.util.log_util import get_logger
 
@@ -34,22 +42,143 @@ async def send_drops_to_dps(
     port: int,
     shutdown_flag: threading.Event,
 ) -> None:
-    """For each drop tell the dps that ip/port has that drop
+    """Keep telling the dps that ip/port has each drop, until shutdown
 
     :param ip: The ip/address to tell the dps
     :param port: The port to tell the dps
     :param shutdown_flag: Stop when this is set
     """
-    this_node_id = await node_id_from_private_key(
-        await load_private_key_from_disk(),
-    )
-    dps = await get_drop_peer_store(this_node_id)
+    global _announcer
+    announcer = DropAnnouncer(ip, port)
+    _announcer = announcer
+    try:
+        await announcer.run(shutdown_flag)
+    finally:
+        if _announcer is announcer:
+            _announcer = None
+
+
+def announce_drop(drop_id: bytes) -> None:
+    """Announce a new drop to the dps now, rather than waiting for its turn.
+    Does nothing if this process is not announcing drops.
+
+    :param drop_id: The drop to announce
+    """
+    if _announcer is not None:
+        _announcer.announce_soon(drop_id)
+
+
+def spread_offsets(n: int, window: float) -> List[float]:
+    """
+    Spread n events evenly over a window, with jitter.  The window is split
+    into n equal slots and each event is at a random time in its own slot.
+
+    :param n: Number of events
+    :param window: Length of the window, in seconds
+    :return: Sorted list of offsets into the window, in seconds
+    """
+    slot = window / n if n else 0
+    return [(i + random.random()) * slot for i in range(n)]
 
-    while not shutdown_flag.is_set():
-        await send_drops_once(ip, port, dps)
-        sleep_time = TRACKER_DROP_AVAILABILITY_TTL / 2 - 1
-        logger.debug("Sleeping for %s", sleep_time)
-        await asyncio.sleep(sleep_time)
+
+class DropAnnouncer(object):
+    """
+    Announces every drop to the dps once per republish window (half the dps
+    TTL).  Stores that can take many drops in one request get them all at
+    the start of the window; for the rest, the drops are spread evenly over
+    the window, in a random order, with at most MAX_CONCURRENT_ANNOUNCEMENTS
+    announcements pending at a time.  Drops passed to ``announce_soon`` are
+    announced as soon as there is room.
+    """
+
+    def __init__(
+        self, ip: str, port: int,
+        concurrency: int=MAX_CONCURRENT_ANNOUNCEMENTS,
+    ) -> None:
+        """
+        :param ip: The ip/address to tell the dps
+        :param port: The port to tell the dps
+        :param concurrency: Maximum announcements to have pending at a time
+        """
+        self.ip = ip
+        self.port = port
+        self.window = TRACKER_DROP_AVAILABILITY_TTL / 2 - 1
+        self._queue = asyncio.Queue()  # type: asyncio.Queue
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def announce_soon(self, drop_id: bytes) -> None:
+        """
+        Announce a drop without waiting for its turn in the window
+
+        :param drop_id: The drop to announce
+        """
+        self._queue.put_nowait(drop_id)
+
+    async def run(self, shutdown_flag: threading.Event) -> None:
+        """
+        Announce drops until shutdown
+
+        :param shutdown_flag: Stop when this is set
+        """
+        this_node_id = (await node_init.get_identity()).node_id
+        loop = asyncio.get_event_loop()
+
+        while not shutdown_flag.is_set():
+            dps = await get_drop_peer_store(this_node_id)
+            start = loop.time()
+            if dps.bulk_announce:
+                await send_drops_once(self.ip, self.port, dps)
+            else:
+                drops = list_drops()
+                random.shuffle(drops)
+                logger.info(
+                    "Announcing %s drops over %s seconds", len(drops),
+                    self.window,
+                )
+                offsets = spread_offsets(len(drops), self.window)
+                for (drop_id, offset) in zip(drops, offsets):
+                    await self._wait_until(start + offset, dps)
+                    if shutdown_flag.is_set():
+                        return
+                    await self._announce(dps, drop_id)
+            await self._wait_until(start + self.window, dps)
+
+    async def _wait_until(self, deadline: float, dps: 'DropPeerStore') -> None:
+        """Announce queued drops until the deadline"""
+        loop = asyncio.get_event_loop()
+        while True:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                return
+            try:
+                drop_id = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return
+            await self._announce(dps, drop_id)
+
+    async def _announce(self, dps: 'DropPeerStore', drop_id: bytes) -> None:
+        """Start announcing a drop, once fewer than the limit are pending"""
+        await self._semaphore.acquire()
+        asyncio.ensure_future(self._send(dps, drop_id))
+
+    async def _send(self, dps: 'DropPeerStore', drop_id: bytes) -> None:
+        try:
+            logger.debug("Sending drop %s", crypto_util.b64encode(drop_id))
+            if not await dps.add_drop_peer(drop_id, self.ip, self.port):
+                logger.warning(
+                    "dps did not accept drop %s",
+                    crypto_util.b64encode(drop_id),
+                )
+        except Exception as e:
+            logger.warning(
+                "failed to announce drop %s: %s",
+                crypto_util.b64encode(drop_id), e,
+            )
+        finally:
+            self._semaphore.release()
+
+
+_announcer = None  # type: Optional[DropAnnouncer]
 
 
 async def send_drops_once(
@@ -64,23 +193,26 @@ async def send_drops_once(
     :param dps: if provided, use this dps, else get it from config
     """
     if dps is None:
-        this_node_id = await node_id_from_private_key(
-            await load_private_key_from_disk(),
-        )
+        this_node_id = (await node_init.get_identity()).node_id
         dps = await get_drop_peer_store(this_node_id)
 
     drops = list_drops()
-    logger.info("Sending drops to dps")
-    for drop in drops:
-        logger.debug("Sending drop %s", crypto_util.b64encode(drop))
+    logger.info("Sending %s drops to dps", len(drops))
+    added = await dps.add_drop_peers(drops, ip, port)
+    if added < len(drops):
+        logger.warning(
+            "dps accepted only %s of %s drops", added, len(drops),
+        )
+
 
-        await dps.add_drop_peer(drop, ip, port)
+_drop_peer_store = None  # type: Optional[Tuple[bytes, Dict[str, Any], DropPeerStore]]  # noqa
 
 
 async def get_drop_peer_store(node_id: bytes) -> "DropPeerStore":
     """
     Provides a DropPeerStore either by means of DHT or tracker depending
-    on config file
+    on config file.  The same DropPeerStore is shared by every caller until
+    the config changes.
 
     :param node_id: bytes of the node id for this node
     :raises UnsupportedOptionError: If the config specifies an unknown DPS type
@@ -88,8 +220,33 @@ async def get_drop_peer_store(node_id: bytes) -> "DropPeerStore":
             values
     :return: DropPeerStore
     """
+    global _drop_peer_store
     config_file = await load_config_file()
 
+    if _drop_peer_store is not None:
+        (cached_id, cached_config, dps) = _drop_peer_store
+        if cached_id == node_id and cached_config == config_file:
+            return dps
+
+    logger.debug("making drop peer store of type %s", config_file.get('type'))
+    dps = _make_drop_peer_store(node_id, config_file)
+    _drop_peer_store = (node_id, config_file, dps)
+    return dps
+
+
+def _make_drop_peer_store(
+    node_id: bytes, config_file: Dict[str, Any],
+) -> "DropPeerStore":
+    """
+    Make a new DropPeerStore from a config
+
+    :param node_id: bytes of the node id for this node
+    :param config_file: The parsed config
+    :raises UnsupportedOptionError: If the config specifies an unknown DPS type
+    :raises IncompleteConfigError: If the config does not have the necessary \
+            values
+    :return: DropPeerStore
+    """
     try:
         if config_file['type'] == 'tracker':
             pks = TrackerPeerStore(
@@ -116,6 +273,9 @@ async def get_drop_peer_store(node_id: bytes) -> "DropPeerStore":
 class DropPeerStore(ABC):
     """Abstract base class for communication to send/get peer lists"""
 
+    #: Whether announcing many drops at once is cheaper than one at a time
+    bulk_announce = False
+
     @abstractmethod
     async def add_drop_peer(self, drop_id: bytes, ip: str, port: int) -> bool:
         """
@@ -128,6 +288,25 @@ class DropPeerStore(ABC):
         """
         pass
 
+    async def add_drop_peers(
+        self, drop_ids: List[bytes], ip: str, port: int,
+    ) -> int:
+        """
+        Add many drop/node mappings to the DPS.  By default this adds them one
+        at a time.
+
+        :param drop_ids: Drops to send
+        :param ip: IP of this node
+        :param port: Port of this node
+        :return: How many of the drops were added
+        """
+        added = 0
+        for drop_id in drop_ids:
+            logger.debug("Sending drop %s", crypto_util.b64encode(drop_id))
+            if await self.add_drop_peer(drop_id, ip, port):
+                added += 1
+        return added
+
     @abstractmethod
     async def request_peers(
         self, drop_id: bytes,
@@ -168,6 +347,7 @@ class DHTPeerStore(DropPeerStore):
         :return: Whether the action was successful
         """
         logger.debug("addingdrop peers %s %s %s", drop_id, ip, port)
+        await wait_for_bootstrap()
 
         await self.node_instance.set(
             drop_id,
@@ -188,6 +368,7 @@ class DHTPeerStore(DropPeerStore):
         :return: A tuple of success and list of peers
         """
         logger.debug("requesting drop peers %s", drop_id)
+        await wait_for_bootstrap()
         # result is bytes representation of frozen set of peers
         result = await self.node_instance.get(drop_id)
         if result is not None:
@@ -208,6 +389,8 @@ class DHTPeerStore(DropPeerStore):
 class TrackerPeerStore(DropPeerStore):
     """Implementation of Peer Store communication using a tracker"""
 
+    bulk_announce = True
+
     def __init__(self, node_id: bytes, ip: str, port: int) -> None:
         """
         Sets up a TrackerPeerStore with the trackers ip and port and the id of
@@ -220,6 +403,7 @@ class TrackerPeerStore(DropPeerStore):
         self.node_id = node_id
         self.tracker_ip = ip
         self.tracker_port = port
+        self.client = get_tracker_client(ip, port)
 
     async def add_drop_peer(self, drop_id: bytes, ip: str, port: int) -> bool:
         """
@@ -237,16 +421,53 @@ class TrackerPeerStore(DropPeerStore):
             'data': [self.node_id, ip, port],
         }
 
-        response = await send_request_to_tracker(
-            request, self.tracker_ip,
-            self.tracker_port,
-        )
+        response = await self.client.request(request)
         logger.debug("tracker add peer response: %s", response)
         if response.get('result') == TRACKER_OK_RESULT:
             return True
         else:
             return False
 
+    async def add_drop_peers(
+        self, drop_ids: List[bytes], ip: str, port: int,
+    ) -> int:
+        """
+        Adds their node_id, ip, and port to the lists of many drops, in
+        POST_PEERS requests of up to TRACKER_MAX_DROPS_PER_REQUEST drops.  If
+        the tracker does not understand POST_PEERS, falls back to a POST_PEER
+        request per drop.
+
+        :param drop_ids: list of node_id (SHA256 hash) + SHA256 hash
+        :param ip: string of ipv4 or ipv6
+        :param port: port where drops are being hosted
+        :return: How many of the drops were added
+        """
+        added = 0
+        for start in range(0, len(drop_ids), TRACKER_MAX_DROPS_PER_REQUEST):
+            batch = drop_ids[start:start + TRACKER_MAX_DROPS_PER_REQUEST]
+            request = {
+                'request_type': int(TrackerRequest.POST_PEERS),
+                'node_id': self.node_id,
+                'drop_ids': batch,
+                'data': [ip, port],
+            }
+            response = await self.client.request(request)
+            logger.debug("tracker add peers response: %s", response)
+            if response.get('result') == TRACKER_OK_RESULT:
+                added += len(batch)
+                continue
+
+            logger.info(
+                "tracker did not accept POST_PEERS, sending %s drops one at "
+                "a time", len(batch),
+            )
+            results = await async_util.limit_gather(
+                [self.add_drop_peer(drop_id, ip, port) for drop_id in batch],
+                TRACKER_MAX_PENDING_REQUESTS,
+            )
+            added += sum(1 for r in results if r is True)
+        return added
+
     async def request_peers(
         self, drop_id: bytes,
     ) -> Tuple[bool, List[Tuple[bytes, str, int]]]:
@@ -262,10 +483,7 @@ class TrackerPeerStore(DropPeerStore):
             'drop_id': drop_id,
         }
 
-        response = await send_request_to_tracker(
-            request, self.tracker_ip,
-            self.tracker_port,
-        )
+        response = await self.client.request(request)
         logger.debug("tracker get peers response: %s", response)
         if response.get('result') == TRACKER_OK_RESULT:
             data = response.get('data')
@@ -1,6 +1,8 @@
 """Functionality to get public keys from a public key store"""
 from abc import ABC
 from abc import abstractmethod
+from typing import Any
+from typing import Dict  # noqa
 from typing import List
 from typing import Optional
 from typing import Tuple
@@ -9,6 +11,8 @@ from syncr_backend.constants import TRACKER_OK_RESULT
 from syncr_backend.constants import TrackerRequest
 from syncr_backend.external_interface.dht_util import \
     get_dht
+from syncr_backend.external_interface.dht_util import \
+    wait_for_bootstrap
 from syncr_backend.external_interface.store_exceptions import (
     IncompleteConfigError
 )
@@ -16,7 +20,7 @@ from syncr_backend.external_interface.store_exceptions import (
     UnsupportedOptionError
 )
 from syncr_backend.external_interface.tracker_util import (
-    send_request_to_tracker
+    get_tracker_client
 )
 from syncr_backend.util.fileio_util import load_config_file
 from syncr_backend.util.log_util import get_logger
@@ -25,10 +29,14 @@ from syncr_backend.util.log_util import get_logger
 logger = get_logger(__name__)
 
 
+_public_key_store = None  # type: Optional[Tuple[bytes, Dict[str, Any], PublicKeyStore]]  # noqa
+
+
 async def get_public_key_store(node_id: bytes) -> "PublicKeyStore":
     """
     Provides a PublicKeyStore either by means of DHT or tracker depending
-    on config file
+    on config file.  The same PublicKeyStore is shared by every caller until
+    the config changes.
 
     :param node_id: This node's node id
     :raises UnsupportedOptionError: If the config specifies an unknown DPS type
@@ -36,8 +44,32 @@ async def get_public_key_store(node_id: bytes) -> "PublicKeyStore":
             values
     :return: PublicKeyStore
     """
+    global _public_key_store
     config_file = await load_config_file()
 
+    if _public_key_store is not None:
+        (cached_id, cached_config, pks) = _public_key_store
+        if cached_id == node_id and cached_config == config_file:
+            return pks
+
+    pks = _make_public_key_store(node_id, config_file)
+    _public_key_store = (node_id, config_file, pks)
+    return pks
+
+
+def _make_public_key_store(
+    node_id: bytes, config_file: Dict[str, Any],
+) -> "PublicKeyStore":
+    """
+    Make a new PublicKeyStore from a config
+
+    :param node_id: This node's node id
+    :param config_file: The parsed config
+    :raises UnsupportedOptionError: If the config specifies an unknown DPS type
+    :raises IncompleteConfigError: If the config does not have the necessary \
+            values
+    :return: PublicKeyStore
+    """
     try:
         logger.debug("Keystore is of type %s", config_file['type'])
         if config_file['type'] == 'tracker':
@@ -111,6 +143,7 @@ class DHTKeyStore(PublicKeyStore):
         :return: boolean on success of setting key
         """
         try:
+            await wait_for_bootstrap()
             await self.node_instance.set(self.node_id, key)
             return True
         except Exception:
@@ -128,7 +161,7 @@ class DHTKeyStore(PublicKeyStore):
         :return: boolean (success of getting key), 2048 RSA public key \
                 (if boolean is True)
         """
-
+        await wait_for_bootstrap()
         result = str(await self.node_instance.get(request_node_id), 'utf-8')
         if result is not None:
             return True, result
@@ -151,6 +184,7 @@ class TrackerKeyStore(PublicKeyStore):
         self.node_id = node_id
         self.tracker_ip = ip
         self.tracker_port = port
+        self.client = get_tracker_client(ip, port)
 
     async def set_key(self, key: bytes) -> bool:
         """
@@ -165,10 +199,7 @@ class TrackerKeyStore(PublicKeyStore):
             'data': key,
         }
 
-        response = await send_request_to_tracker(
-            request, self.tracker_ip,
-            self.tracker_port,
-        )
+        response = await self.client.request(request)
         logger.debug("tracker set key response: %s", response)
         if response.get('result') == TRACKER_OK_RESULT:
             return True
@@ -191,10 +222,7 @@ class TrackerKeyStore(PublicKeyStore):
             'node_id': request_node_id,
         }
 
-        response = await send_request_to_tracker(
-            request, self.tracker_ip,
-            self.tracker_port,
-        )
+        response = await self.client.request(request)
         logger.debug("tracker get key response: %s", response)
         if response.get('result') == TRACKER_OK_RESULT:
             return True, response.get('data')
@@ -0,0 +1,293 @@
+"""A tracker server, keeping public keys and drop peers in memory
+
+It speaks both kinds of connection described in
+:mod:`syncr_backend.external_interface.tracker_util`: one request per
+connection, or many framed requests on a persistent connection, answered in
+order.
+"""
+import asyncio
+import hashlib
+import heapq
+import time
+from typing import Any
+from typing import Callable  # noqa
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from syncr_backend.constants import MAX_STORED_PEERS
+from syncr_backend.constants import TRACKER_DROP_AVAILABILITY_TTL
+from syncr_backend.constants import TRACKER_ERROR_RESULT
+from syncr_backend.constants import TRACKER_MAX_DROPS_PER_REQUEST
+from syncr_backend.constants import TRACKER_OK_RESULT
+from syncr_backend.constants import TrackerRequest
+from syncr_backend.external_interface.tracker_util import encode_frame
+from syncr_backend.external_interface.tracker_util import read_frame
+from syncr_backend.external_interface.tracker_util import \
+    TrackerProtocolError
+from syncr_backend.util import bencode_util
+from syncr_backend.util.log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+Peer = Tuple[bytes, str, int]
+
+
+class TrackerRequestError(Exception):
+    """Raised when a request is malformed, or cannot be answered"""
+    pass
+
+
+class TrackerStorage(object):
+    """
+    Public keys by node id, and announced peers by drop id.
+
+    Each drop has a dict from peer to when it was last announced, and a
+    min-heap of expiry times shared by every drop lets expired peers be
+    removed lazily, in O(log n) each.  At most max_peers peers are kept per
+    drop, forgetting the stalest first.
+    """
+
+    def __init__(
+        self, ttl: int=TRACKER_DROP_AVAILABILITY_TTL,
+        max_peers: int=MAX_STORED_PEERS,
+    ) -> None:
+        """
+        :param ttl: How long peers are kept after they were announced
+        :param max_peers: Most peers to keep per drop
+        """
+        self.ttl = ttl
+        self.max_peers = max_peers
+        self.keys = {}  # type: Dict[bytes, bytes]
+        #: drop id -> peer -> time it was last announced
+        self.peers = {}  # type: Dict[bytes, Dict[Peer, int]]
+        self._expiry_heap = []  # type: List[Tuple[int, int, bytes, Peer]]
+        self._heap_counter = 0
+
+    def cull(self, now: int) -> None:
+        """
+        Forget every peer that has not been announced for the TTL
+
+        :param now: The current time
+        """
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            (expiry, _, drop_id, peer) = heapq.heappop(heap)
+            drop_peers = self.peers.get(drop_id)
+            # the peer may have been announced again since
+            if drop_peers is None or \
+                    drop_peers.get(peer) != expiry - self.ttl:
+                continue
+            del drop_peers[peer]
+            if not drop_peers:
+                del self.peers[drop_id]
+
+    def add_peer(self, drop_id: bytes, peer: Peer, now: int) -> None:
+        """
+        Add a peer to a drop, or renew it
+
+        :param drop_id: The drop
+        :param peer: (node id, ip, port) of the peer
+        :param now: The current time
+        """
+        self.cull(now)
+        drop_peers = self.peers.setdefault(drop_id, {})
+        drop_peers[peer] = now
+        self._heap_counter += 1
+        heapq.heappush(
+            self._expiry_heap,
+            (now + self.ttl, self._heap_counter, drop_id, peer),
+        )
+        while len(drop_peers) > self.max_peers:
+            del drop_peers[min(drop_peers, key=drop_peers.__getitem__)]
+
+    def get_peers(self, drop_id: bytes, now: int) -> List[List[Any]]:
+        """
+        Get the peers of a drop
+
+        :param drop_id: The drop
+        :param now: The current time
+        :return: [node id, ip, port, time announced] of each peer, most \
+                recently announced first
+        """
+        self.cull(now)
+        drop_peers = self.peers.get(drop_id, {})
+        return [
+            [node_id, ip, port, announced]
+            for ((node_id, ip, port), announced) in sorted(
+                drop_peers.items(), key=lambda item: item[1], reverse=True,
+            )
+        ]
+
+
+def _get_bytes(request: Dict[str, Any], field: str) -> bytes:
+    """Get a field of a request that must be bytes"""
+    value = request.get(field)
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if not isinstance(value, bytes) or not value:
+        raise TrackerRequestError("missing or invalid %s" % field)
+    return value
+
+
+def _get_address(data: Any) -> Tuple[str, int]:
+    """Get an ip and port from a request"""
+    try:
+        (ip, port) = data
+    except (TypeError, ValueError):
+        raise TrackerRequestError("invalid address")
+    if isinstance(ip, bytes):
+        ip = ip.decode('utf-8', 'replace')
+    if not isinstance(ip, str) or not isinstance(port, int):
+        raise TrackerRequestError("invalid address")
+    return (ip, port)
+
+
+class TrackerServer(object):
+    """Answers tracker requests from a TrackerStorage"""
+
+    def __init__(self, storage: TrackerStorage) -> None:
+        """
+        :param storage: Where keys and peers are kept
+        """
+        self.storage = storage
+        self._handlers = {
+            int(TrackerRequest.GET_KEY): self.get_key,
+            int(TrackerRequest.POST_KEY): self.post_key,
+            int(TrackerRequest.GET_PEERS): self.get_peers,
+            int(TrackerRequest.POST_PEER): self.post_peer,
+            int(TrackerRequest.POST_PEERS): self.post_peers,
+        }  # type: Dict[int, Callable[[Dict[str, Any], int], Any]]
+
+    def handle_request(self, request: Any) -> Dict[str, Any]:
+        """
+        Answer one request
+
+        :param request: The decoded request
+        :return: The response
+        """
+        try:
+            if not isinstance(request, dict):
+                raise TrackerRequestError("request is not a dict")
+            request_type = request.get('request_type')
+            if not isinstance(request_type, int):
+                raise TrackerRequestError("missing request type")
+            handler = self._handlers.get(request_type)
+            if handler is None:
+                raise TrackerRequestError("unknown request type")
+            data = handler(request, int(time.time()))
+        except TrackerRequestError as e:
+            return {'result': TRACKER_ERROR_RESULT, 'message': str(e)}
+        if data is None:
+            return {'result': TRACKER_OK_RESULT}
+        return {'result': TRACKER_OK_RESULT, 'data': data}
+
+    def get_key(self, request: Dict[str, Any], now: int) -> bytes:
+        """GET_KEY: {'node_id'} -> the node's public key"""
+        key = self.storage.keys.get(_get_bytes(request, 'node_id'))
+        if key is None:
+            raise TrackerRequestError("no public key for node")
+        return key
+
+    def post_key(self, request: Dict[str, Any], now: int) -> None:
+        """POST_KEY: {'node_id', 'data': public key}.  The node id must be
+        the hash of the key."""
+        node_id = _get_bytes(request, 'node_id')
+        key = _get_bytes(request, 'data')
+        if hashlib.sha256(key).digest() != node_id:
+            raise TrackerRequestError("node id does not match key")
+        self.storage.keys[node_id] = key
+
+    def get_peers(self, request: Dict[str, Any], now: int) -> List[List[Any]]:
+        """GET_PEERS: {'drop_id'} -> [[node_id, ip, port, timestamp], ...]"""
+        peers = self.storage.get_peers(_get_bytes(request, 'drop_id'), now)
+        if not peers:
+            raise TrackerRequestError("no peers for drop")
+        return peers
+
+    def post_peer(self, request: Dict[str, Any], now: int) -> None:
+        """POST_PEER: {'drop_id', 'data': [node_id, ip, port]}"""
+        drop_id = _get_bytes(request, 'drop_id')
+        data = request.get('data')
+        if not isinstance(data, list) or len(data) != 3:
+            raise TrackerRequestError("invalid peer")
+        node_id = _get_bytes({'node_id': data[0]}, 'node_id')
+        (ip, port) = _get_address(data[1:])
+        self.storage.add_peer(drop_id, (node_id, ip, port), now)
+
+    def post_peers(self, request: Dict[str, Any], now: int) -> None:
+        """POST_PEERS: {'node_id', 'drop_ids': [...], 'data': [ip, port]}"""
+        node_id = _get_bytes(request, 'node_id')
+        (ip, port) = _get_address(request.get('data'))
+        drop_ids = request.get('drop_ids')
+        if not isinstance(drop_ids, list) or \
+                len(drop_ids) > TRACKER_MAX_DROPS_PER_REQUEST:
+            raise TrackerRequestError("invalid drop ids")
+        drop_ids = [_get_bytes({'d': d}, 'd') for d in drop_ids]
+        for drop_id in drop_ids:
+            self.storage.add_peer(drop_id, (node_id, ip, port), now)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+    ) -> None:
+        """
+        Answer the requests on a connection, then close it
+
+        :param reader: The connection's reader
+        :param writer: The connection's writer
+        """
+        try:
+            first = await reader.read(1)
+            if first.isdigit():
+                await self._handle_persistent(first, reader, writer)
+            elif first:
+                await self._handle_one_shot(first, reader, writer)
+        except (OSError, TrackerProtocolError) as e:
+            logger.debug("tracker connection failed: %s", e)
+        finally:
+            writer.close()
+
+    async def _handle_one_shot(
+        self, first: bytes, reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        decoder = bencode_util.Decoder()
+        decoder.feed(first)
+        try:
+            request = await bencode_util.read_value(reader, decoder)
+        except bencode_util.BencodeDecodeError:
+            response = {
+                'result': TRACKER_ERROR_RESULT,
+                'message': "request is not bencoded",
+            }
+        else:
+            response = self.handle_request(request)
+        writer.write(bencode_util.encode(response))
+        writer.write_eof()
+        await writer.drain()
+
+    async def _handle_persistent(
+        self, first: bytes, reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        request = await read_frame(reader, first)
+        while request is not None:
+            writer.write(encode_frame(self.handle_request(request)))
+            await writer.drain()
+            request = await read_frame(reader)
+
+
+async def start_tracker_server(
+    ip: str, port: int, storage: TrackerStorage,
+) -> asyncio.AbstractServer:
+    """
+    Start a tracker server
+
+    :param ip: ip to listen on
+    :param port: port to listen on
+    :param storage: Where to keep keys and peers
+    :return: The running server
+    """
+    server = TrackerServer(storage)
+    return await asyncio.start_server(server.handle_connection, ip, port)
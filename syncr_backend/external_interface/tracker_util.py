@@ -1,16 +1,34 @@
-"""Helper functions for sending tracker requests"""
+"""Helper functions for sending tracker requests
+
+Trackers accept two kinds of connections.  The original kind carries one
+bencoded request, ended by EOF, and is answered with one bencoded response.
+On a persistent connection, each request and response is instead framed as
+a bencoded byte string (``<length>:<bencoded dict>``), so many requests can
+be sent without waiting for responses, which come back in order.  Trackers
+tell the two apart by the first byte of the connection: a digit for a frame,
+``d`` for a plain request.
+"""
 import asyncio
+from collections import deque
 from typing import Any
+from typing import Deque  # noqa
 from typing import Dict
+from typing import Optional
+from typing import Tuple  # noqa
 
-import bencode  # type: ignore
-
+from syncr_backend.constants import TRACKER_PROBE_TIMEOUT
+from syncr_backend.util import bencode_util
 from syncr_backend.util.log_util import get_logger
 
 
 logger = get_logger(__name__)
 
 
+class TrackerProtocolError(Exception):
+    """Raised when a tracker sends something that is not a valid response"""
+    pass
+
+
 async def send_request_to_tracker(
     request: Dict[str, Any], ip: str, port: int,
 ) -> Dict[str, Any]:
@@ -25,18 +43,208 @@ async def send_request_to_tracker(
     """
     reader, writer = await asyncio.open_connection(ip, port)
 
-    writer.write(bencode.encode(request))
+    writer.write(bencode_util.encode(request))
     writer.write_eof()
     await writer.drain()
 
-    response = b''
-    while 1:
-        data = await reader.read()
-        if not data:
-            break
-        else:
-            response += data
+    response = await bencode_util.read_value(reader)
+    writer.close()
+    return response
+
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """
+    Frame a message for a persistent connection
+
+    >>> from syncr_backend.external_interface.tracker_util import encode_frame
+    >>> encode_frame({'a': 1})
+    b'8:d1:ai1ee'
+
+    :param message: The request or response
+    :return: The bencoded message, as a bencoded byte string
+    """
+    return bencode_util.encode(bencode_util.encode(message))
+
+
+async def read_frame(
+    reader: asyncio.StreamReader, prefix: bytes=b'',
+) -> Optional[Dict[str, Any]]:
+    """
+    Read one framed message from a persistent connection
+
+    :param reader: The connection
+    :param prefix: The start of the frame, if it was already read
+    :raises TrackerProtocolError: If the data is not a framed message
+    :return: The message, or None if the connection was closed between \
+            messages
+    """
+    try:
+        length = prefix + await reader.readuntil(b':')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial and not prefix:
+            return None
+        raise TrackerProtocolError("connection closed in frame header")
+    except asyncio.LimitOverrunError:
+        raise TrackerProtocolError("frame header too long")
+    if not length[:-1].isdigit():
+        raise TrackerProtocolError("bad frame header %r" % length[:16])
+    try:
+        payload = await reader.readexactly(int(length[:-1]))
+    except asyncio.IncompleteReadError:
+        raise TrackerProtocolError("connection closed in frame")
+    try:
+        message = bencode_util.decode(payload)
+    except Exception:
+        raise TrackerProtocolError("frame is not bencoded")
+    if not isinstance(message, dict):
+        raise TrackerProtocolError("frame is not a dict")
+    return message
+
+
+class TrackerClient(object):
+    """
+    A persistent connection to a tracker, shared by everything that talks to
+    it.  Requests are pipelined: each is written as soon as it is made, and
+    responses are matched to requests in order.
+
+    If the tracker closes the connection, or does not answer within
+    ``TRACKER_PROBE_TIMEOUT``, before answering any framed request, it is
+    assumed not to support persistent connections, and this
+    and all later requests are sent one connection each, with
+    ``send_request_to_tracker``.  A tracker that cannot be connected to says
+    nothing about that, so only the request being made then is sent on its
+    own connection.
+    """
+
+    def __init__(self, ip: str, port: int) -> None:
+        """
+        :param ip: ip of tracker
+        :param port: port where tracker is serving
+        """
+        self.ip = ip
+        self.port = port
+        #: Whether the tracker supports persistent connections, if known
+        self.persistent = None  # type: Optional[bool]
+        self._writer = None  # type: Optional[asyncio.StreamWriter]
+        self._reader_task = None  # type: Optional[asyncio.Future]
+        self._pending = deque()  # type: Deque[asyncio.Future]
+        self._connect_lock = asyncio.Lock()
+
+    async def request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send a request to the tracker
+
+        :param request: The request
+        :return: The tracker's response
+        """
+        if self.persistent is not False:
+            try:
+                writer = await self._connect()
+            except OSError as e:
+                logger.warning(
+                    "cannot connect to tracker %s:%s: %s", self.ip,
+                    self.port, e,
+                )
+                return await send_request_to_tracker(
+                    request, self.ip, self.port,
+                )
+            try:
+                return await self._pipelined_request(writer, request)
+            except (OSError, TrackerProtocolError) as e:
+                if self.persistent is None:
+                    logger.info(
+                        "tracker %s:%s does not support persistent "
+                        "connections: %s", self.ip, self.port, e,
+                    )
+                    self.persistent = False
+                else:
+                    logger.warning(
+                        "lost connection to tracker %s:%s: %s", self.ip,
+                        self.port, e,
+                    )
+        return await send_request_to_tracker(request, self.ip, self.port)
+
+    async def _pipelined_request(
+        self, writer: asyncio.StreamWriter, request: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        response = asyncio.get_event_loop().create_future()
+        self._pending.append(response)
+        writer.write(encode_frame(request))
+        await writer.drain()
+        if self.persistent is not None:
+            return await response
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(response), TRACKER_PROBE_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            response.cancel()
+            self.close()
+            raise TrackerProtocolError("no response to a framed request")
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        async with self._connect_lock:
+            if self._writer is None:
+                logger.debug("connecting to tracker %s:%s", self.ip, self.port)
+                reader, writer = await asyncio.open_connection(
+                    self.ip, self.port,
+                )
+                self._writer = writer
+                self._reader_task = asyncio.ensure_future(
+                    self._read_responses(reader, writer),
+                )
+            return self._writer
+
+    async def _read_responses(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+    ) -> None:
+        error = ConnectionResetError(
+            "tracker closed the connection",
+        )  # type: Exception
+        try:
+            while True:
+                response = await read_frame(reader)
+                if response is None:
+                    break
+                if not self._pending:
+                    raise TrackerProtocolError("response without a request")
+                self.persistent = True
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(response)
+        except (OSError, TrackerProtocolError) as e:
+            error = e
+        except asyncio.CancelledError:
+            error = ConnectionAbortedError("tracker client closed")
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
 
-    reader.feed_eof()
+    def close(self) -> None:
+        """Close the connection to the tracker, failing pending requests"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
 
-    return bencode.decode(response)
+
+_clients = {}  # type: Dict[Tuple[str, int], TrackerClient]
+
+
+def get_tracker_client(ip: str, port: int) -> TrackerClient:
+    """
+    Get the shared client of a tracker
+
+    :param ip: ip of tracker
+    :param port: port where tracker is serving
+    :return: The tracker client
+    """
+    client = _clients.get((ip, port))
+    if client is None:
+        client = TrackerClient(ip, port)
+        _clients[(ip, port)] = client
+    return client
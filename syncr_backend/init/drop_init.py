@@ -7,35 +7,44 @@ from typing import Tuple
 
 from syncr_backend.constants import DEFAULT_DROP_METADATA_LOCATION
 from syncr_backend.constants import DEFAULT_FILE_METADATA_LOCATION
+from syncr_backend.constants import FIXED_CHUNKS_PROTOCOL_VERSION
+from syncr_backend.external_interface import drop_peer_store
 from syncr_backend.init import node_init
+from syncr_backend.metadata import chunk_index
 from syncr_backend.metadata import drop_metadata
+from syncr_backend.metadata import drop_registry
 from syncr_backend.metadata import file_metadata
 from syncr_backend.metadata.drop_metadata import DropMetadata
 from syncr_backend.metadata.drop_metadata import save_drop_location
 from syncr_backend.metadata.file_metadata import FileMetadata
 from syncr_backend.util import crypto_util
 from syncr_backend.util import fileio_util
+from syncr_backend.util import watch_util
 from syncr_backend.util.log_util import get_logger
 
 
 logger = get_logger(__name__)
 
 
-async def initialize_drop(directory: str) -> bytes:
+async def initialize_drop(
+    directory: str, file_protocol_version: int=FIXED_CHUNKS_PROTOCOL_VERSION,
+) -> bytes:
     """
     Initialize a drop from a directory. Generates the necesssary drop and
     file metadata files and writes the drop location to the central config dif
 
     :param directory: The directory to initialize a drop from
+    :param file_protocol_version: How to split files into chunks, \
+            FIXED_CHUNKS_PROTOCOL_VERSION or CDC_PROTOCOL_VERSION
     :return: The b64 encoded id of the created drop
     """
     logger.info("initializing drop in dir %s", directory)
-    priv_key = await node_init.load_private_key_from_disk()
-    node_id = await crypto_util.node_id_from_public_key(priv_key.public_key())
+    node_id = (await node_init.get_identity()).node_id
     (drop_m, files_m) = await make_drop_metadata(
         path=directory,
         drop_name=os.path.basename(directory),
         owner=node_id,
+        file_protocol_version=file_protocol_version,
     )
     await drop_m.write_file(
         is_current=True,
@@ -44,18 +53,17 @@ async def initialize_drop(directory: str) -> bytes:
             directory, DEFAULT_DROP_METADATA_LOCATION,
         ),
     )
-    for f_m in files_m.values():
-        await f_m.write_file(
-            os.path.join(directory, DEFAULT_FILE_METADATA_LOCATION),
-        )
+    await FileMetadata.write_files(
+        os.path.join(directory, DEFAULT_FILE_METADATA_LOCATION),
+        files_m.values(),
+    )
+    await chunk_index.index_files(files_m)
     await save_drop_location(drop_m.id, directory)
+    await drop_registry.refresh(drop_m.id)
+    drop_peer_store.announce_drop(drop_m.id)
     logger.info("drop initialized with %s files", len(files_m))
 
-    scanned_files = await fileio_util.scan_current_files(directory)
-    await fileio_util.write_timestamp_file(
-        scanned_files,
-        directory,
-    )
+    await watch_util.update_timestamp_file(directory)
 
     return crypto_util.b64encode(drop_m.id)
 
@@ -66,7 +74,8 @@ async def make_drop_metadata(
     owner: bytes,
     other_owners: Dict[bytes, int]={},
     ignore: List[str]=[],
-    drop_id: Optional[bytes]=None
+    drop_id: Optional[bytes]=None,
+    file_protocol_version: int=FIXED_CHUNKS_PROTOCOL_VERSION,
 ) -> Tuple[DropMetadata, Dict[str, FileMetadata]]:
     """
     Makes drop metadata and file metadatas from a directory
@@ -76,6 +85,7 @@ async def make_drop_metadata(
     :param drop_id: The drop id of the drop metadata, must match the owner
     :param owner: The owner, must match the drop id
     :param other_owners: Other owners, may be empty
+    :param file_protocol_version: How to split files into chunks
     :return: A tuple of the drop metadata, and a dict from file names to file \
              metadata
     """
@@ -86,7 +96,7 @@ async def make_drop_metadata(
     for (dirpath, filename) in fileio_util.walk_with_ignore(path, ignore):
         full_name = os.path.join(dirpath, filename)
         files[full_name] = await file_metadata.make_file_metadata(
-            full_name, drop_id,
+            full_name, drop_id, file_protocol_version,
         )
 
     file_hashes = {
@@ -15,6 +15,56 @@ from syncr_backend.util.log_util import get_logger
 logger = get_logger(__name__)
 
 
+class NodeIdentity(object):
+    """The keys and id of this node"""
+
+    def __init__(
+        self, private_key: crypto_util.rsa.RSAPrivateKey, node_id: bytes,
+    ) -> None:
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.public_key_bytes = crypto_util.dump_public_key(self.public_key)
+        self.node_id = node_id
+
+
+_identity = None  # type: Optional[NodeIdentity]
+
+
+async def load_identity(init_directory: Optional[str]=None) -> NodeIdentity:
+    """
+    Load the identity of this node from disk, and use it for the rest of
+    this process.  Call this at startup.
+
+    :param init_directory: directory where node files are stored \
+    init_directory of none uses ~/.{DEFAULT_INIT_DIR}
+    :return: The node identity
+    """
+    global _identity
+    private_key = await load_private_key_from_disk(init_directory)
+    node_id = await crypto_util.node_id_from_private_key(private_key)
+    _identity = NodeIdentity(private_key, node_id)
+    logger.info("node id is %s", crypto_util.b64encode(node_id))
+    return _identity
+
+
+async def get_identity() -> NodeIdentity:
+    """
+    Get the identity of this node, loading it from the default init directory
+    if it has not been loaded yet
+
+    :return: The node identity
+    """
+    if _identity is None:
+        return await load_identity()
+    return _identity
+
+
+def forget_identity() -> None:
+    """Forget the loaded identity, so it is loaded from disk when next used"""
+    global _identity
+    _identity = None
+
+
 def force_initialize_node(init_directory: Optional[str]=None) -> None:
     """
     Initialize new node in .node directory
@@ -28,6 +78,7 @@ def force_initialize_node(init_directory: Optional[str]=None) -> None:
 
     if os.path.exists(full_directory):
         shutil.rmtree(full_directory)
+    forget_identity()
 
     initialize_node(full_directory)
 
@@ -44,6 +95,7 @@ def delete_node_directory(init_directory: Optional[str]=None) -> None:
 
     if os.path.exists(full_directory):
         shutil.rmtree(full_directory)
+    forget_identity()
 
 
 def is_node_initialized(init_directory: Optional[str]=None) -> bool:
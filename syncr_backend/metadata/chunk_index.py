@@ -0,0 +1,287 @@
+"""A node wide index of where chunks are on disk
+
+Every chunk this node has verified, in any file of any drop, is recorded by
+hash in a SQLite database in the node init directory, so a chunk shared by
+several files or drops only has to be downloaded once, and is copied from
+disk after that.
+
+Most chunks a node is missing are not on disk at all, so the hashes in the
+index are also kept in a Bloom filter in memory, and only hashes that pass
+it are looked up in the database.  Entries are not removed when files
+change, so whatever the index returns must be checked against its hash
+before it is used.
+"""
+import asyncio
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+from syncr_backend.constants import CHUNK_INDEX_BLOOM_CAPACITY
+from syncr_backend.constants import CHUNK_INDEX_BLOOM_ERROR_RATE
+from syncr_backend.constants import DEFAULT_CHUNK_INDEX_FILE
+from syncr_backend.init.node_init import get_full_init_directory
+from syncr_backend.metadata.file_metadata import FileMetadata
+from syncr_backend.util.log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+R = TypeVar('R')
+
+#: Where a chunk is, as (path, offset, length)
+Location = Tuple[str, int, int]
+
+
+class BloomFilter(object):
+    """
+    A set of byte strings that can have false positives, but no false
+    negatives
+
+    >>> from syncr_backend.metadata.chunk_index import BloomFilter
+    >>> bloom = BloomFilter(100)
+    >>> bloom.add(b'chunk')
+    >>> b'chunk' in bloom, b'other chunk' in bloom
+    (True, False)
+    """
+
+    def __init__(
+        self, capacity: int,
+        error_rate: float=CHUNK_INDEX_BLOOM_ERROR_RATE,
+    ) -> None:
+        """
+        :param capacity: How many keys it holds at error_rate
+        :param error_rate: The false positive rate once capacity keys are in
+        """
+        self.capacity = max(1, capacity)
+        self.num_bits = math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2)**2,
+        )
+        self.num_hashes = max(
+            1, round(self.num_bits / self.capacity * math.log(2)),
+        )
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _indexes(self, key: bytes) -> Iterable[int]:
+        digest = hashlib.sha256(key).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return (
+            (h1 + i * h2) % self.num_bits for i in range(self.num_hashes)
+        )
+
+    def add(self, key: bytes) -> None:
+        """
+        Add a key
+
+        :param key: The key
+        """
+        for i in self._indexes(key):
+            self._bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, bytes):
+            return False
+        return all(
+            self._bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(key)
+        )
+
+
+class ChunkIndex(object):
+    """Where chunks are on disk, by hash"""
+
+    SCHEMA = """CREATE TABLE IF NOT EXISTS chunks (
+        hash BLOB NOT NULL,
+        path TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (hash, path, offset)
+    )"""
+
+    def __init__(self, db_path: str) -> None:
+        """
+        :param db_path: The database, created if it does not exist
+        """
+        self.db_path = db_path
+        self._conn = None  # type: Optional[sqlite3.Connection]
+        self._lock = threading.Lock()
+        self._filter = None  # type: Optional[BloomFilter]
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(ChunkIndex.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _call(self, f: Callable[[sqlite3.Connection], R]) -> R:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return f(conn)
+
+    async def _run(self, f: Callable[[sqlite3.Connection], R]) -> R:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._call, f)
+
+    async def _rebuild_filter(self) -> BloomFilter:
+        """Build the Bloom filter from every hash in the database, with room
+        for as many again"""
+        rows = await self._run(
+            lambda conn: conn.execute(
+                "SELECT DISTINCT hash FROM chunks",
+            ).fetchall(),
+        )
+        bloom = BloomFilter(max(CHUNK_INDEX_BLOOM_CAPACITY, 2 * len(rows)))
+        for (chunk_hash,) in rows:
+            bloom.add(bytes(chunk_hash))
+        self._filter = bloom
+        return bloom
+
+    async def _get_filter(self) -> BloomFilter:
+        if self._filter is None:
+            return await self._rebuild_filter()
+        return self._filter
+
+    async def add_chunks(
+        self, path: str, chunks: Iterable[Tuple[bytes, int, int]],
+    ) -> None:
+        """
+        Record verified chunks of a file
+
+        :param path: The file
+        :param chunks: (hash, offset, length) of each chunk
+        """
+        rows = [
+            (chunk_hash, path, offset, length)
+            for (chunk_hash, offset, length) in chunks
+        ]
+        if not rows:
+            return
+        bloom = await self._get_filter()
+        await self._run(
+            lambda conn: conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows,
+            ),
+        )
+        for row in rows:
+            bloom.add(row[0])
+        if bloom.count > bloom.capacity:
+            await self._rebuild_filter()
+
+    async def add_file(
+        self, path: str, file_metadata: FileMetadata,
+        chunk_ids: Optional[Iterable[int]]=None,
+    ) -> None:
+        """
+        Record verified chunks of a file
+
+        :param path: The file
+        :param file_metadata: The file's metadata
+        :param chunk_ids: The chunks to record, or None for all of them
+        """
+        if chunk_ids is None:
+            chunk_ids = range(file_metadata.num_chunks)
+        await self.add_chunks(
+            os.path.abspath(path), [
+                (file_metadata.hashes[chunk_id],) +
+                file_metadata.chunk_range(chunk_id)
+                for chunk_id in chunk_ids
+            ],
+        )
+
+    async def remove_file(self, path: str) -> None:
+        """
+        Forget every chunk of a file.  Its hashes stay in the Bloom filter
+        until it is rebuilt.
+
+        :param path: The file
+        """
+        await self._run(
+            lambda conn: conn.execute(
+                "DELETE FROM chunks WHERE path = ?", (path,),
+            ),
+        )
+
+    async def lookup(
+        self, hashes: Iterable[bytes],
+    ) -> Dict[bytes, List[Location]]:
+        """
+        Find chunks on disk
+
+        :param hashes: The hashes of the chunks
+        :return: hash -> where chunks with that hash were, for the hashes \
+                found
+        """
+        bloom = await self._get_filter()
+        candidates = {h for h in hashes if h in bloom}
+        if not candidates:
+            return {}
+
+        def find(conn: sqlite3.Connection) -> List[Tuple]:
+            return [
+                row for h in candidates
+                for row in conn.execute(
+                    "SELECT hash, path, offset, length FROM chunks "
+                    "WHERE hash = ?", (h,),
+                )
+            ]
+
+        found = {}  # type: Dict[bytes, List[Location]]
+        for (chunk_hash, path, offset, length) in await self._run(find):
+            found.setdefault(bytes(chunk_hash), []).append(
+                (path, offset, length),
+            )
+        return found
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_chunk_indexes = {}  # type: Dict[str, ChunkIndex]
+
+
+def get_chunk_index() -> Optional[ChunkIndex]:
+    """
+    Get the chunk index of this node.  It is shared by everything in this
+    process.
+
+    :return: The index, or None if the node is not initialized
+    """
+    node_info_path = get_full_init_directory(None)
+    if not os.path.isdir(node_info_path):
+        return None
+    path = os.path.join(node_info_path, DEFAULT_CHUNK_INDEX_FILE)
+    index = _chunk_indexes.get(path)
+    if index is None:
+        index = ChunkIndex(path)
+        _chunk_indexes[path] = index
+    return index
+
+
+async def index_files(files: Dict[str, FileMetadata]) -> None:
+    """
+    Record every chunk of complete files in this node's chunk index
+
+    :param files: path -> metadata of each file
+    """
+    index = get_chunk_index()
+    if index is None:
+        return
+    for (path, file_metadata) in files.items():
+        await index.add_file(path, file_metadata)
@@ -1,36 +1,51 @@
 "The drop metadata object and related functions"""
+import asyncio
+import hashlib
 import logging
 import os
 import shutil
+from collections import defaultdict
 from typing import Any
+from typing import DefaultDict  # noqa
 from typing import Dict
 from typing import Iterator
 from typing import List
+from typing import MutableMapping  # noqa
 from typing import Optional
 from typing import Tuple
 from typing import Union
 
 import aiofiles  # type: ignore
-import bencode  # type: ignore
+from cachetools import LRUCache  # type: ignore
+from cachetools import TTLCache  # type: ignore
 
+from syncr_backend.constants import DEFAULT_DROP_LOCATIONS_FILE
 from syncr_backend.constants import DEFAULT_METADATA_LOOKUP_LOCATION
 from syncr_backend.constants import DEFAULT_PUB_KEY_LOOKUP_LOCATION
+from syncr_backend.constants import DEFAULT_VERIFIED_METADATA_FILE
+from syncr_backend.constants import MISSING_PUB_KEY_TTL
+from syncr_backend.constants import NODE_ID_BYTE_SIZE
+from syncr_backend.constants import PUB_KEY_CACHE_SIZE
 from syncr_backend.external_interface.public_key_store import \
     get_public_key_store
+from syncr_backend.external_interface.public_key_store import \
+    PublicKeyStore
 from syncr_backend.init import node_init
 from syncr_backend.init.node_init import get_full_init_directory
-from syncr_backend.init.node_init import load_private_key_from_disk
+from syncr_backend.metadata.metadata_store import CURRENT
+from syncr_backend.metadata.metadata_store import FileMetadataStore
+from syncr_backend.metadata.metadata_store import get_metadata_store_of
+from syncr_backend.metadata.metadata_store import LATEST
+from syncr_backend.util import bencode_util
 from syncr_backend.util import crypto_util
 from syncr_backend.util.async_util import async_cache
 from syncr_backend.util.crypto_util import load_public_key
-from syncr_backend.util.crypto_util import node_id_from_private_key
 from syncr_backend.util.crypto_util import VerificationException
+from syncr_backend.util.journal_util import get_node_journal
+from syncr_backend.util.journal_util import KeyValueJournal
 from syncr_backend.util.log_util import get_logger
 
 
-CURRENT = "CURRENT"
-LATEST = "LATEST"
-
 logger = get_logger(__name__)
 
 
@@ -176,8 +191,10 @@ class DropMetadata(object):
         h = await self.unsigned_header
         if self.sig is None:
             self.log.debug("signing header")
-            key = await node_init.load_private_key_from_disk()
-            self.sig = await crypto_util.sign_dictionary(key, h)
+            identity = await node_init.get_identity()
+            self.sig = await crypto_util.sign_dictionary(
+                identity.private_key, h,
+            )
         h["header_signature"] = self.sig
         return h
 
@@ -225,11 +242,8 @@ class DropMetadata(object):
 
         :return: None
         """
-        save_path = _get_save_path()
-        encoded_drop_id = crypto_util.b64encode(self.id).decode('utf-8')
-        drop_loc_file = os.path.join(save_path, encoded_drop_id)
-        logger.info("removing file: %s", drop_loc_file)
-        os.remove(drop_loc_file)
+        self.log.info("removing drop location")
+        remove_drop_location(self.id)
 
     async def delete(self) -> None:
         """Deletes the drop from the local system and unsubscribes
@@ -246,10 +260,8 @@ class DropMetadata(object):
     def make_filename(
         id: bytes, version: Union[str, DropVersion],
     ) -> str:
-        """Make the filename for a drop metadata"""
-        return "%s_%s" % (
-            crypto_util.b64encode(id).decode("utf-8"), str(version),
-        )
+        """Make the filename for a drop metadata in the file layout"""
+        return FileMetadataStore.make_filename(id, str(version))
 
     async def write_file(
         self, metadata_location: str, is_current: bool=True,
@@ -262,21 +274,11 @@ class DropMetadata(object):
         :return: None
         """
         self.log.debug("writing file")
-        file_name = DropMetadata.make_filename(self.id, self.version)
-        if not os.path.exists(metadata_location):
-            os.makedirs(metadata_location)
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'wb',
-        ) as f:
-            await f.write(await self.encode())
-        if is_current:
-            await DropMetadata.write_current(
-                self.id, self.version, metadata_location,
-            )
-        if is_latest:
-            await DropMetadata.write_latest(
-                self.id, self.version, metadata_location,
-            )
+        store = get_metadata_store_of(metadata_location)
+        await store.write_drop_metadata(
+            self.id, (self.version.version, self.version.nonce),
+            await self.encode(), is_current=is_current, is_latest=is_latest,
+        )
 
     @staticmethod
     async def write_current(
@@ -289,12 +291,10 @@ class DropMetadata(object):
         :param version: the current version
         :param metadata_location: where to write it
         """
-        file_name = DropMetadata.make_filename(id, CURRENT)
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'w',
-        ) as f:
-            to_write = DropMetadata.make_filename(id, version)
-            await f.write(to_write)
+        store = get_metadata_store_of(metadata_location)
+        await store.write_pointer(
+            id, CURRENT, (version.version, version.nonce),
+        )
 
     @staticmethod
     async def write_latest(
@@ -306,70 +306,57 @@ class DropMetadata(object):
         :param version: the latest version
         :param metadata_locatin: where to write it
         """
-        file_name = DropMetadata.make_filename(id, LATEST)
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'w',
-        ) as f:
-            to_write = DropMetadata.make_filename(id, version)
-            await f.write(to_write)
+        store = get_metadata_store_of(metadata_location)
+        await store.write_pointer(
+            id, LATEST, (version.version, version.nonce),
+        )
 
     @staticmethod
     async def read_current(
         id: bytes, metadata_location: str,
-    ) -> Optional[str]:
+    ) -> Optional[DropVersion]:
         """Read the current drop version
 
         :param id: the drop id
         :param metadata_location: where to find it
         :return: The current version, or none if not found
         """
-        file_name = DropMetadata.make_filename(id, CURRENT)
-        logger.debug(
-            "trying to read file %s from %s", file_name, metadata_location,
-        )
-        if not os.path.isfile(os.path.join(metadata_location, file_name)):
-            logger.debug("File not found")
+        store = get_metadata_store_of(metadata_location)
+        version = await store.read_pointer(id, CURRENT)
+        if version is None:
+            logger.debug("current version not found")
             return None
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'r',
-        ) as f:
-            logger.debug("Reading file")
-            return await f.readline()
+        return DropVersion(*version)
 
     @staticmethod
     async def read_latest(
         id: bytes, metadata_location: str,
-    ) -> Optional[str]:
+    ) -> Optional[DropVersion]:
         """Read the latest drop version
 
         :param id: the drop id
         :param metadata_location: where to find it
         :return: The latest version, or none if not found
         """
-        file_name = DropMetadata.make_filename(id, LATEST)
-        logger.debug(
-            "trying to read file %s from %s", file_name, metadata_location,
-        )
-        if not os.path.isfile(os.path.join(metadata_location, file_name)):
-            logger.debug("File not found")
+        store = get_metadata_store_of(metadata_location)
+        version = await store.read_pointer(id, LATEST)
+        if version is None:
+            logger.debug("latest version not found")
             return None
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'r',
-        ) as f:
-            logger.debug("Reading file")
-            return await f.readline()
+        return DropVersion(*version)
 
     @staticmethod
     @async_cache()
     async def read_file(
         id: bytes, metadata_location: str, version: Optional[DropVersion]=None,
-        get_latest: bool=False,
+        get_latest: bool=False, reverify: bool=False,
     ) -> Optional['DropMetadata']:
         """Read a drop metadata file from disk
 
         :param id: the drop id
         :param metadata_location: where to look for the file
         :param version: the drop version
+        :param reverify: verify the signature even if it was verified before
         :return: A DropMetadata object, or maybe None
         """
         logger.debug("reading from file")
@@ -379,41 +366,34 @@ class DropMetadata(object):
             )
             if get_latest:
                 logger.info("reading latest")
-                file_name = await DropMetadata.read_latest(
+                version = await DropMetadata.read_latest(
                     id, metadata_location,
                 )
             else:
                 logger.info("reading current")
-                file_name = await DropMetadata.read_current(
+                version = await DropMetadata.read_current(
                     id, metadata_location,
                 )
         else:
             logger.debug("Getting version %s", version)
-            file_name = DropMetadata.make_filename(id, version)
-        if file_name is None:
+        if version is None:
             logger.warning(
                 "current drop metadata not found for %s",
                 crypto_util.b64encode(id),
             )
             return None
 
-        if not os.path.isfile(os.path.join(metadata_location, file_name)):
+        store = get_metadata_store_of(metadata_location)
+        b = await store.read_drop_metadata(
+            id, (version.version, version.nonce),
+        )
+        if b is None:
             logger.warning(
                 "drop metadata not found for %s",
                 crypto_util.b64encode(id),
             )
             return None
-
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'rb',
-        ) as f:
-            b = b''
-            while True:
-                data = await f.read()
-                if not data:
-                    break
-                b += data
-            return await DropMetadata.decode(b)
+        return await DropMetadata.decode(b, reverify=reverify)
 
     async def encode(self) -> bytes:
         """Encode the full drop metadata file, including files, to bytes
@@ -422,19 +402,21 @@ class DropMetadata(object):
         """
         h = await self.header
         h["files"] = self.files
-        return bencode.encode(h)
+        return bencode_util.encode(h)
 
     @staticmethod
-    async def decode(b: bytes) -> 'DropMetadata':
+    async def decode(b: bytes, reverify: bool=False) -> 'DropMetadata':
         """Decodes a bencoded drop metadata file to a DropMetadata object
         Also verifies the files hash and header signature, and throws an
-        exception if they're not OK
+        exception if they're not OK.  Verification is skipped if these exact
+        bytes were verified before, unless reverify is set.
 
         :param b: The bencoded file
+        :param reverify: Always verify, even if b was verified before
         :return: A DropMetadata object from b
         """
         # Note: assumes signed header
-        decoded = bencode.decode(b)
+        decoded = bencode_util.decode(b)
         dm = DropMetadata(
             drop_id=decoded["drop_id"],
             name=decoded["name"],
@@ -452,10 +434,93 @@ class DropMetadata(object):
             files=decoded["files"],
             sig=decoded["header_signature"],
         )
+        digest = await crypto_util.hash(b)
+        if not reverify and dm._was_verified(digest):
+            dm.log.debug("already verified, skipping verification")
+            return dm
         await dm.verify_files_hash()
         await dm.verify_header()
+        dm._set_verified(digest)
         return dm
 
+    def _verified_key(self) -> Optional[str]:
+        if self.sig is None:
+            return None
+        return "%s_%s" % (
+            DropMetadata.make_filename(self.id, self.version),
+            hashlib.sha256(self.sig).hexdigest(),
+        )
+
+    def _was_verified(self, digest: bytes) -> bool:
+        """
+        Check if these exact metadata bytes were verified before
+
+        :param digest: The hash of the encoded metadata
+        :return: Whether it was verified
+        """
+        verified = get_node_journal(DEFAULT_VERIFIED_METADATA_FILE)
+        key = self._verified_key()
+        if verified is None or key is None:
+            return False
+        return verified.get(key) == \
+            crypto_util.b64encode(digest).decode('utf-8')
+
+    def _set_verified(self, digest: bytes) -> None:
+        """
+        Record that the metadata bytes were verified
+
+        :param digest: The hash of the encoded metadata
+        """
+        verified = get_node_journal(DEFAULT_VERIFIED_METADATA_FILE)
+        key = self._verified_key()
+        if verified is None or key is None:
+            return
+        verified.set(key, crypto_util.b64encode(digest).decode('utf-8'))
+
+
+_drop_locations = None  # type: Optional[KeyValueJournal]
+
+
+def _get_drop_locations() -> KeyValueJournal:
+    """
+    Get the journal of drop locations of this node, migrating the old one
+    file per drop layout to it if needed
+
+    :return: The drop locations journal, from b64 encoded drop id to location
+    """
+    global _drop_locations
+    node_info_path = node_init.get_full_init_directory()
+    journal_path = os.path.join(node_info_path, DEFAULT_DROP_LOCATIONS_FILE)
+    if _drop_locations is None or _drop_locations.path != journal_path:
+        _drop_locations = KeyValueJournal(journal_path)
+        _migrate_drop_locations(
+            _drop_locations,
+            os.path.join(node_info_path, DEFAULT_METADATA_LOOKUP_LOCATION),
+        )
+    return _drop_locations
+
+
+def _migrate_drop_locations(journal: KeyValueJournal, old_path: str) -> None:
+    """
+    Move drop locations from the old one file per drop directory to the
+    journal, then remove the old directory
+
+    :param journal: The journal to add locations to
+    :param old_path: The old drop location directory
+    """
+    if not os.path.isdir(old_path):
+        return
+    names = os.listdir(old_path)
+    logger.info("migrating %s drop locations from %s", len(names), old_path)
+    locations = []
+    for name in names:
+        with open(os.path.join(old_path, name), 'r') as f:
+            locations.append((name, f.read()))
+    journal.set_many(
+        [(name, loc) for (name, loc) in locations if name not in journal],
+    )
+    shutil.rmtree(old_path)
+
 
 async def save_drop_location(drop_id: bytes, location: str) -> None:
     """Save a drop's location in the central data dir
@@ -463,33 +528,39 @@ async def save_drop_location(drop_id: bytes, location: str) -> None:
     :param drop_id: The unencoded drop id
     :param location: Where the drop is located on disk
     """
-    save_path = _get_save_path()
-
     encoded_drop_id = crypto_util.b64encode(drop_id).decode('utf-8')
-
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
-
-    async with aiofiles.open(
-        os.path.join(save_path, encoded_drop_id), 'w',
-    ) as f:
-        await f.write(location)
+    drop_locations = _get_drop_locations()
+    if drop_locations.get(encoded_drop_id) != location:
+        drop_locations.set(encoded_drop_id, location)
 
 
 async def get_drop_location(drop_id: bytes) -> str:
     """Get a drop's location from the central data dir
 
     :param drop_id: The drop id to look up
+    :raises FileNotFoundError: If the drop is not on this node
     :return: The drops save dir
     """
-    save_path = _get_save_path()
-
     encoded_drop_id = crypto_util.b64encode(drop_id).decode('utf-8')
+    drop_locations = _get_drop_locations()
+
+    location = drop_locations.get(encoded_drop_id)
+    if location is None:
+        # it may have been added by another process
+        drop_locations.refresh()
+        location = drop_locations.get(encoded_drop_id)
+    if location is None:
+        raise FileNotFoundError(encoded_drop_id)
+    return location
+
 
-    async with aiofiles.open(
-        os.path.join(save_path, encoded_drop_id), 'r',
-    ) as f:
-        return await f.read()
+def remove_drop_location(drop_id: bytes) -> None:
+    """Remove a drop's location from the central data dir
+
+    :param drop_id: The drop id to remove
+    """
+    encoded_drop_id = crypto_util.b64encode(drop_id).decode('utf-8')
+    _get_drop_locations().delete(encoded_drop_id)
 
 
 def list_drops() -> List[bytes]:
@@ -498,29 +569,65 @@ def list_drops() -> List[bytes]:
 
     :return: List of drop IDs
     """
-    save_path = _get_save_path()
-    names = os.listdir(save_path)
+    drop_locations = _get_drop_locations()
+    drop_locations.refresh()
 
-    return [crypto_util.b64decode(os.fsencode(e)) for e in names]
+    return [
+        crypto_util.b64decode(os.fsencode(e)) for e in drop_locations.keys()
+    ]
 
 
-def _get_save_path() -> str:
-    node_info_path = node_init.get_full_init_directory()
-    save_path = os.path.join(node_info_path, DEFAULT_METADATA_LOOKUP_LOCATION)
-    if not os.path.exists(save_path):
-        os.mkdir(save_path)
-    return save_path
+_pub_keys = LRUCache(
+    maxsize=PUB_KEY_CACHE_SIZE,
+)  # type: MutableMapping[bytes, crypto_util.rsa.RSAPublicKey]
+_missing_pub_keys = TTLCache(
+    maxsize=PUB_KEY_CACHE_SIZE, ttl=MISSING_PUB_KEY_TTL,
+)  # type: MutableMapping[bytes, bool]
+_pub_key_locks = defaultdict(
+    asyncio.Lock,
+)  # type: DefaultDict[bytes, asyncio.Lock]
 
 
 async def get_pub_key(node_id: bytes) -> crypto_util.rsa.RSAPublicKey:
     """
-    Gets the public key from disk if possible otherwise request it from
-    PublicKeyStore
+    Gets the public key from memory or disk if possible otherwise request it
+    from PublicKeyStore.  Parsed keys are kept in memory, and keys that could
+    not be found are not requested again for a short time.
 
     :param node_id: bytes for the node you want public key of
     :raises VerificationException: If the pub key cannot be retrieved
     :return: PublicKey
     """
+    pub_key = _pub_keys.get(node_id)
+    if pub_key is not None:
+        return pub_key
+
+    lock = _pub_key_locks[node_id]
+    try:
+        async with lock:
+            pub_key = _pub_keys.get(node_id)
+            if pub_key is None:
+                pub_key = await _load_pub_key(node_id)
+                _pub_keys[node_id] = pub_key
+    finally:
+        # keep locks only for keys being fetched; those still waiting on
+        # this one find the key in _pub_keys
+        if _pub_key_locks.get(node_id) is lock:
+            del _pub_key_locks[node_id]
+    return pub_key
+
+
+async def _load_pub_key(node_id: bytes) -> crypto_util.rsa.RSAPublicKey:
+    """
+    Read a public key from disk, or request it from the PublicKeyStore
+
+    :param node_id: bytes for the node you want public key of
+    :raises VerificationException: If the pub key cannot be retrieved
+    :return: PublicKey
+    """
+    if node_id in _missing_pub_keys:
+        raise VerificationException("public key recently not found")
+
     init_directory = get_full_init_directory(None)
     pub_key_directory = os.path.join(
         init_directory,
@@ -538,31 +645,67 @@ async def get_pub_key(node_id: bytes) -> crypto_util.rsa.RSAPublicKey:
             pub_key = await pub_file.read()
             return load_public_key(pub_key)
     else:
-        key_bytes = await load_private_key_from_disk()
-        this_node_id = await node_id_from_private_key(key_bytes)
-        public_key_store = await get_public_key_store(this_node_id)
+        public_key_store = await _get_public_key_store()
         key_request = await public_key_store.request_key(node_id)
         if key_request[0] and key_request[1] is not None:
             pub_key = key_request[1].encode('utf-8')
             await _save_key_to_disk(key_path, pub_key)
             return load_public_key(pub_key)
         else:
+            _missing_pub_keys[node_id] = True
             raise VerificationException()
 
 
+async def _get_public_key_store() -> PublicKeyStore:
+    """
+    :return: The PublicKeyStore of this node, used to request keys
+    """
+    identity = await node_init.get_identity()
+    return await get_public_key_store(identity.node_id)
+
+
+async def prefetch_pub_keys(
+    drop_id: bytes, drop_metadata: Optional[DropMetadata]=None,
+) -> None:
+    """
+    Concurrently get the public keys of the owners and signer of a drop, so
+    they are ready when its versions are verified.  Keys that cannot be
+    found are skipped.
+
+    :param drop_id: The drop id, which includes the first owner
+    :param drop_metadata: A version of the drop, to get the other owners of
+    """
+    node_ids = {drop_id[:NODE_ID_BYTE_SIZE]}
+    if drop_metadata is not None:
+        node_ids.add(drop_metadata.owner)
+        node_ids.add(drop_metadata.signed_by)
+        node_ids.update(drop_metadata.other_owners.keys())
+    node_ids = {n for n in node_ids if n not in _pub_keys}
+    if not node_ids:
+        return
+
+    logger.debug("prefetching %s public keys", len(node_ids))
+    results = await asyncio.gather(
+        *[get_pub_key(node_id) for node_id in node_ids],
+        return_exceptions=True,
+    )
+    for (node_id, result) in zip(node_ids, results):
+        if isinstance(result, Exception):
+            logger.info(
+                "could not prefetch public key of %s: %s",
+                crypto_util.b64encode(node_id), result,
+            )
+
+
 async def send_my_pub_key() -> None:
     """Send the pub key for this node the the Key Store"""
-    this_node_id = await node_id_from_private_key(
-        await load_private_key_from_disk(),
-    )
+    identity = await node_init.get_identity()
     logger.info(
         "Sending pub key for %s to tracker",
-        crypto_util.b64encode(this_node_id),
+        crypto_util.b64encode(identity.node_id),
     )
-    public_key_store = await get_public_key_store(this_node_id)
-    pub_key = (await load_private_key_from_disk()).public_key()
-    pub_key_bytes = crypto_util.dump_public_key(pub_key)
-    await public_key_store.set_key(pub_key_bytes)
+    public_key_store = await get_public_key_store(identity.node_id)
+    await public_key_store.set_key(identity.public_key_bytes)
 
 
 async def _save_key_to_disk(key_path: str, pub_key: bytes) -> None:
@@ -0,0 +1,187 @@
+"""Node wide, in memory registry of the drops on this node
+
+Incoming requests are resolved through here, so serving a chunk does not need
+to open the drop location file and re-read the drop metadata every time.
+Entries are loaded lazily, and must be refreshed (with ``refresh``) when a
+drop is added or updated, and removed (with ``remove``) when a drop is
+deleted or unsubscribed from.
+"""
+import asyncio
+import os
+from collections import defaultdict
+from typing import Dict  # noqa
+from typing import Optional
+
+from syncr_backend.constants import DEFAULT_DROP_METADATA_LOCATION
+from syncr_backend.constants import DEFAULT_FILE_METADATA_LOCATION
+from syncr_backend.metadata.drop_metadata import DropMetadata
+from syncr_backend.metadata.drop_metadata import get_drop_location
+from syncr_backend.metadata.file_metadata import FileMetadata
+from syncr_backend.util import crypto_util
+from syncr_backend.util.log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class DropRegistryEntry(object):
+    """The location, current version, metadata, and file lookup tables of a
+    drop"""
+
+    def __init__(
+        self, drop_id: bytes, location: str, metadata: DropMetadata,
+    ) -> None:
+        self.drop_id = drop_id
+        self.location = location
+        self.metadata = metadata
+        self.version = metadata.version
+        self.file_names = {
+            file_id: name for (name, file_id) in metadata.files.items()
+        }  # type: Dict[bytes, str]
+        self._file_metadata = {}  # type: Dict[bytes, FileMetadata]
+        self._encoded_metadata = None  # type: Optional[bytes]
+
+    @property
+    def metadata_location(self) -> str:
+        """
+        Where the drop metadata files of this drop are
+
+        :return: The drop metadata directory
+        """
+        return os.path.join(self.location, DEFAULT_DROP_METADATA_LOCATION)
+
+    @property
+    def file_metadata_location(self) -> str:
+        """
+        Where the file metadata files of this drop are
+
+        :return: The file metadata directory
+        """
+        return os.path.join(self.location, DEFAULT_FILE_METADATA_LOCATION)
+
+    def get_file_path(self, file_id: bytes) -> Optional[str]:
+        """
+        Get the full path of a file in the current version
+
+        :param file_id: The file id to look up
+        :return: The full path of the file, or None if it is not in the drop
+        """
+        file_name = self.file_names.get(file_id)
+        if file_name is None:
+            return None
+        return os.path.join(self.location, file_name)
+
+    async def get_file_metadata(
+        self, file_id: bytes,
+    ) -> Optional[FileMetadata]:
+        """
+        Get the file metadata of a file in this drop.  File metadata of files
+        in the current version is kept, so the chunks it has are only
+        calculated once.
+
+        :param file_id: The file id to look up
+        :return: The file metadata, or None if it is not found
+        """
+        file_metadata = self._file_metadata.get(file_id)
+        if file_metadata is not None:
+            return file_metadata
+
+        file_name = self.file_names.get(file_id)
+        file_metadata = await FileMetadata.read_file(
+            file_id=file_id,
+            metadata_location=self.file_metadata_location,
+            file_name=file_name if file_name is not None else "",
+        )
+        if file_metadata is None or file_name is None:
+            # Not in the current version, so don't hold on to it
+            return file_metadata
+
+        file_metadata.file_name = file_name
+        self._file_metadata[file_id] = file_metadata
+        return file_metadata
+
+    async def encoded_metadata(self) -> bytes:
+        """
+        The bencoded current drop metadata, as sent on the wire
+
+        :return: The encoded drop metadata
+        """
+        if self._encoded_metadata is None:
+            self._encoded_metadata = await self.metadata.encode()
+        return self._encoded_metadata
+
+
+_entries = {}  # type: Dict[bytes, DropRegistryEntry]
+_load_locks = defaultdict(asyncio.Lock)  # type: Dict[bytes, asyncio.Lock]
+
+
+async def get_entry(drop_id: bytes) -> Optional[DropRegistryEntry]:
+    """
+    Get the registry entry of a drop, loading it from disk if it is not
+    registered yet
+
+    :param drop_id: The drop id
+    :return: The entry, or None if the drop or its metadata is not on this node
+    """
+    entry = _entries.get(drop_id)
+    if entry is not None:
+        return entry
+
+    async with _load_locks[drop_id]:
+        entry = _entries.get(drop_id)
+        if entry is None:
+            entry = await _load_entry(drop_id)
+            if entry is not None:
+                _entries[drop_id] = entry
+    return entry
+
+
+async def refresh(drop_id: bytes) -> Optional[DropRegistryEntry]:
+    """
+    Reload the registry entry of a drop.  Call this when a drop is added, or
+    its current version changes.
+
+    :param drop_id: The drop id
+    :return: The new entry, or None if the drop is not on this node
+    """
+    remove(drop_id)
+    return await get_entry(drop_id)
+
+
+def remove(drop_id: bytes) -> None:
+    """
+    Remove a drop from the registry.  Call this when a drop is deleted or
+    unsubscribed from.
+
+    :param drop_id: The drop id
+    """
+    _entries.pop(drop_id, None)
+
+
+def clear() -> None:
+    """Remove every drop from the registry"""
+    _entries.clear()
+
+
+async def _load_entry(drop_id: bytes) -> Optional[DropRegistryEntry]:
+    logger.debug(
+        "loading registry entry for %s", crypto_util.b64encode(drop_id),
+    )
+    try:
+        location = await get_drop_location(drop_id)
+    except FileNotFoundError:
+        logger.info(
+            "drop %s is not on this node", crypto_util.b64encode(drop_id),
+        )
+        return None
+
+    metadata = await DropMetadata.read_file(
+        id=drop_id,
+        metadata_location=os.path.join(
+            location, DEFAULT_DROP_METADATA_LOCATION,
+        ),
+        version=None,
+    )
+    if metadata is None:
+        return None
+    return DropRegistryEntry(drop_id, location, metadata)
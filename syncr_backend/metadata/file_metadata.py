@@ -1,20 +1,31 @@
 """The file metadata object and related functions"""
+import asyncio
 import hashlib
 import logging
 import os
+from itertools import accumulate
 from math import ceil
+from typing import Any  # noqa
+from typing import Dict  # noqa
+from typing import Iterable
 from typing import List
 from typing import Optional
 from typing import Set  # noqa
+from typing import Tuple
 
 import aiofiles  # type: ignore
-import bencode  # type: ignore
 
+from syncr_backend.constants import CDC_MAX_CHUNK_SIZE
+from syncr_backend.constants import CDC_PROTOCOL_VERSION
 from syncr_backend.constants import DEFAULT_CHUNK_SIZE
 from syncr_backend.constants import DEFAULT_DROP_METADATA_LOCATION
 from syncr_backend.constants import DEFAULT_FILE_METADATA_LOCATION
+from syncr_backend.constants import FIXED_CHUNKS_PROTOCOL_VERSION
 from syncr_backend.metadata import drop_metadata
 from syncr_backend.metadata.drop_metadata import DropMetadata
+from syncr_backend.metadata.metadata_store import get_metadata_store_of
+from syncr_backend.util import bencode_util
+from syncr_backend.util import chunk_util
 from syncr_backend.util import crypto_util
 from syncr_backend.util import fileio_util
 from syncr_backend.util.async_util import async_cache
@@ -27,19 +38,41 @@ logger = get_logger(__name__)
 class FileMetadata(object):
     """A representation of a file metadata file"""
 
-    # TODO: define PROTOCOL_VERSION somewhere
     def __init__(
         self, hashes: List[bytes], file_id: bytes, file_length: int,
         drop_id: bytes, file_name: Optional[str]=None,
-        chunk_size: int=DEFAULT_CHUNK_SIZE, protocol_version: int=1,
+        chunk_size: int=DEFAULT_CHUNK_SIZE,
+        protocol_version: int=FIXED_CHUNKS_PROTOCOL_VERSION,
+        chunk_lengths: Optional[List[int]]=None,
     ) -> None:
+        """
+        :param chunk_size: Length of every chunk but the last, or of the \
+                largest chunk with content-defined chunks
+        :param protocol_version: FIXED_CHUNKS_PROTOCOL_VERSION or \
+                CDC_PROTOCOL_VERSION
+        :param chunk_lengths: Length of each chunk, only with \
+                CDC_PROTOCOL_VERSION
+        :raises ValueError: If chunk_lengths does not match the protocol \
+                version, the hashes or the file length
+        """
         self.hashes = hashes
         self.file_id = file_id
         self.file_length = file_length
         self.chunk_size = chunk_size
         self._protocol_version = protocol_version
         self._downloaded_chunks = None  # type: Optional[Set[int]]
-        self.num_chunks = ceil(file_length / chunk_size)
+        self.chunk_lengths = chunk_lengths
+        self._offsets = None  # type: Optional[List[int]]
+        if protocol_version == CDC_PROTOCOL_VERSION:
+            if chunk_lengths is None or len(chunk_lengths) != len(hashes) \
+                    or sum(chunk_lengths) != file_length:
+                raise ValueError("chunk lengths do not match the file")
+            self._offsets = [0] + list(accumulate(chunk_lengths))[:-1]
+            self.num_chunks = len(chunk_lengths)
+        elif chunk_lengths is not None:
+            raise ValueError("chunk lengths need content-defined chunks")
+        else:
+            self.num_chunks = ceil(file_length / chunk_size)
         self.drop_id = drop_id
         self._save_dir = None  # type: Optional[str]
         self.file_name = file_name
@@ -61,6 +94,24 @@ class FileMetadata(object):
             )
         return self._log
 
+    @property
+    def protocol_version(self) -> int:
+        """How the file is split into chunks"""
+        return self._protocol_version
+
+    def chunk_range(self, chunk_id: int) -> Tuple[int, int]:
+        """
+        Where a chunk is in the file
+
+        :param chunk_id: The chunk
+        :return: (offset, length) of the chunk
+        """
+        if self._offsets is not None:
+            assert self.chunk_lengths is not None
+            return (self._offsets[chunk_id], self.chunk_lengths[chunk_id])
+        offset = chunk_id * self.chunk_size
+        return (offset, min(self.chunk_size, self.file_length - offset))
+
     def encode(self) -> bytes:
         """Make the bencoded file that will be transfered on the wire
 
@@ -73,8 +124,10 @@ class FileMetadata(object):
             "file_id": self.file_id,
             "chunks": self.hashes,
             "drop_id": self.drop_id,
-        }
-        return bencode.encode(d)
+        }  # type: Dict[str, Any]
+        if self.chunk_lengths is not None:
+            d["chunk_lengths"] = self.chunk_lengths
+        return bencode_util.encode(d)
 
     async def write_file(
         self, metadata_location: str,
@@ -84,13 +137,25 @@ class FileMetadata(object):
         :param metadata_location: where to save it
         """
         self.log.debug("writing file")
-        file_name = crypto_util.b64encode(self.file_id).decode("utf-8")
-        if not os.path.exists(metadata_location):
-            os.makedirs(metadata_location)
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'wb',
-        ) as f:
-            await f.write(self.encode())
+        await FileMetadata.write_files(metadata_location, [self])
+
+    @staticmethod
+    async def write_files(
+        metadata_location: str, file_metadatas: Iterable['FileMetadata'],
+        replace: bool=False,
+    ) -> None:
+        """Write many file metadata at once, in one batch if the metadata
+        store supports it
+
+        :param metadata_location: where to save them
+        :param file_metadatas: the file metadata to write
+        :param replace: whether to remove all other file metadata
+        """
+        store = get_metadata_store_of(metadata_location)
+        await store.write_file_metadata(
+            [(f_m.file_id, f_m.encode()) for f_m in file_metadatas],
+            replace=replace,
+        )
 
     @staticmethod
     @async_cache(maxsize=1024*1024)
@@ -106,20 +171,11 @@ class FileMetadata(object):
         :return: a FileMetadata object or None if it does not exist
         """
         logger.debug("reading from file")
-        file_name = crypto_util.b64encode(file_id).decode("utf-8")
-        if not os.path.exists(os.path.join(metadata_location, file_name)):
+        store = get_metadata_store_of(metadata_location)
+        b = await store.read_file_metadata(file_id)
+        if b is None:
             return None
-
-        async with aiofiles.open(
-            os.path.join(metadata_location, file_name), 'rb',
-        ) as f:
-            b = b''
-            while True:
-                data = await f.read()
-                if not data:
-                    break
-                b += data
-            return FileMetadata.decode(b)
+        return FileMetadata.decode(b)
 
     @staticmethod
     def decode(data: bytes) -> 'FileMetadata':
@@ -128,12 +184,13 @@ class FileMetadata(object):
         :param data: bencoded byte array of file metadata
         :return: FileMetadata object
         """
-        d = bencode.decode(data)
+        d = bencode_util.decode(data)
         return FileMetadata(
             hashes=d['chunks'], file_id=d['file_id'],
             file_length=d['file_length'], chunk_size=d['chunk_size'],
             drop_id=d['drop_id'],
             protocol_version=d['protocol_version'],
+            chunk_lengths=d.get('chunk_lengths'),
         )
 
     @property
@@ -172,11 +229,13 @@ class FileMetadata(object):
         full_name = os.path.join((await self.save_dir), file_name)
         downloaded_chunks = set()  # type: Set[int]
         for chunk_idx in range(self.num_chunks):
+            (offset, length) = self.chunk_range(chunk_idx)
             try:
                 _, h = await fileio_util.read_chunk(
                     filepath=full_name,
                     position=chunk_idx,
-                    chunk_size=self.chunk_size,
+                    chunk_size=length,
+                    offset=offset,
                 )
             except FileNotFoundError:
                 return set()
@@ -216,6 +275,13 @@ class FileMetadata(object):
             return 1.0
         return len(await self.downloaded_chunks) / self.num_chunks
 
+    def set_downloaded_chunks(self, chunk_ids: Set[int]) -> None:
+        """Replace which chunks are downloaded, after the file was rewritten
+
+        :param chunk_ids: The chunks that are downloaded
+        """
+        self._downloaded_chunks = set(chunk_ids)
+
     async def finish_chunk(self, chunk_id: int) -> None:
         """Mark chunk finished
 
@@ -284,13 +350,30 @@ async def hash_file(
     return sha.digest()
 
 
-async def make_file_metadata(filename: str, drop_id: bytes) -> FileMetadata:
+async def make_file_metadata(
+    filename: str, drop_id: bytes,
+    protocol_version: int=FIXED_CHUNKS_PROTOCOL_VERSION,
+) -> FileMetadata:
     """Given a file name, return a FileMetadata object
 
     :param filename: The name of the file to open and read
+    :param protocol_version: FIXED_CHUNKS_PROTOCOL_VERSION, or \
+            CDC_PROTOCOL_VERSION for content-defined chunks
     :return: FileMetadata object
     """
     size = os.path.getsize(filename)
+    if protocol_version == CDC_PROTOCOL_VERSION:
+        loop = asyncio.get_event_loop()
+        (lengths, hashes) = await loop.run_in_executor(
+            None, chunk_util.chunk_file, filename,
+        )
+        async with aiofiles.open(filename, 'rb') as f:
+            file_id = await hash_file(f)
+        return FileMetadata(
+            hashes, file_id, size, drop_id, chunk_size=CDC_MAX_CHUNK_SIZE,
+            protocol_version=protocol_version, chunk_lengths=lengths,
+        )
+
     async with aiofiles.open(filename, 'rb') as f:
 
         hashes = await file_hashes(f)
@@ -0,0 +1,643 @@
+"""Storage backends for drop and file metadata
+
+A drop's metadata is kept in its ``.5yncr`` directory, either as one
+bencoded file per drop version and per file (the original layout), or in a
+single SQLite database.  Which one is used is set per node, in the metadata
+store config file in the node init directory, for example::
+
+    {"type": "sqlite"}
+
+If there is no config file, the file layout is used.  Use the
+``metadata_store`` command to switch a node between backends.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC
+from abc import abstractmethod
+from typing import Any
+from typing import Callable
+from typing import Dict  # noqa
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+import aiofiles  # type: ignore
+
+from syncr_backend.constants import DEFAULT_DROP_METADATA_LOCATION
+from syncr_backend.constants import DEFAULT_FILE_METADATA_LOCATION
+from syncr_backend.constants import DEFAULT_INIT_DIR
+from syncr_backend.constants import DEFAULT_METADATA_DB_LOCATION
+from syncr_backend.constants import DEFAULT_METADATA_STORE_CONFIG_FILE
+from syncr_backend.external_interface.store_exceptions import \
+    UnsupportedOptionError
+from syncr_backend.init.node_init import get_full_init_directory
+from syncr_backend.util import crypto_util
+from syncr_backend.util.log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+CURRENT = "CURRENT"
+LATEST = "LATEST"
+
+FILE_STORE = "file"
+SQLITE_STORE = "sqlite"
+
+#: A drop version, as (version, nonce)
+Version = Tuple[int, int]
+
+R = TypeVar('R')
+
+
+def _relative_to_init_dir(path: str) -> str:
+    return os.path.relpath(path, DEFAULT_INIT_DIR)
+
+
+class MetadataStore(ABC):
+    """Abstract base class for storage of the metadata of one drop
+
+    Metadata is stored and returned already bencoded; encoding, decoding and
+    verification are left to DropMetadata and FileMetadata.
+    """
+
+    def __init__(self, metadata_dir: str) -> None:
+        """
+        :param metadata_dir: The ``.5yncr`` directory of the drop
+        """
+        self.metadata_dir = metadata_dir
+
+    @abstractmethod
+    async def read_drop_metadata(
+        self, drop_id: bytes, version: Version,
+    ) -> Optional[bytes]:
+        """
+        Read a version of the drop metadata
+
+        :param drop_id: The drop id
+        :param version: The version to read
+        :return: The encoded drop metadata, or None if it is not stored
+        """
+        pass
+
+    @abstractmethod
+    async def write_drop_metadata(
+        self, drop_id: bytes, version: Version, data: bytes,
+        is_current: bool=False, is_latest: bool=False,
+    ) -> None:
+        """
+        Store a version of the drop metadata, and optionally point CURRENT
+        and LATEST at it
+
+        :param drop_id: The drop id
+        :param version: The version to write
+        :param data: The encoded drop metadata
+        :param is_current: Whether to also make this the current version
+        :param is_latest: Whether to also make this the latest version
+        """
+        pass
+
+    @abstractmethod
+    async def list_drop_metadata(self) -> List[Tuple[bytes, Version]]:
+        """
+        :return: (drop id, version) of every stored drop metadata
+        """
+        pass
+
+    @abstractmethod
+    async def read_pointer(
+        self, drop_id: bytes, name: str,
+    ) -> Optional[Version]:
+        """
+        Read a version pointer
+
+        :param drop_id: The drop id
+        :param name: CURRENT or LATEST
+        :return: The version pointed to, or None if not set
+        """
+        pass
+
+    @abstractmethod
+    async def write_pointer(
+        self, drop_id: bytes, name: str, version: Version,
+    ) -> None:
+        """
+        Set a version pointer
+
+        :param drop_id: The drop id
+        :param name: CURRENT or LATEST
+        :param version: The version to point to
+        """
+        pass
+
+    @abstractmethod
+    async def list_pointers(self) -> List[Tuple[bytes, str, Version]]:
+        """
+        :return: (drop id, name, version) of every set pointer
+        """
+        pass
+
+    @abstractmethod
+    async def read_file_metadata(self, file_id: bytes) -> Optional[bytes]:
+        """
+        Read a file metadata
+
+        :param file_id: The file id
+        :return: The encoded file metadata, or None if it is not stored
+        """
+        pass
+
+    @abstractmethod
+    async def write_file_metadata(
+        self, items: Iterable[Tuple[bytes, bytes]], replace: bool=False,
+    ) -> None:
+        """
+        Store many file metadata at once
+
+        :param items: (file id, encoded file metadata) pairs
+        :param replace: Remove every other stored file metadata
+        """
+        pass
+
+    @abstractmethod
+    async def list_file_metadata(self) -> List[bytes]:
+        """
+        :return: The file ids of every stored file metadata
+        """
+        pass
+
+    def close(self) -> None:
+        """Release any resources held by this store"""
+        pass
+
+
+class FileMetadataStore(MetadataStore):
+    """Stores each drop version and file metadata as a file, with the
+    CURRENT and LATEST pointers as files containing a drop version's file
+    name"""
+
+    def __init__(self, metadata_dir: str) -> None:
+        super().__init__(metadata_dir)
+        self.drop_dir = os.path.join(
+            metadata_dir,
+            _relative_to_init_dir(DEFAULT_DROP_METADATA_LOCATION),
+        )
+        self.files_dir = os.path.join(
+            metadata_dir,
+            _relative_to_init_dir(DEFAULT_FILE_METADATA_LOCATION),
+        )
+
+    @staticmethod
+    def make_filename(drop_id: bytes, version: str) -> str:
+        """
+        Make the file name of a drop metadata or pointer file
+
+        :param drop_id: The drop id
+        :param version: "version_nonce", or a pointer name
+        :return: The file name
+        """
+        return "%s_%s" % (
+            crypto_util.b64encode(drop_id).decode("utf-8"), version,
+        )
+
+    @staticmethod
+    def parse_filename(file_name: str) -> Tuple[bytes, Optional[Version]]:
+        """
+        Parse the file name of a drop metadata file
+
+        :param file_name: The file name
+        :raises ValueError: If it is not a drop metadata file name
+        :return: The drop id and version, or None as the version for pointers
+        """
+        (encoded_id, version) = file_name.strip().split('_', 1)
+        drop_id = crypto_util.b64decode(encoded_id.encode('utf-8'))
+        if version in (CURRENT, LATEST):
+            return (drop_id, None)
+        (number, nonce) = version.split('_')
+        return (drop_id, (int(number), int(nonce)))
+
+    def _version_filename(self, drop_id: bytes, version: Version) -> str:
+        return FileMetadataStore.make_filename(drop_id, "%s_%s" % version)
+
+    async def _read(self, path: str) -> Optional[bytes]:
+        if not os.path.isfile(path):
+            return None
+        async with aiofiles.open(path, 'rb') as f:
+            return await f.read()
+
+    async def _write(self, path: str, data: bytes) -> None:
+        async with aiofiles.open(path, 'wb') as f:
+            await f.write(data)
+
+    async def read_drop_metadata(
+        self, drop_id: bytes, version: Version,
+    ) -> Optional[bytes]:
+        return await self._read(
+            os.path.join(
+                self.drop_dir, self._version_filename(drop_id, version),
+            ),
+        )
+
+    async def write_drop_metadata(
+        self, drop_id: bytes, version: Version, data: bytes,
+        is_current: bool=False, is_latest: bool=False,
+    ) -> None:
+        os.makedirs(self.drop_dir, exist_ok=True)
+        await self._write(
+            os.path.join(
+                self.drop_dir, self._version_filename(drop_id, version),
+            ),
+            data,
+        )
+        if is_current:
+            await self.write_pointer(drop_id, CURRENT, version)
+        if is_latest:
+            await self.write_pointer(drop_id, LATEST, version)
+
+    async def list_drop_metadata(self) -> List[Tuple[bytes, Version]]:
+        if not os.path.isdir(self.drop_dir):
+            return []
+        versions = []
+        for name in os.listdir(self.drop_dir):
+            try:
+                (drop_id, version) = FileMetadataStore.parse_filename(name)
+            except ValueError:
+                continue
+            if version is not None:
+                versions.append((drop_id, version))
+        return versions
+
+    async def read_pointer(
+        self, drop_id: bytes, name: str,
+    ) -> Optional[Version]:
+        data = await self._read(
+            os.path.join(
+                self.drop_dir, FileMetadataStore.make_filename(drop_id, name),
+            ),
+        )
+        if data is None:
+            return None
+        (_, version) = FileMetadataStore.parse_filename(data.decode('utf-8'))
+        return version
+
+    async def write_pointer(
+        self, drop_id: bytes, name: str, version: Version,
+    ) -> None:
+        os.makedirs(self.drop_dir, exist_ok=True)
+        await self._write(
+            os.path.join(
+                self.drop_dir, FileMetadataStore.make_filename(drop_id, name),
+            ),
+            self._version_filename(drop_id, version).encode('utf-8'),
+        )
+
+    async def list_pointers(self) -> List[Tuple[bytes, str, Version]]:
+        if not os.path.isdir(self.drop_dir):
+            return []
+        pointers = []
+        for name in os.listdir(self.drop_dir):
+            try:
+                (drop_id, version) = FileMetadataStore.parse_filename(name)
+            except ValueError:
+                continue
+            if version is not None:
+                continue
+            pointer = name.split('_', 1)[1]
+            target = await self.read_pointer(drop_id, pointer)
+            if target is not None:
+                pointers.append((drop_id, pointer, target))
+        return pointers
+
+    async def read_file_metadata(self, file_id: bytes) -> Optional[bytes]:
+        return await self._read(
+            os.path.join(
+                self.files_dir, crypto_util.b64encode(file_id).decode('utf-8'),
+            ),
+        )
+
+    async def write_file_metadata(
+        self, items: Iterable[Tuple[bytes, bytes]], replace: bool=False,
+    ) -> None:
+        items = list(items)
+        os.makedirs(self.files_dir, exist_ok=True)
+        if replace:
+            keep = {
+                crypto_util.b64encode(file_id).decode('utf-8')
+                for (file_id, _) in items
+            }
+            for name in os.listdir(self.files_dir):
+                if name not in keep:
+                    os.remove(os.path.join(self.files_dir, name))
+        for (file_id, data) in items:
+            await self._write(
+                os.path.join(
+                    self.files_dir,
+                    crypto_util.b64encode(file_id).decode('utf-8'),
+                ),
+                data,
+            )
+
+    async def list_file_metadata(self) -> List[bytes]:
+        if not os.path.isdir(self.files_dir):
+            return []
+        return [
+            crypto_util.b64decode(name.encode('utf-8'))
+            for name in os.listdir(self.files_dir)
+        ]
+
+
+class SQLiteMetadataStore(MetadataStore):
+    """Stores all the metadata of a drop in one SQLite database, indexed by
+    drop id, version and file id.  Batches of writes are done in a single
+    transaction.
+
+    Database calls are run in the default executor, one at a time.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS drop_metadata (
+            drop_id BLOB NOT NULL,
+            version INTEGER NOT NULL,
+            nonce INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (drop_id, version, nonce)
+        )""",
+        """CREATE TABLE IF NOT EXISTS drop_pointer (
+            drop_id BLOB NOT NULL,
+            name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            nonce INTEGER NOT NULL,
+            PRIMARY KEY (drop_id, name)
+        )""",
+        """CREATE TABLE IF NOT EXISTS file_metadata (
+            file_id BLOB NOT NULL PRIMARY KEY,
+            data BLOB NOT NULL
+        )""",
+    ]
+
+    def __init__(self, metadata_dir: str) -> None:
+        super().__init__(metadata_dir)
+        self.db_path = os.path.join(
+            metadata_dir, _relative_to_init_dir(DEFAULT_METADATA_DB_LOCATION),
+        )
+        self._conn = None  # type: Optional[sqlite3.Connection]
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.metadata_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for statement in SQLiteMetadataStore.SCHEMA:
+                    conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def _call(self, f: Callable[[sqlite3.Connection], R]) -> R:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return f(conn)
+
+    async def _run(self, f: Callable[[sqlite3.Connection], R]) -> R:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._call, f)
+
+    async def _fetchone(self, query: str, *args: Any) -> Optional[Tuple]:
+        return await self._run(
+            lambda conn: conn.execute(query, args).fetchone(),
+        )
+
+    async def _fetchall(self, query: str, *args: Any) -> List[Tuple]:
+        return await self._run(
+            lambda conn: conn.execute(query, args).fetchall(),
+        )
+
+    async def read_drop_metadata(
+        self, drop_id: bytes, version: Version,
+    ) -> Optional[bytes]:
+        row = await self._fetchone(
+            "SELECT data FROM drop_metadata "
+            "WHERE drop_id = ? AND version = ? AND nonce = ?",
+            drop_id, version[0], version[1],
+        )
+        return None if row is None else bytes(row[0])
+
+    async def write_drop_metadata(
+        self, drop_id: bytes, version: Version, data: bytes,
+        is_current: bool=False, is_latest: bool=False,
+    ) -> None:
+        pointers = []
+        if is_current:
+            pointers.append(CURRENT)
+        if is_latest:
+            pointers.append(LATEST)
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                "INSERT OR REPLACE INTO drop_metadata VALUES (?, ?, ?, ?)",
+                (drop_id, version[0], version[1], data),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO drop_pointer VALUES (?, ?, ?, ?)",
+                [(drop_id, p, version[0], version[1]) for p in pointers],
+            )
+
+        await self._run(write)
+
+    async def list_drop_metadata(self) -> List[Tuple[bytes, Version]]:
+        rows = await self._fetchall(
+            "SELECT drop_id, version, nonce FROM drop_metadata",
+        )
+        return [(bytes(d), (v, n)) for (d, v, n) in rows]
+
+    async def read_pointer(
+        self, drop_id: bytes, name: str,
+    ) -> Optional[Version]:
+        row = await self._fetchone(
+            "SELECT version, nonce FROM drop_pointer "
+            "WHERE drop_id = ? AND name = ?",
+            drop_id, name,
+        )
+        return None if row is None else (row[0], row[1])
+
+    async def write_pointer(
+        self, drop_id: bytes, name: str, version: Version,
+    ) -> None:
+        await self._run(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO drop_pointer VALUES (?, ?, ?, ?)",
+                (drop_id, name, version[0], version[1]),
+            ),
+        )
+
+    async def list_pointers(self) -> List[Tuple[bytes, str, Version]]:
+        rows = await self._fetchall(
+            "SELECT drop_id, name, version, nonce FROM drop_pointer",
+        )
+        return [(bytes(d), name, (v, n)) for (d, name, v, n) in rows]
+
+    async def read_file_metadata(self, file_id: bytes) -> Optional[bytes]:
+        row = await self._fetchone(
+            "SELECT data FROM file_metadata WHERE file_id = ?", file_id,
+        )
+        return None if row is None else bytes(row[0])
+
+    async def write_file_metadata(
+        self, items: Iterable[Tuple[bytes, bytes]], replace: bool=False,
+    ) -> None:
+        items = list(items)
+
+        def write(conn: sqlite3.Connection) -> None:
+            if replace:
+                conn.execute("DELETE FROM file_metadata")
+            conn.executemany(
+                "INSERT OR REPLACE INTO file_metadata VALUES (?, ?)", items,
+            )
+
+        await self._run(write)
+
+    async def list_file_metadata(self) -> List[bytes]:
+        rows = await self._fetchall("SELECT file_id FROM file_metadata")
+        return [bytes(r[0]) for r in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+STORE_TYPES = {
+    FILE_STORE: FileMetadataStore,
+    SQLITE_STORE: SQLiteMetadataStore,
+}
+
+_stores = {}  # type: Dict[str, MetadataStore]
+_store_type = None  # type: Optional[str]
+
+
+def get_config_path() -> str:
+    """
+    :return: The path of the metadata store config file of this node
+    """
+    return os.path.join(
+        get_full_init_directory(None), DEFAULT_METADATA_STORE_CONFIG_FILE,
+    )
+
+
+def get_store_type() -> str:
+    """
+    Read which metadata store this node uses from its config file
+
+    :raises UnsupportedOptionError: If the config specifies an unknown type
+    :return: The store type
+    """
+    global _store_type
+    if _store_type is None:
+        store_type = FILE_STORE
+        config_path = get_config_path()
+        if os.path.isfile(config_path):
+            with open(config_path) as f:
+                store_type = json.load(f).get('type', FILE_STORE)
+        if store_type not in STORE_TYPES:
+            raise UnsupportedOptionError(store_type)
+        _store_type = store_type
+    return _store_type
+
+
+def set_store_type(store_type: str) -> None:
+    """
+    Set which metadata store this node uses in its config file.  This does
+    not move any metadata, see ``copy_metadata``.
+
+    :param store_type: The store type
+    :raises UnsupportedOptionError: If store_type is unknown
+    """
+    if store_type not in STORE_TYPES:
+        raise UnsupportedOptionError(store_type)
+    with open(get_config_path(), 'w') as f:
+        json.dump({'type': store_type}, f, ensure_ascii=False)
+    reset()
+
+
+def make_metadata_store(metadata_dir: str, store_type: str) -> MetadataStore:
+    """
+    Make a new metadata store for a drop
+
+    :param metadata_dir: The ``.5yncr`` directory of the drop
+    :param store_type: The store type
+    :return: A metadata store
+    """
+    return STORE_TYPES[store_type](metadata_dir)
+
+
+def get_metadata_store(metadata_dir: str) -> MetadataStore:
+    """
+    Get the metadata store of a drop, using the backend set for this node.
+    Stores are kept open, and shared by everything in this process.
+
+    :param metadata_dir: The ``.5yncr`` directory of the drop
+    :return: The metadata store
+    """
+    metadata_dir = os.path.normpath(metadata_dir)
+    store = _stores.get(metadata_dir)
+    if store is None:
+        store = make_metadata_store(metadata_dir, get_store_type())
+        _stores[metadata_dir] = store
+    return store
+
+
+def get_metadata_store_of(metadata_location: str) -> MetadataStore:
+    """
+    Get the metadata store that holds a drop or file metadata location
+
+    :param metadata_location: A drop's drop or file metadata directory
+    :return: The metadata store
+    """
+    return get_metadata_store(
+        os.path.dirname(os.path.normpath(metadata_location)),
+    )
+
+
+def reset() -> None:
+    """Close every open store, and re-read the config when next used"""
+    global _store_type
+    for store in _stores.values():
+        store.close()
+    _stores.clear()
+    _store_type = None
+
+
+async def copy_metadata(src: MetadataStore, dst: MetadataStore) -> int:
+    """
+    Copy every drop metadata, pointer and file metadata from one store to
+    another.  Used to import to and export from the file layout.
+
+    :param src: The store to copy from
+    :param dst: The store to copy to
+    :return: The number of items copied
+    """
+    count = 0
+    for (drop_id, version) in await src.list_drop_metadata():
+        data = await src.read_drop_metadata(drop_id, version)
+        if data is not None:
+            await dst.write_drop_metadata(drop_id, version, data)
+            count += 1
+    for (drop_id, name, version) in await src.list_pointers():
+        await dst.write_pointer(drop_id, name, version)
+        count += 1
+
+    files = []
+    for file_id in await src.list_file_metadata():
+        data = await src.read_file_metadata(file_id)
+        if data is not None:
+            files.append((file_id, data))
+    await dst.write_file_metadata(files)
+    count += len(files)
+    return count
@@ -9,8 +9,6 @@ from typing import Callable  # noqa
 from typing import Dict
 from typing import List  # noqa
 
-import bencode  # type: ignore
-
 from syncr_backend.constants import DEFAULT_DROP_METADATA_LOCATION
 from syncr_backend.constants import ERR_EXCEPTION
 from syncr_backend.constants import ERR_INVINPUT
@@ -18,18 +16,17 @@ from syncr_backend.constants import ERR_NEXIST
 from syncr_backend.constants import FRONTEND_TCP_ADDRESS
 from syncr_backend.constants import FRONTEND_UNIX_ADDRESS
 from syncr_backend.constants import FrontendAction
-from syncr_backend.external_interface.drop_peer_store import send_drops_once
+from syncr_backend.init import node_init
 from syncr_backend.init.drop_init import initialize_drop
 from syncr_backend.init.node_init import get_full_init_directory
-from syncr_backend.init.node_init import load_private_key_from_disk
+from syncr_backend.metadata import drop_registry
 from syncr_backend.metadata.drop_metadata import DropMetadata
 from syncr_backend.metadata.drop_metadata import get_drop_location
-from syncr_backend.network.send_requests import get_my_ip
+from syncr_backend.util import bencode_util
 from syncr_backend.util import crypto_util
-from syncr_backend.util.crypto_util import node_id_from_private_key
+from syncr_backend.util import watch_util
 from syncr_backend.util.drop_util import check_for_changes
 from syncr_backend.util.drop_util import check_for_update
-from syncr_backend.util.drop_util import cleanup_drop
 from syncr_backend.util.drop_util import do_metadata_request
 from syncr_backend.util.drop_util import find_changes_in_new_version
 from syncr_backend.util.drop_util import get_drop_metadata
@@ -194,7 +191,9 @@ async def handle_delete_drop(
                 'error': ERR_INVINPUT,
             }
         else:
+            watch_util.unwatch_drop(await get_drop_location(drop_id))
             await drop_metadata.delete()
+            drop_registry.remove(drop_id)
             response = {
                 'status': 'ok',
                 'result': 'success',
@@ -253,12 +252,11 @@ async def handle_sync_update(
             logger.info("current: %s", drop_metadata.version)
             logger.info("latest: %s", new_metadata.version)
             logger.info("queuing sync")
+            # removed files are deleted by the sync, once files that were
+            # renamed have been moved
             await queue_sync(
                 drop_id, file_location, new_metadata.version,
             )
-            await cleanup_drop(
-                drop_id, drop_metadata, new_metadata,
-            )
             response = {
                 'status': 'ok',
                 'result': 'success',
@@ -497,7 +495,6 @@ async def handle_initialize_drop(
             status = 'ok'
             result = 'success'
             message = 'Drop ' + drop_name + ' created'
-            await send_drops_once(*(get_my_ip()))
 
     response = {
         'status': status,
@@ -616,7 +613,9 @@ async def handle_unsubscribe(
                 'error': ERR_INVINPUT,
             }
         else:
+            watch_util.unwatch_drop(await get_drop_location(drop_id))
             drop_metadata.unsubscribe()
+            drop_registry.remove(drop_id)
             response = {
                 'status': 'ok',
                 'result': 'success',
@@ -638,9 +637,7 @@ async def handle_get_public_key(
     :param conn: socket.accept() connection
     :return: None
     """
-    this_node_id = await node_id_from_private_key(
-        await load_private_key_from_disk(),
-    )
+    this_node_id = (await node_init.get_identity()).node_id
     if this_node_id is None:
         response = {
             'status': 'error',
@@ -705,15 +702,8 @@ async def async_handle_request(
     :param reader: The StreamReader to read from
     :param writer: The StreamWriter the response will go to
     """
-    request = b''
-
-    while 1:
-        data = await reader.read()
-        if not data:
-            break
-        else:
-            request += data
-    await handle_frontend_request(bencode.decode(request), writer)
+    request = await bencode_util.read_value(reader)
+    await handle_frontend_request(request, writer)
 
 
 async def _tcp_handle_request() -> asyncio.events.AbstractServer:
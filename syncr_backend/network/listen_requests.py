@@ -1,14 +1,13 @@
 """The recieve side of network communication"""
 import asyncio
-import os
 import sys
 import threading
 from asyncio import AbstractEventLoop
+from typing import Any
+from typing import Dict
 from typing import Optional  # noqa
 
-import bencode  # type: ignore
-
-from syncr_backend.constants import DEFAULT_DROP_METADATA_LOCATION
+from syncr_backend.constants import COMPRESSION_PROTOCOL_VERSION
 from syncr_backend.constants import ERR_EXCEPTION
 from syncr_backend.constants import ERR_NEXIST
 from syncr_backend.constants import REQUEST_TYPE_CHUNK
@@ -16,10 +15,12 @@ from syncr_backend.constants import REQUEST_TYPE_CHUNK_LIST
 from syncr_backend.constants import REQUEST_TYPE_DROP_METADATA
 from syncr_backend.constants import REQUEST_TYPE_FILE_METADATA
 from syncr_backend.constants import REQUEST_TYPE_NEW_DROP_METADATA
+from syncr_backend.metadata import drop_registry
 from syncr_backend.metadata.drop_metadata import DropMetadata
 from syncr_backend.metadata.drop_metadata import DropVersion
-from syncr_backend.metadata.drop_metadata import get_drop_location
-from syncr_backend.metadata.file_metadata import get_file_metadata_from_drop_id
+from syncr_backend.metadata.file_metadata import FileMetadata  # noqa
+from syncr_backend.util import bencode_util
+from syncr_backend.util import compression_util
 from syncr_backend.util.fileio_util import read_chunk
 from syncr_backend.util.log_util import get_logger
 from syncr_backend.util.network_util import send_response
@@ -68,15 +69,31 @@ async def async_handle_request(
     :param reader: StreamReader
     :param writer: StreamWriter
     """
-    request = b''
-    while 1:
-        data = await reader.read()
-        if not data:
-            break
-        else:
-            request += data
-        logger.info('Data received')
-    await request_dispatcher(bencode.decode(request), writer)
+    request = await bencode_util.read_value(reader)
+    logger.info('Data received')
+    await request_dispatcher(request, writer)
+
+
+async def ok_response(request: dict, data: bytes) -> Dict[str, Any]:
+    """
+    Make an ok response carrying bytes, compressed with an encoding the
+    request accepts if that makes it smaller
+
+    :param request: The request being answered
+    :param data: The response
+    :return: The response dict
+    """
+    accepted = None
+    if (request.get('protocol_version') or 0) >= COMPRESSION_PROTOCOL_VERSION:
+        accepted = request.get('accept_encoding')
+    loop = asyncio.get_event_loop()
+    (data, encoding) = await loop.run_in_executor(
+        None, compression_util.compress, data, accepted,
+    )
+    response = {'status': 'ok', 'response': data}  # type: Dict[str, Any]
+    if encoding is not None:
+        response['encoding'] = encoding
+    return response
 
 
 async def handle_request_drop_metadata(
@@ -96,21 +113,28 @@ async def handle_request_drop_metadata(
     :param writer: StreamWriter
     :return: None
     """
-    file_location = await get_drop_location(request['drop_id'])
-    file_location = os.path.join(file_location, DEFAULT_DROP_METADATA_LOCATION)
     if request.get('version') is not None and request.get('nonce') is not None:
         drop_version = DropVersion(
             int(request['version']), int(request['nonce']),
         )  # type: Optional[DropVersion]
     else:
         drop_version = None
-    request_drop_metadata = await DropMetadata.read_file(
-        id=request['drop_id'],
-        metadata_location=file_location,
-        version=drop_version,
-    )
 
-    if request_drop_metadata is None:
+    entry = await drop_registry.get_entry(request['drop_id'])
+    encoded_metadata = None  # type: Optional[bytes]
+    if entry is not None:
+        if drop_version is None or drop_version == entry.version:
+            encoded_metadata = await entry.encoded_metadata()
+        else:
+            request_drop_metadata = await DropMetadata.read_file(
+                id=request['drop_id'],
+                metadata_location=entry.metadata_location,
+                version=drop_version,
+            )
+            if request_drop_metadata is not None:
+                encoded_metadata = await request_drop_metadata.encode()
+
+    if encoded_metadata is None:
         logger.info("drop metadata not found, sending error")
         response = {
             'status': 'error',
@@ -118,10 +142,7 @@ async def handle_request_drop_metadata(
         }
     else:
         logger.info("sending drop metadata")
-        response = {
-            'status': 'ok',
-            'response': await request_drop_metadata.encode(),
-        }
+        response = await ok_response(request, encoded_metadata)
 
     await send_response(writer, response)
 
@@ -142,10 +163,13 @@ async def handle_request_file_metadata(
     :param writer: StreamWriter
     :return: None
     """
-    request_file_metadata = await get_file_metadata_from_drop_id(
-        request['drop_id'],
-        request['file_id'],
-    )
+    entry = await drop_registry.get_entry(request['drop_id'])
+    if entry is None:
+        request_file_metadata = None  # type: Optional[FileMetadata]
+    else:
+        request_file_metadata = await entry.get_file_metadata(
+            request['file_id'],
+        )
 
     if request_file_metadata is None:
         logger.info("file metadata not found, sending error")
@@ -155,10 +179,7 @@ async def handle_request_file_metadata(
         }
     else:
         logger.info("sending file metadata")
-        response = {
-            'status': 'ok',
-            'response': request_file_metadata.encode(),
-        }
+        response = await ok_response(request, request_file_metadata.encode())
 
     await send_response(writer, response)
 
@@ -179,10 +200,13 @@ async def handle_request_chunk_list(
     :param writer: StreamWriter
     :return: None
     """
-    request_file_metadata = await get_file_metadata_from_drop_id(
-        request['drop_id'],
-        request['file_id'],
-    )
+    entry = await drop_registry.get_entry(request['drop_id'])
+    if entry is None:
+        request_file_metadata = None  # type: Optional[FileMetadata]
+    else:
+        request_file_metadata = await entry.get_file_metadata(
+            request['file_id'],
+        )
 
     if request_file_metadata is None:
         logger.info("file metadata not found, sending error")
@@ -218,40 +242,28 @@ async def handle_request_chunk(
     :param writer: StreamWriter
     :return: None
     """
-    request_file_metadata = await get_file_metadata_from_drop_id(
-        request['drop_id'],
-        request['file_id'],
-    )
-    drop_location = await get_drop_location(request['drop_id'])
-    drop_metadata_location = os.path.join(
-        drop_location, DEFAULT_DROP_METADATA_LOCATION,
-    )
-    request_drop_metadata = await DropMetadata.read_file(
-        id=request['drop_id'], metadata_location=drop_metadata_location,
-        version=None,
-    )
-
-    if request_file_metadata is None or request_drop_metadata is None:
+    entry = await drop_registry.get_entry(request['drop_id'])
+    file_path = None  # type: Optional[str]
+    file_metadata = None  # type: Optional[FileMetadata]
+    if entry is not None:
+        file_path = entry.get_file_path(request['file_id'])
+        file_metadata = await entry.get_file_metadata(request['file_id'])
+
+    if file_path is None or file_metadata is None or \
+            not 0 <= request['index'] < file_metadata.num_chunks:
         logger.info("chunk not found")
         response = {
             'status': 'error',
             'error': ERR_NEXIST,
         }
     else:
-        file_name = request_drop_metadata.get_file_name_from_id(
-            request['file_id'],
-        )
+        (offset, length) = file_metadata.chunk_range(request['index'])
         chunk = (await read_chunk(
-            os.path.join(
-                drop_location, file_name,
-            ), request['index'],
+            file_path, request['index'], chunk_size=length, offset=offset,
         ))[0]
         logger.info("sending chunk")
         logger.debug("chunk len: %s", len(chunk))
-        response = {
-            'status': 'ok',
-            'response': chunk,
-        }
+        response = await ok_response(request, chunk)
 
     await send_response(writer, response)
 
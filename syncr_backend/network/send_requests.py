@@ -9,8 +9,7 @@ from typing import Optional
 from typing import Tuple
 from typing import TypeVar
 
-import bencode  # type: ignore
-
+from syncr_backend.constants import COMPRESSION_PROTOCOL_VERSION
 from syncr_backend.constants import PROTOCOL_VERSION
 from syncr_backend.constants import REQUEST_TYPE_CHUNK
 from syncr_backend.constants import REQUEST_TYPE_CHUNK_LIST
@@ -19,9 +18,12 @@ from syncr_backend.constants import REQUEST_TYPE_FILE_METADATA
 from syncr_backend.metadata.drop_metadata import DropMetadata
 from syncr_backend.metadata.drop_metadata import DropVersion
 from syncr_backend.metadata.file_metadata import FileMetadata
+from syncr_backend.util import bencode_util
+from syncr_backend.util import compression_util
 from syncr_backend.util import network_util
 from syncr_backend.util.log_util import get_logger
 from syncr_backend.util.network_util import raise_network_error
+from syncr_backend.util.network_util import UnsupportedEncodingException
 
 
 R = TypeVar('R')
@@ -229,7 +231,7 @@ async def send_chunk_request(
 
 
 async def send_request_to_node(
-    request: Dict[str, Any], ip: str, port: int,
+    request: Dict[str, Any], ip: str, port: int, compressed: bool=True,
 ) -> Any:
     """
     Creates a connection a node and sends a given request to the
@@ -238,26 +240,49 @@ async def send_request_to_node(
     :param port: port where node is serving
     :param ip: ip of node
     :param request: Dictionary of a request as specified in the Spec Document
-    :return: node response
+    :param compressed: Whether to accept a compressed response.  If one \
+            cannot be decompressed, as it may be too large, the request is \
+            sent again without.
+    :return: node response, decompressed if it was compressed
     """
+    message = request
+    if compressed and (request.get('protocol_version') or 0) >= \
+            COMPRESSION_PROTOCOL_VERSION:
+        message = dict(
+            request, accept_encoding=compression_util.accepted_encodings(),
+        )
+
     reader, writer = await asyncio.open_connection(ip, port)
 
-    writer.write(bencode.encode(request))
+    writer.write(bencode_util.encode(message))
     writer.write_eof()
     await writer.drain()
 
-    data = b''
-    while 1:
-        sockdata = await reader.read()
-        if not sockdata:
-            break
-        data += sockdata
-    reader.feed_eof()
-
-    response = bencode.decode(data)
+    response = await bencode_util.read_value(reader)
+    writer.close()
     if (response['status'] == 'ok'):
         logger.debug("sending OK")
-        return response['response']
+        encoding = response.get('encoding')
+        if encoding is None:
+            return response['response']
+        body = response['response']
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        loop = asyncio.get_event_loop()
+        try:
+            return await loop.run_in_executor(
+                None, compression_util.decompress, body, encoding,
+            )
+        except UnsupportedEncodingException as e:
+            if message is request:
+                raise
+            logger.warning(
+                "cannot decompress response from %s:%s, asking again "
+                "uncompressed: %s", ip, port, e,
+            )
+            return await send_request_to_node(
+                request, ip, port, compressed=False,
+            )
     else:
         logger.debug("sending error")
         raise_network_error(response['error'])
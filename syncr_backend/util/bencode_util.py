@@ -0,0 +1,409 @@
+"""Bencoding, tuned for the messages and files of this project
+
+This encodes exactly like the ``bencode.py`` package, and decodes the same
+way: byte strings that are valid utf-8 become ``str``, dict keys must be
+utf-8, and dicts come out sorted by key.  It differs only in rejecting a few
+malformed inputs that ``bencode.py`` lets through, such as ``i+1e``, and in
+also encoding ``bytes`` dict keys and ``int`` subclasses.
+
+:func:`encode` collects the pieces of a value and joins them into one buffer
+allocated at its final size, so a large byte string (a chunk) is copied only
+once.  :func:`decode` parses a whole message at once.  :class:`Decoder` and
+:func:`read_value` find the end of a message as it arrives on a stream, so
+it can be decoded without waiting for the connection to be closed.
+"""
+import asyncio
+import re
+from operator import itemgetter
+from typing import Any
+from typing import Dict  # noqa
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+class BencodeDecodeError(Exception):
+    """Raised when data is not a valid bencoded value"""
+    pass
+
+
+_I = ord('i')
+_L = ord('l')
+_D = ord('d')
+_E = ord('e')
+_ZERO = ord('0')
+_NINE = ord('9')
+
+#: Longest integer or string length, in digits, to look for the end of
+MAX_DIGITS = 32
+
+#: Strings longer than this are checked for utf-8 on a prefix first, since
+#: decoding all of a large binary string only to fail is slow
+UTF8_PROBE_SIZE = 2**12
+
+_first = itemgetter(0)
+
+
+def _key(k: Any) -> bytes:
+    if type(k) is str:
+        return k.encode('utf-8')
+    elif isinstance(k, (bytes, bytearray)):
+        return bytes(k)
+    raise TypeError("cannot bencode a %s dict key" % type(k).__name__)
+
+
+def _encode(x: Any, r: List[bytes]) -> None:
+    t = type(x)
+    if t is bytes:
+        r.append(b'%d:' % len(x))
+        r.append(x)
+    elif t is str:
+        s = x.encode('utf-8')
+        r.append(b'%d:' % len(s))
+        r.append(s)
+    elif t is int or t is bool:
+        r.append(b'i%de' % x)
+    elif t is list or t is tuple:
+        r.append(b'l')
+        for item in x:
+            _encode(item, r)
+        r.append(b'e')
+    elif isinstance(x, dict):
+        r.append(b'd')
+        items = [(_key(k), v) for (k, v) in x.items()]
+        items.sort(key=_first)
+        for (k, v) in items:
+            r.append(b'%d:' % len(k))
+            r.append(k)
+            _encode(v, r)
+        r.append(b'e')
+    elif isinstance(x, int):
+        r.append(b'i%de' % x)
+    elif isinstance(x, (bytearray, memoryview)):
+        _encode(bytes(x), r)
+    elif isinstance(x, (list, tuple)):
+        _encode(list(x), r)
+    else:
+        raise TypeError("cannot bencode %s" % t.__name__)
+
+
+def encode(value: Any) -> bytes:
+    """
+    Bencode a value
+
+    >>> from syncr_backend.util import bencode_util
+    >>> bencode_util.encode({'b': [1, b'\\xff'], 'a': 'x'})
+    b'd1:a1:x1:bli1e1:\\xffee'
+
+    :param value: A dict, list, tuple, str, bytes, int or bool, or \
+            containers of them.  Dict keys must be str or bytes.
+    :raises TypeError: If value contains something else
+    :return: The bencoded value
+    """
+    parts = []  # type: List[bytes]
+    _encode(value, parts)
+    return b''.join(parts)
+
+
+def _parse_int(s: bytes) -> int:
+    if s.isdigit():
+        if s[0] != _ZERO or len(s) == 1:
+            return int(s)
+    elif s[:1] == b'-' and s[1:].isdigit() and s[1] != _ZERO:
+        return int(s)
+    raise ValueError("bad integer %r" % s[:MAX_DIGITS])
+
+
+def _parse_length(s: bytes) -> int:
+    if s.isdigit() and (s[0] != _ZERO or len(s) == 1):
+        return int(s)
+    raise ValueError("bad string length %r" % s[:MAX_DIGITS])
+
+
+def _text(s: bytes) -> Any:
+    """s as a str if it is utf-8, else s"""
+    if len(s) > UTF8_PROBE_SIZE:
+        try:
+            s[:UTF8_PROBE_SIZE].decode('utf-8')
+        except UnicodeDecodeError as e:
+            # a character cut by the end of the prefix may still be fine
+            if e.start < UTF8_PROBE_SIZE - 3:
+                return s
+    try:
+        return s.decode('utf-8')
+    except UnicodeDecodeError:
+        return s
+
+
+def _decode(x: bytes, i: int) -> Tuple[Any, int]:
+    """Decode the value at i.  Strings, by far the most common values, are
+    decoded inline in lists and dicts rather than by a call to this, and so
+    are integers in lists."""
+    c = x[i]
+    if c == _L:
+        r = []  # type: List[Any]
+        i += 1
+        c = x[i]
+        while c != _E:
+            if _ZERO <= c <= _NINE:
+                colon = x.index(b':', i)
+                i = colon + 1 + _parse_length(x[i:colon])
+                if i > len(x):
+                    raise ValueError("string past end of data")
+                s = x[colon + 1:i]
+                if len(s) > UTF8_PROBE_SIZE:
+                    r.append(_text(s))
+                else:
+                    try:
+                        r.append(s.decode('utf-8'))
+                    except UnicodeDecodeError:
+                        r.append(s)
+            elif c == _I:
+                end = x.index(b'e', i)
+                s = x[i + 1:end]
+                if s.isdigit() and (s[0] != _ZERO or len(s) == 1):
+                    r.append(int(s))
+                else:
+                    r.append(_parse_int(s))
+                i = end + 1
+            else:
+                (v, i) = _decode(x, i)
+                r.append(v)
+            c = x[i]
+        return (r, i + 1)
+    elif c == _D:
+        d = {}  # type: Dict[str, Any]
+        last = ''
+        ordered = True
+        i += 1
+        c = x[i]
+        while c != _E:
+            if not _ZERO <= c <= _NINE:
+                raise ValueError("dict key is not a string")
+            colon = x.index(b':', i)
+            i = colon + 1 + _parse_length(x[i:colon])
+            if i > len(x):
+                raise ValueError("string past end of data")
+            key = x[colon + 1:i].decode('utf-8')
+            if key <= last and d:
+                ordered = False
+            last = key
+            c = x[i]
+            if _ZERO <= c <= _NINE:
+                colon = x.index(b':', i)
+                i = colon + 1 + _parse_length(x[i:colon])
+                if i > len(x):
+                    raise ValueError("string past end of data")
+                s = x[colon + 1:i]
+                if len(s) > UTF8_PROBE_SIZE:
+                    d[key] = _text(s)
+                else:
+                    try:
+                        d[key] = s.decode('utf-8')
+                    except UnicodeDecodeError:
+                        d[key] = s
+            else:
+                (d[key], i) = _decode(x, i)
+            c = x[i]
+        if not ordered:
+            d = dict(sorted(d.items(), key=_first))
+        return (d, i + 1)
+    elif c == _I:
+        end = x.index(b'e', i)
+        return (_parse_int(x[i + 1:end]), end + 1)
+    elif _ZERO <= c <= _NINE:
+        colon = x.index(b':', i)
+        end = colon + 1 + _parse_length(x[i:colon])
+        if end > len(x):
+            raise ValueError("string past end of data")
+        return (_text(x[colon + 1:end]), end)
+    raise ValueError("unexpected %r" % x[i:i + 1])
+
+
+def decode(data: bytes) -> Any:
+    """
+    Decode a bencoded value
+
+    >>> from syncr_backend.util import bencode_util
+    >>> bencode_util.decode(b'd1:a1:x1:bli1e1:\\xffee')
+    {'a': 'x', 'b': [1, b'\\xff']}
+
+    :param data: The bencoded value, and nothing after it
+    :raises BencodeDecodeError: If data is not exactly one bencoded value
+    :return: The value
+    """
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    try:
+        (value, end) = _decode(data, 0)
+    except (IndexError, ValueError, RecursionError) as e:
+        raise BencodeDecodeError("not a valid bencoded value: %s" % e)
+    if end != len(data):
+        raise BencodeDecodeError("data after the bencoded value")
+    return value
+
+
+#: A run of list and dict starts and integers, which Decoder skips at once
+_RUN = re.compile(rb'(?:[ld]|i-?[0-9]{1,%d}e)*' % MAX_DIGITS)
+
+
+class Decoder(object):
+    """
+    Decode bencoded values as their bytes arrive.  The data is only scanned
+    for the end of the value as it comes in, carrying on from where the last
+    scan stopped, and the whole value is then decoded once with
+    :func:`decode`, which is much faster than building it up piece by piece.
+    Data that may already hold the whole value is decoded without scanning.
+
+    >>> from syncr_backend.util.bencode_util import Decoder
+    >>> decoder = Decoder()
+    >>> decoder.feed(b'd1:ali1e')
+    >>> decoder.next_value()
+    (False, None)
+    >>> decoder.feed(b'ee3:')
+    >>> decoder.next_value()
+    (True, {'a': [1]})
+    >>> decoder.next_value()
+    (False, None)
+    """
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        #: Where the scan stopped
+        self._pos = 0
+        #: Number of lists and dicts open at _pos
+        self._depth = 0
+        #: Buffer length needed before scanning can go on
+        self._need = 0
+
+    def feed(self, data: bytes) -> None:
+        """
+        Add data that arrived
+
+        :param data: The data
+        """
+        self._buf += data
+
+    def _error(self, message: str) -> BencodeDecodeError:
+        return BencodeDecodeError(
+            "not a valid bencoded value: %s at %d" % (message, self._pos),
+        )
+
+    def _unexpected(self, pos: int) -> BencodeDecodeError:
+        self._pos = pos
+        return self._error("unexpected %r" % bytes(self._buf[pos:pos + 1]))
+
+    def _scan(self) -> int:
+        """Scan on from _pos, returning where the value ends, or -1 if more
+        data is needed.  Only the structure is checked here; decode checks
+        the rest."""
+        buf = self._buf
+        n = len(buf)
+        pos = self._pos
+        depth = self._depth
+        while pos < n:
+            c = buf[pos]
+            if _ZERO <= c <= _NINE:
+                colon = buf.find(b':', pos, pos + MAX_DIGITS + 1)
+                if colon < 0:
+                    if n > pos + MAX_DIGITS:
+                        raise self._unexpected(pos)
+                    break
+                length = buf[pos:colon]
+                if not length.isdigit():
+                    raise self._unexpected(pos)
+                end = colon + 1 + int(length)
+                if end > n:
+                    self._need = end
+                    break
+                pos = end
+            elif c == _E and depth:
+                depth -= 1
+                pos += 1
+            elif depth:
+                # none of these end a value, so take them all at once
+                run = _RUN.match(buf, pos)
+                end = run.end() if run else pos
+                if end == pos:
+                    # an integer that is not all there yet, or bad data
+                    if c != _I or buf.find(b'e', pos) >= 0 or \
+                            n > pos + MAX_DIGITS + 2:
+                        raise self._unexpected(pos)
+                    break
+                depth += buf.count(b'l', pos, end) + buf.count(b'd', pos, end)
+                pos = end
+                continue
+            elif c == _L or c == _D:
+                depth = 1
+                pos += 1
+                continue
+            elif c == _I:
+                end = buf.find(b'e', pos, pos + MAX_DIGITS + 3)
+                if end < 0:
+                    if n > pos + MAX_DIGITS + 2:
+                        raise self._unexpected(pos)
+                    break
+                pos = end + 1
+            else:
+                raise self._unexpected(pos)
+            if not depth:
+                return pos
+        self._pos = pos
+        self._depth = depth
+        return -1
+
+    def next_value(self) -> Tuple[bool, Any]:
+        """
+        Decode the next value, if all of it was fed
+
+        :raises BencodeDecodeError: If the data is not bencoded
+        :return: (True, the value), or (False, None) if more data is needed
+        """
+        buf = self._buf
+        if len(buf) < self._need:
+            return (False, None)
+        if not self._pos and buf[-1:] == b'e':
+            # usually the whole value arrived at once, and nothing after it
+            try:
+                value = decode(bytes(buf))
+            except BencodeDecodeError:
+                pass
+            else:
+                del buf[:]
+                self._need = 0
+                return (True, value)
+        end = self._scan()
+        if end < 0:
+            return (False, None)
+        data = bytes(memoryview(buf)[:end])
+        del buf[:end]
+        self._pos = 0
+        self._depth = 0
+        self._need = 0
+        return (True, decode(data))
+
+
+async def read_value(
+    reader: asyncio.StreamReader, decoder: Optional[Decoder]=None,
+) -> Any:
+    """
+    Read one bencoded value from a stream, decoding it once all of it has
+    arrived.  Data after the value that was already read is left in the
+    decoder.
+
+    :param reader: The stream
+    :param decoder: A decoder to keep using, if more values follow
+    :raises BencodeDecodeError: If the data is not bencoded, or the stream \
+            ends before the value does
+    :return: The value
+    """
+    if decoder is None:
+        decoder = Decoder()
+    while True:
+        (done, value) = decoder.next_value()
+        if done:
+            return value
+        data = await reader.read(2**16)
+        if not data:
+            raise BencodeDecodeError("stream ended in a bencoded value")
+        decoder.feed(data)
@@ -0,0 +1,166 @@
+"""Content-defined chunking of files
+
+Files in file metadata protocol version CDC_PROTOCOL_VERSION are split where
+a rolling gear hash of the last 32 bytes has its top bits clear, instead of
+every DEFAULT_CHUNK_SIZE bytes.  Because a boundary only
+depends on the bytes just before it, inserting or removing bytes in a file
+only changes the chunks around the edit, and the rest keep their hashes.
+
+The gear table is derived from sha256, so every node splits a file the same
+way.  Finding boundaries runs at a few MB/s, so files are chunked in an
+executor.
+"""
+import hashlib
+import os
+from typing import BinaryIO
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+from syncr_backend.constants import CDC_AVG_CHUNK_SIZE
+from syncr_backend.constants import CDC_MAX_CHUNK_SIZE
+from syncr_backend.constants import CDC_MIN_CHUNK_SIZE
+
+
+#: Bytes of history the rolling hash depends on
+WINDOW_SIZE = 32
+_HASH_MASK = 2**WINDOW_SIZE - 1
+
+GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], 'big')
+    for i in range(256)
+]  # type: List[int]
+
+
+def boundary_mask(avg_size: int, min_size: int) -> int:
+    """
+    The mask of the top bits of the rolling hash that must be clear at a
+    boundary, so chunks are avg_size long on average
+
+    >>> hex(boundary_mask(2**20, 2**18))
+    '0xffffe000'
+
+    :param avg_size: The average chunk length to aim for
+    :param min_size: The smallest chunk length
+    :return: The mask
+    """
+    bits = max(1, (avg_size - min_size).bit_length() - 1)
+    return (_HASH_MASK >> (WINDOW_SIZE - bits)) << (WINDOW_SIZE - bits)
+
+
+def find_boundary(
+    data: bytes, start: int, end: int, mask: int, min_size: int,
+) -> int:
+    """
+    Find where the chunk starting at start ends
+
+    :param data: Buffer holding the chunk
+    :param start: Where the chunk starts in data
+    :param end: Where to stop looking, at most start plus the largest chunk
+    :param mask: From boundary_mask
+    :param min_size: The smallest chunk length
+    :return: Where the next chunk starts, or end if no boundary was found
+    """
+    # the hash only depends on the last WINDOW_SIZE bytes, so skip the bytes
+    # that cannot end a chunk
+    first = min(start + min_size, end)
+    h = 0
+    gear = GEAR
+    for b in data[max(start, first - WINDOW_SIZE):first]:
+        h = ((h << 1) + gear[b]) & _HASH_MASK
+    i = first
+    for b in data[first:end]:
+        h = ((h << 1) + gear[b]) & _HASH_MASK
+        i += 1
+        if not h & mask:
+            return i
+    return end
+
+
+def iter_chunks(
+    f: BinaryIO, min_size: int=CDC_MIN_CHUNK_SIZE,
+    avg_size: int=CDC_AVG_CHUNK_SIZE, max_size: int=CDC_MAX_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Split a file into content-defined chunks
+
+    :param f: File open in mode 'rb'
+    :param min_size: The smallest chunk length, except the last chunk
+    :param avg_size: The average chunk length to aim for
+    :param max_size: The largest chunk length
+    :return: An iterator of the chunks
+    """
+    mask = boundary_mask(avg_size, min_size)
+    buf = b''
+    eof = False
+    while True:
+        if not eof and len(buf) < max_size:
+            data = f.read(max_size)
+            eof = not data
+            buf += data
+            continue
+        if not buf:
+            return
+        end = find_boundary(buf, 0, min(len(buf), max_size), mask, min_size)
+        yield buf[:end]
+        buf = buf[end:]
+
+
+def chunk_file(
+    path: str, min_size: int=CDC_MIN_CHUNK_SIZE,
+    avg_size: int=CDC_AVG_CHUNK_SIZE, max_size: int=CDC_MAX_CHUNK_SIZE,
+) -> Tuple[List[int], List[bytes]]:
+    """
+    Split a file into content-defined chunks and hash them.  Blocks, so run
+    it in an executor.
+
+    :param path: The file
+    :param min_size: The smallest chunk length, except the last chunk
+    :param avg_size: The average chunk length to aim for
+    :param max_size: The largest chunk length
+    :return: (lengths, hashes) of the chunks
+    """
+    lengths = []  # type: List[int]
+    hashes = []  # type: List[bytes]
+    with open(path, 'rb') as f:
+        for chunk in iter_chunks(f, min_size, avg_size, max_size):
+            lengths.append(len(chunk))
+            hashes.append(hashlib.sha256(chunk).digest())
+    return (lengths, hashes)
+
+
+def index_chunks(
+    path: str, ranges: Iterable[Tuple[int, int]], content_defined: bool,
+) -> Dict[bytes, Tuple[int, int]]:
+    """
+    Hash the chunks of an old version of a file, to find the chunks of a new
+    version it already has.  Blocks, so run it in an executor.
+
+    :param path: The old version
+    :param ranges: (offset, length) of the chunks of the new version, which \
+            are looked for in the same place
+    :param content_defined: Also hash the old version's own content-defined \
+            chunks, to find chunks that moved
+    :return: hash -> (offset, length) of the chunks found in path
+    """
+    index = {}  # type: Dict[bytes, Tuple[int, int]]
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        for (offset, length) in ranges:
+            if offset + length > size:
+                continue
+            f.seek(offset)
+            index.setdefault(
+                hashlib.sha256(f.read(length)).digest(), (offset, length),
+            )
+        if content_defined:
+            f.seek(0)
+            offset = 0
+            for chunk in iter_chunks(f):
+                index.setdefault(
+                    hashlib.sha256(chunk).digest(), (offset, len(chunk)),
+                )
+                offset += len(chunk)
+    return index
@@ -0,0 +1,165 @@
+"""Optional compression of responses between nodes
+
+From protocol version COMPRESSION_PROTOCOL_VERSION on, a request can list the
+encodings its sender can decode in ``accept_encoding``, most preferred
+first.  A bytes response (drop metadata, file metadata or a chunk) may then
+be compressed with one of them, and the response says which in
+``encoding``.  Nodes that predate this ignore ``accept_encoding`` and never
+set ``encoding``, so both sides fall back to uncompressed responses.
+
+zlib is always available.  zstd is used if the ``zstandard`` package is
+installed.  Chunks are still verified against the hash of their
+uncompressed contents.
+"""
+import zlib
+from typing import Any
+from typing import Callable
+from typing import Dict  # noqa
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from syncr_backend.constants import COMPRESSION_MAX_RATIO
+from syncr_backend.constants import COMPRESSION_MIN_SIZE
+from syncr_backend.constants import COMPRESSION_SAMPLE_SIZE
+from syncr_backend.constants import MAX_DECOMPRESSED_SIZE
+from syncr_backend.util.network_util import UnsupportedEncodingException
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+
+def _zlib_compress(data: bytes) -> bytes:
+    return zlib.compress(data)
+
+
+def _zlib_decompress(data: bytes, max_size: int) -> bytes:
+    d = zlib.decompressobj()
+    out = d.decompress(data, max_size)
+    if d.unconsumed_tail or not d.eof:
+        raise UnsupportedEncodingException("bad or too large zlib response")
+    return out
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data: bytes, max_size: int) -> bytes:
+    try:
+        return zstandard.ZstdDecompressor().decompress(
+            data, max_output_size=max_size,
+        )
+    except zstandard.ZstdError as e:
+        raise UnsupportedEncodingException(e)
+
+
+_Codec = Tuple[Callable[[bytes], bytes], Callable[[bytes, int], bytes]]
+
+#: encoding -> (compress, decompress), most preferred first
+CODECS = {}  # type: Dict[str, _Codec]
+if zstandard is not None:
+    CODECS[ZSTD] = (_zstd_compress, _zstd_decompress)
+CODECS[ZLIB] = (_zlib_compress, _zlib_decompress)
+
+
+def accepted_encodings() -> List[str]:
+    """
+    The encodings this node can decode, for ``accept_encoding``
+
+    :return: The encodings, most preferred first
+    """
+    return list(CODECS)
+
+
+def choose_encoding(accepted: Any) -> Optional[str]:
+    """
+    Pick the encoding to answer a request with
+
+    >>> from syncr_backend.util.compression_util import choose_encoding
+    >>> choose_encoding(['brotli', 'zlib'])
+    'zlib'
+    >>> choose_encoding(None) is None
+    True
+
+    :param accepted: The request's ``accept_encoding``, which may be missing \
+            or malformed
+    :return: The first accepted encoding this node can compress with, if any
+    """
+    if not isinstance(accepted, list):
+        return None
+    for encoding in accepted:
+        if isinstance(encoding, bytes):
+            encoding = encoding.decode('utf-8', 'replace')
+        if encoding in CODECS:
+            return encoding
+    return None
+
+
+def compress(data: bytes, accepted: Any) -> Tuple[bytes, Optional[str]]:
+    """
+    Compress a response if the request accepts it and it is worth it.  Short
+    responses are sent as they are, and so are responses whose first
+    COMPRESSION_SAMPLE_SIZE bytes do not compress, such as chunks of already
+    compressed files.  May block for a while on large responses, so run it
+    in an executor.
+
+    :param data: The response
+    :param accepted: The request's ``accept_encoding``
+    :return: (the response to send, its encoding or None if it is not \
+            compressed)
+    """
+    encoding = choose_encoding(accepted)
+    if encoding is None or len(data) < COMPRESSION_MIN_SIZE:
+        return (data, None)
+    (compress_f, _) = CODECS[encoding]
+    if len(data) > COMPRESSION_SAMPLE_SIZE:
+        sample = data[:COMPRESSION_SAMPLE_SIZE]
+        if len(compress_f(sample)) > len(sample) * COMPRESSION_MAX_RATIO:
+            return (data, None)
+    compressed = compress_f(data)
+    if len(compressed) > len(data) * COMPRESSION_MAX_RATIO:
+        return (data, None)
+    return (compressed, encoding)
+
+
+def decompress(
+    data: bytes, encoding: Any, max_size: Optional[int]=None,
+) -> bytes:
+    """
+    Decompress a response
+
+    >>> from syncr_backend.util import compression_util
+    >>> (data, encoding) = compression_util.compress(b'a' * 2048, ['zlib'])
+    >>> len(data) < 2048, encoding
+    (True, 'zlib')
+    >>> compression_util.decompress(data, encoding) == b'a' * 2048
+    True
+
+    :param data: The response
+    :param encoding: The response's ``encoding``
+    :param max_size: Largest decompressed response to accept, by default \
+            MAX_DECOMPRESSED_SIZE
+    :raises UnsupportedEncodingException: If the encoding is unknown, or the \
+            response cannot be decompressed
+    :return: The decompressed response
+    """
+    if isinstance(encoding, bytes):
+        encoding = encoding.decode('utf-8', 'replace')
+    codec = CODECS.get(encoding)
+    if codec is None:
+        raise UnsupportedEncodingException(
+            "unsupported encoding %s" % encoding,
+        )
+    if max_size is None:
+        max_size = MAX_DECOMPRESSED_SIZE
+    try:
+        return codec[1](data, max_size)
+    except zlib.error as e:
+        raise UnsupportedEncodingException(e)
@@ -9,7 +9,6 @@ from typing import List
 from typing import Optional
 from typing import Tuple
 
-import bencode  # type: ignore
 from cryptography.exceptions import InvalidSignature  # type: ignore
 from cryptography.hazmat.backends import default_backend  # type: ignore
 from cryptography.hazmat.primitives import hashes  # type: ignore
@@ -17,6 +16,7 @@ from cryptography.hazmat.primitives import serialization  # type: ignore
 from cryptography.hazmat.primitives.asymmetric import padding  # type: ignore
 from cryptography.hazmat.primitives.asymmetric import rsa  # type: ignore
 
+from syncr_backend.util import bencode_util
 from syncr_backend.util.log_util import get_logger
 
 
@@ -64,7 +64,7 @@ async def hash_dict(d: Dict[str, Any]) -> bytes:
     :return: The hash of bencode(b)
     """
     logger.debug("hashing dict of len %s", len(d))
-    return await hash(bencode.encode(d))
+    return await hash(bencode_util.encode(d))
 
 
 def b64encode(b: bytes) -> bytes:
@@ -105,7 +105,7 @@ def encode_peerlist(
     :param peerlist: list of dht peers
     :return: bytes of encoded peerlist
     """
-    return encode_peerlist_prefix + bencode.encode(list(peerlist))
+    return encode_peerlist_prefix + bencode_util.encode(list(peerlist))
 
 
 def decode_peerlist(rawpl: bytes) -> Optional[List[Any]]:
@@ -129,7 +129,7 @@ def decode_peerlist(rawpl: bytes) -> Optional[List[Any]]:
     else:
         return None
     try:
-        declist = bencode.decode(peerlist)
+        declist = bencode_util.decode(peerlist)
 
         return list(map(lambda x: tuple(x), declist))
     except Exception:
@@ -252,7 +252,7 @@ async def sign_dictionary(
         hashes.SHA256(),
     )
 
-    signature_interface.update(await hash(bencode.encode(dictionary)))
+    signature_interface.update(await hash(bencode_util.encode(dictionary)))
     return signature_interface.finalize()
 
 
@@ -279,7 +279,7 @@ async def verify_signed_dictionary(
         ),
         hashes.SHA256(),
     )
-    verifier.update(await hash(bencode.encode(dictionary)))
+    verifier.update(await hash(bencode_util.encode(dictionary)))
     try:
         verifier.verify()
     except InvalidSignature:
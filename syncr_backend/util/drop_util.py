@@ -1,14 +1,14 @@
 import asyncio
+import hashlib
 import os
-import shutil
 import sys
 import traceback
 from collections import defaultdict
-from random import shuffle
 from typing import AsyncIterator
 from typing import Awaitable  # noqa
 from typing import cast
 from typing import Dict  # noqa
+from typing import Iterable
 from typing import List
 from typing import NamedTuple
 from typing import Optional
@@ -19,30 +19,48 @@ from typing import Union  # noqa
 
 from cachetools import TTLCache  # type: ignore
 
+from syncr_backend.constants import CDC_PROTOCOL_VERSION
 from syncr_backend.constants import DEFAULT_DROP_METADATA_LOCATION
 from syncr_backend.constants import DEFAULT_FILE_METADATA_LOCATION
+from syncr_backend.constants import DEFAULT_INCOMPLETE_EXT
+from syncr_backend.constants import DEFAULT_OLD_FILES_LOCATION
+from syncr_backend.constants import DEFAULT_SYNCED_VERSIONS_FILE
 from syncr_backend.constants import DEFAULT_TIMESTAMP_LOCATION
+from syncr_backend.constants import DEFAULT_VERIFIED_VERSIONS_FILE
+from syncr_backend.constants import FIXED_CHUNKS_PROTOCOL_VERSION
 from syncr_backend.constants import MAX_CHUNKS_PER_PEER
 from syncr_backend.constants import MAX_CONCURRENT_CHUNK_DOWNLOADS
 from syncr_backend.constants import MAX_CONCURRENT_FILE_DOWNLOADS
+from syncr_backend.constants import MAX_RETURNED_PEERS
 from syncr_backend.constants import TRACKER_DROP_AVAILABILITY_TTL
+from syncr_backend.constants import TRACKER_DROP_IP_INDEX
+from syncr_backend.constants import TRACKER_DROP_PORT_INDEX
+from syncr_backend.constants import TRACKER_DROP_TIMESTAMP_INDEX
 from syncr_backend.external_interface import drop_peer_store
 from syncr_backend.init import drop_init
 from syncr_backend.init import node_init
+from syncr_backend.metadata import chunk_index
 from syncr_backend.metadata import drop_metadata
+from syncr_backend.metadata import drop_registry
 from syncr_backend.metadata.drop_metadata import DropMetadata
 from syncr_backend.metadata.drop_metadata import DropVersion
 from syncr_backend.metadata.drop_metadata import get_drop_location
 from syncr_backend.metadata.drop_metadata import list_drops
+from syncr_backend.metadata.drop_metadata import prefetch_pub_keys
 from syncr_backend.metadata.drop_metadata import save_drop_location
 from syncr_backend.metadata.file_metadata import FileMetadata
 from syncr_backend.metadata.file_metadata import get_file_metadata_from_drop_id
 from syncr_backend.metadata.file_metadata import make_file_metadata
 from syncr_backend.network import send_requests
 from syncr_backend.util import async_util
+from syncr_backend.util import chunk_util
 from syncr_backend.util import crypto_util
 from syncr_backend.util import fileio_util
+from syncr_backend.util import network_util
+from syncr_backend.util import watch_util
 from syncr_backend.util.crypto_util import VerificationException
+from syncr_backend.util.journal_util import get_node_journal
+from syncr_backend.util.journal_util import KeyValueJournal
 from syncr_backend.util.log_util import get_logger
 
 
@@ -72,7 +90,9 @@ async def sync_drop(
     logger.info("acquiring lock")
 
     try:
-        drop_peers = await get_drop_peers(drop_id)
+        (drop_peers, _) = await asyncio.gather(
+            get_drop_peers(drop_id), prefetch_pub_keys(drop_id),
+        )
         logger.info("peers: %s", drop_peers)
         await start_drop_from_id(drop_id, save_dir)
         logger.info("version: %s", version)
@@ -82,6 +102,30 @@ async def sync_drop(
         metadata_location = os.path.join(
             save_dir, DEFAULT_DROP_METADATA_LOCATION,
         )
+        old_metadata = await DropMetadata.read_file(
+            id=drop_id, metadata_location=metadata_location, version=None,
+        )
+        # must be found before the new version becomes current
+        unchanged = await find_unchanged_files(
+            old_metadata, drop_metadata, save_dir,
+        )
+        to_sync = {
+            file_name: file_id
+            for (file_name, file_id) in drop_metadata.files.items()
+            if file_name not in unchanged
+        }
+        logger.info(
+            "syncing %s files, %s are unchanged", len(to_sync), len(unchanged),
+        )
+
+        await reuse_local_files(
+            old_metadata, drop_metadata, save_dir, to_sync,
+        )
+        # removed files are deleted while the old version is still current,
+        # so if this stops before the new one is written it is done again
+        if old_metadata is not None and \
+                old_metadata.version != drop_metadata.version:
+            await cleanup_drop(drop_id, old_metadata, drop_metadata)
         await DropMetadata.write_current(
             drop_metadata.id, drop_metadata.version, metadata_location,
         )
@@ -95,7 +139,7 @@ async def sync_drop(
                     # rotate(drop_peers) so each file starts with a new peer
                     peers=rotate(drop_peers),
                     save_dir=save_dir,
-                ) for file_name, file_id in drop_metadata.files.items()
+                ) for file_name, file_id in to_sync.items()
             ],
             n=MAX_CONCURRENT_FILE_DOWNLOADS,
             task_timeout=1,
@@ -109,11 +153,8 @@ async def sync_drop(
 
         if all(file_results) and no_exceptions:
             drop_location = await get_drop_location(drop_id)
-            scanned_files = await fileio_util.scan_current_files(drop_location)
-            await fileio_util.write_timestamp_file(
-                scanned_files,
-                drop_location,
-            )
+            await watch_util.update_timestamp_file(drop_location)
+            mark_version_synced(drop_metadata)
     except Exception as e:
         ex_type, ex, tb = sys.exc_info()
         logger.error("error syncing drop: %s", e)
@@ -124,6 +165,7 @@ async def sync_drop(
         lock.release()
 
     DropMetadata.read_file.cache_clear()  # type: ignore
+    await drop_registry.refresh(drop_id)
 
     return all(file_results) and no_exceptions, drop_id
 
@@ -345,8 +387,7 @@ async def make_new_version(
     if old_drop_m is None:
         peers = await get_drop_peers(drop_id)
         old_drop_m = await get_drop_metadata(drop_id, peers)
-    priv_key = await node_init.load_private_key_from_disk()
-    node_id = await crypto_util.node_id_from_public_key(priv_key.public_key())
+    node_id = (await node_init.get_identity()).node_id
 
     if node_id not in old_drop_m.other_owners and node_id != old_drop_m.owner:
         raise PermissionError("You are not the owner of this drop")
@@ -357,6 +398,7 @@ async def make_new_version(
         owner=old_drop_m.owner,
         other_owners=old_drop_m.other_owners,
         drop_id=old_drop_m.id,
+        file_protocol_version=await get_file_protocol_version(old_drop_m),
         # TODO: ignore?
     )
 
@@ -374,15 +416,6 @@ async def make_new_version(
         old_drop_m.version.version + 1,
         crypto_util.random_int(),
     )
-    # deletes the existing metadata files
-    await asyncio.get_event_loop().run_in_executor(
-        None,
-        shutil.rmtree,
-        os.path.join(
-            drop_directory, DEFAULT_FILE_METADATA_LOCATION,
-        ),
-    )
-
     await new_drop_m.write_file(
         is_current=True,
         is_latest=True,
@@ -390,18 +423,33 @@ async def make_new_version(
             drop_directory, DEFAULT_DROP_METADATA_LOCATION,
         ),
     )
-    for f_m in new_files_m.values():
-        await f_m.write_file(
-            os.path.join(drop_directory, DEFAULT_FILE_METADATA_LOCATION),
-        )
+    # replaces the existing file metadata
+    await FileMetadata.write_files(
+        os.path.join(drop_directory, DEFAULT_FILE_METADATA_LOCATION),
+        new_files_m.values(),
+        replace=True,
+    )
+    await chunk_index.index_files(new_files_m)
 
     DropMetadata.read_file.cache_clear()  # type: ignore
+    await drop_registry.refresh(drop_id)
 
-    scanned_files = await fileio_util.scan_current_files(drop_directory)
-    await fileio_util.write_timestamp_file(
-        scanned_files,
-        drop_directory,
-    )
+    await watch_util.update_timestamp_file(drop_directory)
+    mark_version_synced(new_drop_m)
+
+
+async def get_file_protocol_version(drop_m: DropMetadata) -> int:
+    """How the files in a version of a drop are split into chunks, so the
+    next version can split them the same way
+
+    :param drop_m: The drop metadata of the version
+    :return: The file metadata protocol version of its files
+    """
+    for file_id in drop_m.files.values():
+        file_m = await get_file_metadata_from_drop_id(drop_m.id, file_id)
+        if file_m is not None:
+            return file_m.protocol_version
+    return FIXED_CHUNKS_PROTOCOL_VERSION
 
 
 async def start_drop_from_id(drop_id: bytes, save_dir: str) -> None:
@@ -426,6 +474,8 @@ async def start_drop_from_id(drop_id: bytes, save_dir: str) -> None:
         os.path.join(save_dir, DEFAULT_FILE_METADATA_LOCATION), exist_ok=True,
     )
     await save_drop_location(drop_id, save_dir)
+    drop_registry.remove(drop_id)
+    drop_peer_store.announce_drop(drop_id)
 
 
 async def do_metadata_request(
@@ -481,10 +531,68 @@ async def get_drop_metadata(
         )
 
     if do_verification:
+        await prefetch_pub_keys(drop_id, metadata)
         await verify_version(metadata)
     return metadata
 
 
+async def reuse_local_files(
+    old_metadata: Optional[DropMetadata], new_metadata: DropMetadata,
+    save_dir: str, names: Optional[Iterable[str]]=None,
+) -> int:
+    """
+    Put files of a new version that are already on disk under another name in
+    place, before anything is downloaded.  A file is on disk if it has the
+    same file id under another name, in the old version or the new one.
+    Files that were renamed are moved, and other duplicates are copied.
+    Either way, the contents are checked against the file metadata when the
+    file is synced, so a file changed locally is only partly downloaded.
+
+    :param old_metadata: The version on disk, if any
+    :param new_metadata: The version being synced
+    :param save_dir: Where the drop is saved
+    :param names: The files of the new version to look for, or None for all \
+            of them
+    :return: How many files were put in place
+    """
+    new_files = new_metadata.files
+    old_files = {} if old_metadata is None else old_metadata.files
+    names_by_id = defaultdict(list)  # type: Dict[bytes, List[str]]
+    for files in (old_files, new_files):
+        for (name, file_id) in sorted(files.items()):
+            if name not in names_by_id[file_id]:
+                names_by_id[file_id].append(name)
+    # names that are gone in the new version can be moved instead of copied
+    movable = set(old_files) - set(new_files)
+
+    if names is None:
+        names = new_files
+    done = 0
+    for name in sorted(names):
+        file_id = new_files[name]
+        full_path = os.path.join(save_dir, name)
+        if os.path.exists(full_path) or \
+                os.path.exists(full_path + DEFAULT_INCOMPLETE_EXT):
+            continue
+        for src_name in names_by_id[file_id]:
+            src_path = os.path.join(save_dir, src_name)
+            if src_name == name or not os.path.isfile(src_path):
+                continue
+            if src_name in movable:
+                logger.info("%s was renamed to %s", src_name, name)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(src_path, full_path)
+                movable.remove(src_name)
+            else:
+                logger.info("copying %s to %s", src_name, name)
+                await fileio_util.copy_file(src_path, full_path)
+            done += 1
+            break
+    if done:
+        logger.info("%s files were already on disk", done)
+    return done
+
+
 async def cleanup_drop(
     drop_id: bytes, old_metadata: Optional[DropMetadata],
     new_metadata: Optional[DropMetadata],
@@ -505,47 +613,133 @@ async def cleanup_drop(
     to_delete = old_files - new_files
 
     drop_location = await get_drop_location(drop_id)
+    index = chunk_index.get_chunk_index()
     for old_file in to_delete:
         file_location = os.path.join(drop_location, old_file)
         if os.path.isfile(file_location):
             os.remove(file_location)
+        if index is not None:
+            await index.remove_file(os.path.abspath(file_location))
+
+
+def _verified_version_key(drop_metadata: DropMetadata) -> str:
+    return DropMetadata.make_filename(drop_metadata.id, drop_metadata.version)
+
+
+def _sig_digest(drop_metadata: DropMetadata) -> Optional[str]:
+    if drop_metadata.sig is None:
+        return None
+    return hashlib.sha256(drop_metadata.sig).hexdigest()
+
+
+def _is_version_verified(
+    verified: Optional[KeyValueJournal], drop_metadata: DropMetadata,
+) -> bool:
+    """
+    Check the ledger of verified versions for a version
+
+    :param verified: The ledger, from version to signature hash
+    :param drop_metadata: The version to look up
+    :return: Whether the version, and so every version before it, is verified
+    """
+    if verified is None:
+        return False
+    digest = _sig_digest(drop_metadata)
+    return digest is not None and \
+        verified.get(_verified_version_key(drop_metadata)) == digest
 
 
 async def verify_version(
     drop_metadata: DropMetadata,
     peers: List[Tuple[str, int]]=[],
 ) -> None:
-    """Verify the DropMetadata version recursively
+    """Verify the DropMetadata version and all prior versions
 
     If this version and all prior versions leading up to it are legitimate
-    returns none, otherwise throws a VerificationException
+    returns none, otherwise throws a VerificationException.  Versions
+    verified before are recorded in a ledger in the node init dir, so only
+    versions newer than those are checked.  The chain of versions is walked
+    back one generation at a time, fetching each generation concurrently.
 
     :param drop_metadata: A DropMetadata object
     :param peers: List of peers to download metadata objects from
     :raises VerificationException: If this version or any parent versions \
             cannot be verified
     """
-    if len(drop_metadata.previous_versions) == 0:
-        await drop_metadata.verify_header()
+    verified = get_node_journal(DEFAULT_VERIFIED_VERSIONS_FILE)
+    if _is_version_verified(verified, drop_metadata):
         return
-    elif len(drop_metadata.previous_versions) == 1:
-        version = drop_metadata.previous_versions[0]
-        if not version < drop_metadata.version:
-            raise VerificationException(
-                "new version not more than previous; new %s, old %s" % (
-                    drop_metadata.version, version,
-                ),
-            )
+
+    chain = {drop_metadata.version: drop_metadata}
+    unverified = [drop_metadata]
+    generation = [drop_metadata]
+    while generation:
+        needed = set()  # type: Set[DropVersion]
+        for dm in generation:
+            for version in dm.previous_versions:
+                if not version < dm.version:
+                    raise VerificationException(
+                        "new version not more than previous; new %s, old %s"
+                        % (dm.version, version),
+                    )
+                if version not in chain:
+                    needed.add(version)
+        if not needed:
+            break
+
         if not peers:
             try:
                 peers = await get_drop_peers(drop_metadata.id)
             except PeerStoreError:
                 peers = []
-        dmd = await get_drop_metadata(
-            drop_metadata.id, peers, version=version, do_verification=False,
+        versions = list(needed)
+        logger.debug(
+            "fetching %s previous versions of %s", len(versions),
+            crypto_util.b64encode(drop_metadata.id),
         )
-        await verify_version(dmd, peers)
+        fetched = await asyncio.gather(*[
+            get_drop_metadata(
+                drop_metadata.id, peers, version=version,
+                do_verification=False,
+            ) for version in versions
+        ])
+
+        generation = []
+        for (version, dm) in zip(versions, fetched):
+            chain[version] = dm
+            if not _is_version_verified(verified, dm):
+                generation.append(dm)
+        unverified.extend(generation)
+
+    logger.debug(
+        "verifying %s versions of %s", len(unverified),
+        crypto_util.b64encode(drop_metadata.id),
+    )
+    await asyncio.gather(*[
+        _verify_version_link(
+            dm, [chain[version] for version in dm.previous_versions],
+        ) for dm in unverified
+    ])
+
+    if verified is not None:
+        verified.set_many([
+            (_verified_version_key(dm), _sig_digest(dm)) for dm in unverified
+        ])
+
+
+async def _verify_version_link(
+    drop_metadata: DropMetadata, previous: List[DropMetadata],
+) -> None:
+    """Verify one version against the versions before it
 
+    :param drop_metadata: A DropMetadata object
+    :param previous: The DropMetadata of its previous versions
+    :raises VerificationException: If this version cannot be verified
+    """
+    if len(previous) == 0:
+        await drop_metadata.verify_header()
+    elif len(previous) == 1:
+        dmd = previous[0]
         if drop_metadata.signed_by == dmd.owner:
             logger.debug(
                 "Beginning ownership change verification for drop: %s",
@@ -573,20 +767,12 @@ async def verify_version(
         primary_owner = drop_metadata.owner
         if primary_owner != drop_metadata.signed_by:
             raise VerificationException()
-        for version in drop_metadata.previous_versions:
-            if not version < drop_metadata.version:
-                raise VerificationException("version not more than previous")
-            if peers is None:
-                peers = await get_drop_peers(drop_metadata.id)
-            dmd = await get_drop_metadata(
-                drop_metadata.id, peers, version=version,
-                do_verification=False,
-            )
-            await verify_version(dmd, peers)
+        for dmd in previous:
             if primary_owner != dmd.owner:
                 raise VerificationException(
                     "merge branch not signed by primary owner",
                 )
+        await drop_metadata.verify_header()
 
 
 async def get_owned_subscribed_drops_metadata(
@@ -602,8 +788,7 @@ async def get_owned_subscribed_drops_metadata(
     drops = list_drops()
 
     # Get id of current node
-    priv_key = await node_init.load_private_key_from_disk()
-    node_id = await crypto_util.node_id_from_public_key(priv_key.public_key())
+    node_id = (await node_init.get_identity()).node_id
 
     owned_drops = []
     subscribed_drops = []
@@ -698,14 +883,32 @@ async def find_changes_in_new_version(
         return None
     assert drop_metadata.version < new_metadata.version, "New version required"
 
+    return diff_versions(drop_metadata.files, new_metadata.files)
+
+
+def diff_versions(
+    old_files: Dict[str, bytes], new_files: Dict[str, bytes],
+) -> FileUpdateStatus:
+    """
+    Compare the files of two versions of a drop
+
+    >>> from syncr_backend.util.drop_util import diff_versions
+    >>> status = diff_versions({'a': b'1', 'b': b'2'}, {'a': b'1', 'c': b'3'})
+    >>> status.added, status.removed, status.changed, status.unchanged
+    ({'c'}, {'b'}, set(), {'a'})
+
+    :param old_files: file name -> file id of the old version
+    :param new_files: file name -> file id of the new version
+    :return: FileUpdateStatus of the new version relative to the old one
+    """
     added_files = set()
     changed_files = set()
     unchanged_files = set()
-    removed_files = set(drop_metadata.files.keys())
+    removed_files = set(old_files.keys())
 
-    for (name, id) in new_metadata.files.items():
+    for (name, file_id) in new_files.items():
         if name in removed_files:
-            if drop_metadata.files[name] == new_metadata.files[name]:
+            if old_files[name] == file_id:
                 unchanged_files.add(name)
             else:
                 changed_files.add(name)
@@ -721,6 +924,70 @@ async def find_changes_in_new_version(
     )
 
 
+def _synced_version_key(drop_metadata: DropMetadata) -> str:
+    return crypto_util.b64encode(drop_metadata.id).decode('utf-8')
+
+
+def mark_version_synced(drop_metadata: DropMetadata) -> None:
+    """
+    Record that every file of a drop version is on disk, and that the drop's
+    timestamp file was just written
+
+    :param drop_metadata: The version
+    """
+    synced = get_node_journal(DEFAULT_SYNCED_VERSIONS_FILE)
+    if synced is not None:
+        synced.set(
+            _synced_version_key(drop_metadata),
+            [drop_metadata.version.version, drop_metadata.version.nonce],
+        )
+
+
+def is_version_synced(drop_metadata: DropMetadata) -> bool:
+    """
+    Check whether a drop version was the last one completely synced
+
+    :param drop_metadata: The version
+    :return: Whether every file of it was on disk when the timestamp file \
+            was last written
+    """
+    synced = get_node_journal(DEFAULT_SYNCED_VERSIONS_FILE)
+    return synced is not None and synced.get(
+        _synced_version_key(drop_metadata),
+    ) == [drop_metadata.version.version, drop_metadata.version.nonce]
+
+
+async def find_unchanged_files(
+    old_metadata: Optional[DropMetadata], new_metadata: DropMetadata,
+    save_dir: str,
+) -> Set[str]:
+    """
+    Find the files of a new version that are already on disk, without
+    reading them: files with the same file id in the old version, if it was
+    completely synced, that were not changed locally since.  Local changes
+    are found from the timestamp file, so this only stats files, or does
+    nothing at all if the drop is watched.  Call it while the old version is
+    still current.
+
+    :param old_metadata: The current version, if any
+    :param new_metadata: The version being synced
+    :param save_dir: Where the drop is saved
+    :return: The names of the files that need no syncing
+    """
+    if old_metadata is None or not is_version_synced(old_metadata) or \
+            not os.path.exists(
+                os.path.join(save_dir, DEFAULT_TIMESTAMP_LOCATION),
+            ):
+        return set()
+    unchanged = diff_versions(old_metadata.files, new_metadata.files).unchanged
+    if not unchanged:
+        return unchanged
+    local = await check_for_changes(old_metadata.id)
+    if local is None:
+        return set()
+    return unchanged - local.changed - local.removed
+
+
 async def check_for_changes(drop_id: bytes) -> Optional[FileUpdateStatus]:
     """Checks over the local drop and returns what files have local
     changes if any
@@ -750,9 +1017,28 @@ async def check_for_changes(drop_id: bytes) -> Optional[FileUpdateStatus]:
             drop_metadata,
         )
 
-    files = await fileio_util.scan_current_files(drop_location)
+    watcher = await watch_util.get_watcher(drop_location)
+    if watcher is not None:
+        changes = watcher.changes()
+        if changes is not None:
+            # only look at what changed since the timestamp file was written
+            old_files = await fileio_util.read_timestamp_file(drop_location)
+            # this walks new directories
+            checked = await asyncio.get_event_loop().run_in_executor(
+                None, watch_util.expand_changes, drop_location, changes,
+                old_files,
+            )
+            files = fileio_util.get_file_fingerprints(drop_location, checked)
+            return diff_timestamps(old_files, files, checked)
+        token = watcher.begin_scan()
 
-    return await diff_timestamp_file(files, drop_location)
+    files = await fileio_util.scan_current_files(drop_location)
+    status = await diff_timestamp_file(files, drop_location)
+    if watcher is not None:
+        watcher.end_scan(
+            token, status.added | status.removed | status.changed,
+        )
+    return status
 
 
 async def fallback_check_for_changes(
@@ -769,27 +1055,29 @@ async def fallback_check_for_changes(
     logger.info("Checking for local changes in drop (fallback): %s", drop_id)
     drop_location = await get_drop_location(drop_id)
 
-    files = {}
+    starting_files = set()
     for (dirpath, filename) in fileio_util.walk_with_ignore(
         drop_location, [],
     ):
         full_name = os.path.join(dirpath, filename)
-        rel_name = os.path.relpath(full_name, drop_location)
-        files[rel_name] = await make_file_metadata(
-            full_name, drop_id,
-        )
+        starting_files.add(os.path.relpath(full_name, drop_location))
 
     changed_files = set()
     removed_files = set()
     unchanged_files = set()
-    starting_files = set(files.keys())
 
     for (name, id) in drop_metadata.files.items():
         if name in starting_files:
             temp_metadata = await get_file_metadata_from_drop_id(
                 drop_id, id,
             )
-            if temp_metadata == files[name]:
+            # split the file the same way to compare its chunks
+            protocol_version = FIXED_CHUNKS_PROTOCOL_VERSION \
+                if temp_metadata is None else temp_metadata.protocol_version
+            current_metadata = await make_file_metadata(
+                os.path.join(drop_location, name), drop_id, protocol_version,
+            )
+            if temp_metadata == current_metadata:
                 unchanged_files.add(name)
             else:
                 changed_files.add(name)
@@ -806,34 +1094,56 @@ async def fallback_check_for_changes(
 
 
 async def diff_timestamp_file(
-    current_files: Dict[str, int],
+    current_files: Dict[str, fileio_util.Fingerprint],
     drop_location: str,
 ) -> FileUpdateStatus:
     """
     Reads the timestamp file and compares it to the current files
 
-    :param current_files: Dictionary that stores filepath and timestamp
+    :param current_files: Dictionary that stores filepath and fingerprint
     :return: FileUpdateStatus constructed from the difference of the \
     current_files Dictionary and the loaded Dictionary from the timestamp file
     """
-
     timestamp_files = await fileio_util.read_timestamp_file(drop_location)
-    # current is the set of currently existing filepaths
-    current = set(current_files.keys())
-    # old is the set of previous existing filepaths
-    old = set(timestamp_files.keys())
+    return diff_timestamps(timestamp_files, current_files)
+
+
+def diff_timestamps(
+    old_files: Dict[str, fileio_util.Fingerprint],
+    current_files: Dict[str, fileio_util.Fingerprint],
+    checked: Optional[Set[str]]=None,
+) -> FileUpdateStatus:
+    """
+    Compare the files in a timestamp file to the current files
+
+    :param old_files: Dictionary of filepath and fingerprint when the \
+    timestamp file was written
+    :param current_files: Dictionary of filepath and current fingerprint
+    :param checked: If given, current_files only has these files (those \
+    that still exist), and every other file is unchanged
+    :return: FileUpdateStatus of the difference
+    """
+    if checked is None:
+        checked = set(old_files) | set(current_files)
     # files that are in current but not in old are added files
-    added_files = current - old
+    added_files = {
+        filepath for filepath in checked
+        if filepath in current_files and filepath not in old_files
+    }
     # files that are in the old but not in current have been removed
-    removed_files = old - current
+    removed_files = {
+        filepath for filepath in checked
+        if filepath in old_files and filepath not in current_files
+    }
     # files that are in both old and current could have been changed
-    # get all unchanged files
-    unchanged_files = {
-        filepath for filepath in (current.intersection(old))
-        if timestamp_files[filepath] == current_files[filepath]
+    changed_files = {
+        filepath for filepath in checked
+        if filepath in old_files and filepath in current_files and
+        not fileio_util.same_fingerprint(
+            old_files[filepath], current_files[filepath],
+        )
     }
-    # files that are in both old and current and not unchanged are changed
-    changed_files = current.intersection(old) - unchanged_files
+    unchanged_files = set(old_files) - removed_files - changed_files
 
     return FileUpdateStatus(
         added=added_files,
@@ -875,10 +1185,29 @@ async def sync_file_contents(
             await fileio_util.create_file(full_path, file_metadata.file_length)
         return needed_chunks
 
-    await fileio_util.create_file(full_path, file_metadata.file_length)
-
-    if needed_chunks is None:
+    old_path = os.path.join(
+        save_dir, DEFAULT_OLD_FILES_LOCATION,
+        hashlib.sha256(file_name.encode('utf-8')).hexdigest(),
+    )
+    if await fileio_util.create_file(
+        full_path, file_metadata.file_length, old_path,
+    ):
+        try:
+            file_metadata.set_downloaded_chunks(
+                await reuse_old_chunks(file_metadata, old_path, full_path),
+            )
+        finally:
+            os.remove(old_path)
         needed_chunks = await file_metadata.needed_chunks
+    elif needed_chunks is None:
+        needed_chunks = await file_metadata.needed_chunks
+
+    if needed_chunks:
+        for chunk_id in await copy_local_chunks(
+            file_metadata, full_path, needed_chunks,
+        ):
+            await file_metadata.finish_chunk(chunk_id)
+            needed_chunks.remove(chunk_id)
 
     process_queue = asyncio.Queue()  # type: asyncio.Queue[Awaitable[Optional[int]]] # noqa
     result_queue = asyncio.Queue()  # type: asyncio.Queue[Union[Optional[int], BaseException]] # noqa
@@ -924,6 +1253,114 @@ async def sync_file_contents(
     return needed_chunks
 
 
+async def reuse_old_chunks(
+    file_metadata: FileMetadata, old_path: str, full_path: str,
+) -> Set[int]:
+    """Copy the chunks the old contents of a file already have into its new
+    incomplete file, wherever they are in the old contents
+
+    :param file_metadata: the file metadata of the new version
+    :param old_path: where the old contents are
+    :param full_path: the path of the file
+    :return: The chunk ids copied
+    """
+    ranges = [
+        file_metadata.chunk_range(chunk_id)
+        for chunk_id in range(file_metadata.num_chunks)
+    ]
+    loop = asyncio.get_event_loop()
+    index = await loop.run_in_executor(
+        None, chunk_util.index_chunks, old_path, ranges,
+        file_metadata.protocol_version == CDC_PROTOCOL_VERSION,
+    )
+    copies = {}  # type: Dict[int, Tuple[int, int, int, bytes]]
+    for (chunk_id, chunk_hash) in enumerate(file_metadata.hashes):
+        found = index.get(chunk_hash)
+        if found is not None:
+            (offset, length) = ranges[chunk_id]
+            copies[chunk_id] = (found[0], offset, length, chunk_hash)
+    copied = await fileio_util.copy_chunks(old_path, full_path, copies)
+    logger.info(
+        "reused %s of %s chunks of %s", len(copied), file_metadata.num_chunks,
+        full_path,
+    )
+    await record_chunks(file_metadata, full_path, copied)
+    return copied
+
+
+async def copy_local_chunks(
+    file_metadata: FileMetadata, full_path: str, needed_chunks: Set[int],
+) -> Set[int]:
+    """Copy the needed chunks of a file that are already somewhere on this
+    node, in any file of any drop, into its incomplete file
+
+    :param file_metadata: the file metadata of the file
+    :param full_path: the path of the file
+    :param needed_chunks: the chunk ids to look for
+    :return: The chunk ids copied
+    """
+    index = chunk_index.get_chunk_index()
+    if index is None:
+        return set()
+    found = await index.lookup(
+        file_metadata.hashes[chunk_id] for chunk_id in needed_chunks
+    )
+    # source path -> chunk id -> copy, trying each source a chunk is in
+    # until one of them still has it
+    own_path = os.path.abspath(full_path)
+    sources = {}  # type: Dict[str, Dict[int, Tuple[int, int, int, bytes]]]
+    for chunk_id in needed_chunks:
+        chunk_hash = file_metadata.hashes[chunk_id]
+        (offset, length) = file_metadata.chunk_range(chunk_id)
+        for (path, src_offset, src_length) in found.get(chunk_hash, []):
+            if src_length == length and path != own_path:
+                sources.setdefault(path, {})[chunk_id] = (
+                    src_offset, offset, length, chunk_hash,
+                )
+
+    copied = set()  # type: Set[int]
+    for (path, copies) in sources.items():
+        copies = {
+            chunk_id: copy for (chunk_id, copy) in copies.items()
+            if chunk_id not in copied
+        }
+        if not copies:
+            continue
+        # the chunks of incomplete files are recorded as they are verified
+        for src_path in (path, path + DEFAULT_INCOMPLETE_EXT):
+            try:
+                copied |= await fileio_util.copy_chunks(
+                    src_path, full_path, copies,
+                )
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            await index.remove_file(path)
+
+    if copied:
+        logger.info(
+            "copied %s of %s needed chunks of %s from this node",
+            len(copied), len(needed_chunks), full_path,
+        )
+        await record_chunks(file_metadata, full_path, copied)
+    return copied
+
+
+async def record_chunks(
+    file_metadata: FileMetadata, full_path: str, chunk_ids: Iterable[int],
+) -> None:
+    """Record verified chunks of a file in this node's chunk index
+
+    :param file_metadata: the file metadata of the file
+    :param full_path: the path of the file
+    :param chunk_ids: the chunks that were verified
+    """
+    index = chunk_index.get_chunk_index()
+    if index is not None:
+        await index.add_file(full_path, file_metadata, chunk_ids)
+
+
 async def peers_and_chunks(
     peers: List[Tuple[str, int]], needed_chunks: Set[int],
     drop_id: bytes, file_id: bytes, chunks_per_peer: int,
@@ -997,14 +1434,17 @@ async def download_chunk_from_peer(
         file_id=file_id,
         file_index=file_index,
     )
+    (offset, _) = file_metadata.chunk_range(file_index)
     try:
         await fileio_util.write_chunk(
             filepath=full_path,
             position=file_index,
             contents=chunk,
             chunk_hash=file_metadata.hashes[file_index],
+            offset=offset,
         )
         await file_metadata.finish_chunk(file_index)
+        await record_chunks(file_metadata, full_path, [file_index])
         return file_index
     except crypto_util.VerificationException as e:
         logger.warning(
@@ -1022,14 +1462,15 @@ class PeerStoreError(Exception):
 @async_util.async_cache(cache_obj=TTLCache, ttl=5)
 async def get_drop_peers(drop_id: bytes) -> List[Tuple[str, int]]:
     """
-    Gets the peers that have a drop. Also shuffles the list
+    Gets the peers that have a drop, at most ``max_returned_peers`` from the
+    dps config (MAX_RETURNED_PEERS by default).  The most recently announced
+    peers come first, followed by a random sample of the rest.
 
     :param drop_id: id of drop
     :raises PeerStoreError: If peers cannot be found
     :return: A list of peers in format (ip, port)
     """
-    priv_key = await node_init.load_private_key_from_disk()
-    node_id = await crypto_util.node_id_from_public_key(priv_key.public_key())
+    node_id = (await node_init.get_identity()).node_id
     drop_peer_store_instance = await drop_peer_store.get_drop_peer_store(
         node_id,
     )
@@ -1038,18 +1479,30 @@ async def get_drop_peers(drop_id: bytes) -> List[Tuple[str, int]]:
         encoded_id = crypto_util.b64encode(drop_id)
         raise PeerStoreError("No peers found for drop %s" % encoded_id)
 
+    # trackers send when each peer was announced, the dht sends its peers
+    # freshest first
+    drop_peers = list(drop_peers)
+    if all(len(peer) > TRACKER_DROP_TIMESTAMP_INDEX for peer in drop_peers):
+        drop_peers.sort(
+            key=lambda peer: peer[TRACKER_DROP_TIMESTAMP_INDEX], reverse=True,
+        )
+
+    my_ip = send_requests.get_my_ip()[0]
     peers = [
-        (ip, int(port)) for peer_name, ip, port in drop_peers
-        if ip != send_requests.get_my_ip()[0]
+        (
+            cast(str, peer[TRACKER_DROP_IP_INDEX]),
+            int(peer[TRACKER_DROP_PORT_INDEX]),
+        )
+        for peer in drop_peers if peer[TRACKER_DROP_IP_INDEX] != my_ip
     ]
 
     if not peers:
         encoded_id = crypto_util.b64encode(drop_id)
         raise PeerStoreError("No peers found for drop %s" % encoded_id)
 
-    shuffle(peers)
-
-    return peers
+    config_file = await fileio_util.load_config_file()
+    limit = int(config_file.get('max_returned_peers', MAX_RETURNED_PEERS))
+    return network_util.select_peers(peers, limit)
 
 
 def get_drop_id_from_directory(save_dir: str) -> Optional[bytes]:
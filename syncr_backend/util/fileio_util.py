@@ -1,27 +1,36 @@
 """Helper functions for reading from and writing to the filesystem"""
 import asyncio
+import concurrent.futures
 import fnmatch
+import hashlib
 import json
 import os
+import re
+import shutil
+import stat
 from collections import defaultdict
 from typing import Any
 from typing import Dict  # noqa
+from typing import Iterable
 from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Set
 from typing import Tuple
 
 import aiofiles  # type: ignore
-import bencode  # type: ignore
 
 from syncr_backend.constants import DEFAULT_CHUNK_SIZE
 from syncr_backend.constants import DEFAULT_DPS_CONFIG_FILE
 from syncr_backend.constants import DEFAULT_IGNORE
+from syncr_backend.constants import DEFAULT_IGNORE_FILE
 from syncr_backend.constants import DEFAULT_INCOMPLETE_EXT
 from syncr_backend.constants import DEFAULT_TIMESTAMP_LOCATION
+from syncr_backend.constants import MAX_CONCURRENT_SCANS
 from syncr_backend.external_interface.store_exceptions import \
     MissingConfigError
 from syncr_backend.init.node_init import get_full_init_directory
+from syncr_backend.util import bencode_util
 from syncr_backend.util import crypto_util
 from syncr_backend.util.log_util import get_logger
 
@@ -32,9 +41,13 @@ logger = get_logger(__name__)
 write_locks = defaultdict(asyncio.Lock)  # type: Dict[str, asyncio.Lock]
 
 
+_config_cache = {}  # type: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]]
+
+
 async def load_config_file() -> Dict[str, Any]:
     """
-    Read and parse the Drop Peer Store config
+    Read and parse the Drop Peer Store config.  The parsed config is kept,
+    and only read again when the file changes.
 
     :raises MissingConfigError: If the dps config cannot be found
     :return: Parsed dict of config file contents
@@ -42,39 +55,271 @@ async def load_config_file() -> Dict[str, Any]:
     init_directory = get_full_init_directory(None)
     dps_config_path = os.path.join(init_directory, DEFAULT_DPS_CONFIG_FILE)
 
-    if not os.path.isfile(dps_config_path):
+    try:
+        st = os.stat(dps_config_path)
+    except FileNotFoundError:
         raise MissingConfigError()
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _config_cache.get(dps_config_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
 
+    logger.debug("reading config file %s", dps_config_path)
     async with aiofiles.open(dps_config_path) as f:
         config_txt = await f.read()
         config_file = json.loads(config_txt)
 
+    _config_cache[dps_config_path] = (stamp, config_file)
     return config_file
 
 
+class IgnoreMatcher(object):
+    """
+    Ignore patterns, compiled into regexes once.  A directory is ignored if
+    its name or its path relative to the drop matches a pattern, or its path
+    starts with one, and then so is everything under it.  A file is ignored if
+    its name or its relative path matches a pattern.
+
+    >>> matcher = IgnoreMatcher(['.5yncr', '*.tmp', 'build'])
+    >>> matcher.ignored('a/b.tmp'), matcher.ignored('src/build/x')
+    (True, True)
+    >>> matcher.ignored('src/a.py'), matcher.ignored('.5yncrrc')
+    (False, False)
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        """
+        :param patterns: fnmatch patterns to ignore
+        """
+        self.patterns = list(patterns)
+        globs = [fnmatch.translate(p) for p in self.patterns]
+        prefixes = [re.escape(p) + re.escape(os.sep) for p in self.patterns]
+        self._name_re = re.compile('|'.join(globs) or '(?!)')
+        self._path_re = re.compile('|'.join(globs + prefixes) or '(?!)')
+
+    def dir_ignored(self, rel_dir: str) -> bool:
+        """Whether a directory, relative to the drop, is ignored.  Its parents
+        are not checked."""
+        return self._path_re.match(rel_dir) is not None or \
+            self._name_re.match(os.path.basename(rel_dir)) is not None
+
+    def file_ignored(self, rel_dir: str, name: str) -> bool:
+        """Whether a file in a directory that is not ignored is ignored"""
+        return self._name_re.match(name) is not None or \
+            self._path_re.match(os.path.join(rel_dir, name)) is not None
+
+    def ignored(self, rel_path: str) -> bool:
+        """Whether a file, relative to the drop, is ignored"""
+        (rel_dir, name) = os.path.split(rel_path)
+        parent = ''
+        for part in rel_dir.split(os.sep) if rel_dir else []:
+            parent = os.path.join(parent, part)
+            if self.dir_ignored(parent):
+                return True
+        return self.file_ignored(rel_dir, name)
+
+
+def read_ignore_file(path: str) -> List[str]:
+    """
+    Read the patterns in an ignore file: one per line, skipping blank lines
+    and comments starting with #.  A leading or trailing / is dropped.
+
+    :param path: The ignore file
+    :return: The patterns
+    """
+    with open(path) as f:
+        lines = [line.strip() for line in f]
+    return [
+        line.strip('/') for line in lines
+        if line and not line.startswith('#') and line.strip('/')
+    ]
+
+
+_IgnoreKey = Tuple[str, Tuple[str, ...]]
+_IgnoreEntry = Tuple[Optional[Tuple[int, int]], IgnoreMatcher]
+#: (drop location, patterns) -> (.syncrignore stamp, matcher)
+_ignore_matchers = {}  # type: Dict[_IgnoreKey, _IgnoreEntry]
+
+
+def get_ignore_matcher(
+    drop_location: str, ignore: Iterable[str]=(),
+) -> IgnoreMatcher:
+    """
+    Get the matcher for a drop, of the given patterns, DEFAULT_IGNORE, and the
+    patterns in the drop's .syncrignore file.  Matchers are kept, and only
+    made again when the .syncrignore file changes.
+
+    :param drop_location: The drop's directory
+    :param ignore: More patterns to ignore
+    :return: The matcher
+    """
+    ignore_file = os.path.join(drop_location, DEFAULT_IGNORE_FILE)
+    try:
+        st = os.stat(ignore_file)
+        stamp = (st.st_mtime_ns, st.st_size)  # type: Optional[Tuple[int, int]]
+    except OSError:
+        stamp = None
+    key = (drop_location, tuple(ignore))
+    cached = _ignore_matchers.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    patterns = list(ignore) + DEFAULT_IGNORE
+    if stamp is not None:
+        try:
+            patterns += read_ignore_file(ignore_file)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning("cannot read %s: %s", ignore_file, e)
+    matcher = IgnoreMatcher(patterns)
+    _ignore_matchers[key] = (stamp, matcher)
+    return matcher
+
+
+#: What the timestamp file keeps for each file: (size, mtime in ns, inode)
+Fingerprint = Tuple[int, int, int]
+
+
+def fingerprint(st: os.stat_result) -> Fingerprint:
+    """Make the fingerprint of a file from its stat result"""
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def same_fingerprint(old: Fingerprint, new: Fingerprint) -> bool:
+    """
+    Whether a file is unchanged.  Fingerprints from timestamp files written
+    before they had a size and inode only have the mtime in whole seconds.
+
+    >>> same_fingerprint((-1, 5 * 10**9, -1), (3, 5 * 10**9 + 7, 2))
+    True
+    >>> same_fingerprint((3, 5 * 10**9, 2), (3, 5 * 10**9 + 7, 2))
+    False
+
+    :param old: Fingerprint from the timestamp file
+    :param new: Current fingerprint
+    :return: True if the file is unchanged
+    """
+    if old[0] == -1:
+        return old[1] == new[1] // 10**9 * 10**9
+    return old == new
+
+
 async def scan_current_files(
     drop_location: str,
-) -> Dict[str, int]:
+) -> Dict[str, Fingerprint]:
+    """
+    Scans the drop_location and collects files found into a dictionary.
+    The scan runs in an executor.
+
+    :return: dictionary of filepath,fingerprint
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, scan_files, drop_location)
+
+
+def _scan_dir(
+    drop_location: str, rel_dir: str, matcher: IgnoreMatcher,
+) -> Tuple[Dict[str, Fingerprint], List[str]]:
+    """
+    Scan one directory of a drop, leaving out what matcher ignores
+
+    :return: (fingerprints of the files, subdirectories), relative to the drop
+    """
+    files = {}  # type: Dict[str, Fingerprint]
+    subdirs = []  # type: List[str]
+    try:
+        entries = list(os.scandir(os.path.join(drop_location, rel_dir)))
+    except OSError as e:
+        logger.warning("cannot scan %s: %s", rel_dir, e)
+        return (files, subdirs)
+    for entry in entries:
+        rel_name = os.path.join(rel_dir, entry.name)
+        try:
+            if entry.is_dir():
+                # like os.walk, do not follow links to directories
+                if not entry.is_symlink() and \
+                        not matcher.dir_ignored(rel_name):
+                    subdirs.append(rel_name)
+            elif not matcher.file_ignored(rel_dir, entry.name):
+                files[rel_name] = fingerprint(entry.stat())
+        except OSError:
+            # removed since listing the directory, or a broken link
+            continue
+    return (files, subdirs)
+
+
+def scan_files(
+    drop_location: str, workers: int=MAX_CONCURRENT_SCANS,
+) -> Dict[str, Fingerprint]:
+    """
+    Synchronous version of scan_current_files.  Directories are scanned by
+    a pool of threads, which helps on large trees and slow disks since
+    scandir and stat release the GIL.
+
+    :param drop_location: The drop's directory
+    :param workers: How many directories to scan at once
+    :return: dictionary of filepath,fingerprint
     """
-    Scans the drop_location and collects files found into a dictionary
+    matcher = get_ignore_matcher(drop_location)
+    (files, pending) = _scan_dir(drop_location, '', matcher)
+    if workers <= 1:
+        while pending:
+            (dir_files, subdirs) = _scan_dir(
+                drop_location, pending.pop(), matcher,
+            )
+            files.update(dir_files)
+            pending.extend(subdirs)
+        return files
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        running = {
+            pool.submit(_scan_dir, drop_location, rel_dir, matcher)
+            for rel_dir in pending
+        }
+        while running:
+            (done, running) = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                (dir_files, subdirs) = future.result()
+                files.update(dir_files)
+                running.update(
+                    pool.submit(_scan_dir, drop_location, rel_dir, matcher)
+                    for rel_dir in subdirs
+                )
+    return files
+
 
-    :return: dictionary of filepath,timestamp
+def get_file_fingerprints(
+    drop_location: str, rel_paths: Iterable[str],
+) -> Dict[str, Fingerprint]:
     """
+    Get the fingerprints of some files in a drop, like scan_current_files
+    does for all of them.  Files that do not exist or are ignored are left
+    out.
+
+    :param drop_location: The drop's directory
+    :param rel_paths: Paths of the files, relative to drop_location
+    :return: dictionary of filepath,fingerprint
+    """
+    matcher = get_ignore_matcher(drop_location)
     files = {}
-    for (dirpath, filename) in walk_with_ignore(
-        drop_location, [],
-    ):
-        full_name = os.path.join(dirpath, filename)
-        rel_name = os.path.relpath(full_name, drop_location)
-        files[rel_name] = int(os.path.getmtime(full_name))
+    for rel_name in rel_paths:
+        if matcher.ignored(rel_name):
+            continue
+        try:
+            st = os.stat(os.path.join(drop_location, rel_name))
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            files[rel_name] = fingerprint(st)
     return files
 
 
-async def read_timestamp_file(drop_location: str) -> Dict[str, int]:
+async def read_timestamp_file(drop_location: str) -> Dict[str, Fingerprint]:
     """
     Reads the timestamp file and returns it as a dict
 
-    :return: dictionary of filepath and timestamp
+    :return: dictionary of filepath and fingerprint
     """
 
     timestamp_dir = os.path.join(drop_location, DEFAULT_TIMESTAMP_LOCATION)
@@ -82,19 +327,28 @@ async def read_timestamp_file(drop_location: str) -> Dict[str, int]:
     async with aiofiles.open(timestamp_dir, 'rb') as f:
         filedata = await f.read()
     write_locks[timestamp_dir].release()
-    return bencode.decode(filedata)
+    files = {}  # type: Dict[str, Fingerprint]
+    for (name, value) in bencode_util.decode(filedata).items():
+        if isinstance(value, int):
+            # written before fingerprints, only the mtime in seconds
+            files[name] = (-1, value * 10**9, -1)
+        else:
+            files[name] = tuple(value)  # type: ignore
+    return files
 
 
 async def write_timestamp_file(
-    current_files: Dict[str, int],
+    current_files: Dict[str, Fingerprint],
     drop_location: str,
 ) -> None:
     """
     Write the timestamp file as the passed in dict
 
-    :param current_files: Dictionary of filepath and timestamp
+    :param current_files: Dictionary of filepath and fingerprint
     """
-    filedata = bencode.encode(current_files)
+    filedata = bencode_util.encode(
+        {name: list(value) for (name, value) in current_files.items()},
+    )
     timestamp_dir = os.path.join(drop_location, DEFAULT_TIMESTAMP_LOCATION)
     await write_locks[timestamp_dir].acquire()
     async with aiofiles.open(timestamp_dir, 'wb') as f:
@@ -105,7 +359,7 @@ async def write_timestamp_file(
 
 async def write_chunk(
     filepath: str, position: int, contents: bytes, chunk_hash: bytes,
-    chunk_size: int=DEFAULT_CHUNK_SIZE,
+    chunk_size: int=DEFAULT_CHUNK_SIZE, offset: Optional[int]=None,
 ) -> None:
     """
     Takes a filepath, position, contents, and contents hash and writes it to
@@ -121,6 +375,8 @@ async def write_chunk(
     :param chunk_hash: the expected hash of contents
     :param chunk_size: (optional) override the chunk size, used to calculate \
     the position in the file
+    :param offset: (optional) where the chunk starts in the file, for chunks \
+    that are not all chunk_size long
     :raises crypto_util.VerificationException: When the hash of the provided \
             bytes does not match the provided hash
     :return: None
@@ -145,7 +401,7 @@ async def write_chunk(
 
     await write_locks[filepath].acquire()
     async with aiofiles.open(filepath, 'r+b') as f:
-        pos_bytes = position * chunk_size
+        pos_bytes = position * chunk_size if offset is None else offset
         await f.seek(pos_bytes)
         await f.write(contents)
         await f.flush()
@@ -154,7 +410,7 @@ async def write_chunk(
 
 async def read_chunk(
     filepath: str, position: int, file_hash: Optional[bytes]=None,
-    chunk_size: int=DEFAULT_CHUNK_SIZE,
+    chunk_size: int=DEFAULT_CHUNK_SIZE, offset: Optional[int]=None,
 ) -> Tuple[bytes, bytes]:
     """Reads a chunk for a file, returning the contents and its hash.  May
     raise relevant IO exceptions
@@ -165,6 +421,8 @@ async def read_chunk(
     :param position: where to read from
     :param file_hash: if provided, will check the file hash
     :param chunk_size: (optional) override the chunk size
+    :param offset: (optional) where the chunk starts in the file, for chunks \
+    that are not all chunk_size long
     :raises crypto_util.VerificationException: If the hash of the bytes read \
             does not match the provided hash
     :return: a double of (contents, hash), both bytes
@@ -175,7 +433,7 @@ async def read_chunk(
 
     async with aiofiles.open(filepath, 'rb') as f:
         logger.debug("async reading %s", filepath)
-        pos_bytes = position * chunk_size
+        pos_bytes = position * chunk_size if offset is None else offset
         await f.seek(pos_bytes)
         data = await f.read(chunk_size)
 
@@ -189,8 +447,8 @@ async def read_chunk(
 
 
 async def create_file(
-    filepath: str, size_bytes: int,
-) -> None:
+    filepath: str, size_bytes: int, old_path: Optional[str]=None,
+) -> bool:
     """Create a file at filepath of the correct size. May raise relevant IO
     exceptions
 
@@ -199,11 +457,20 @@ async def create_file(
 
     :param filepath: where to create the file
     :param size: the size to allocate
-    :return: None
+    :param old_path: if given, the previous contents of the file, complete \
+    or not, are moved here instead of being truncated, to copy chunks from
+    :return: whether previous contents were moved to old_path
     """
     new_path = filepath + DEFAULT_INCOMPLETE_EXT
+    moved = False
     try:
-        if is_complete(filepath):
+        if old_path is not None:
+            current = filepath if is_complete(filepath) else new_path
+            logger.info("moving %s to %s", current, old_path)
+            os.makedirs(os.path.dirname(old_path), exist_ok=True)
+            os.replace(current, old_path)
+            moved = True
+        elif is_complete(filepath):
             logger.info("file %s is done, moving it to be not done", filepath)
             os.replace(filepath, new_path)
     except FileNotFoundError:
@@ -216,6 +483,122 @@ async def create_file(
     async with aiofiles.open(filepath, 'wb') as f:
         logger.debug("truncating %s ot %s bytes", filepath, size_bytes)
         await f.truncate(size_bytes)
+    return moved
+
+
+def _copy_file_range(
+    src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, length: int,
+) -> int:
+    """Copy as much as possible of a range of src_fd to dst_fd with
+    copy_file_range, which lets the filesystem share the blocks (a reflink)
+    or copy them without going through userspace, where it is supported.
+    Returns how many bytes were copied."""
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    done = 0
+    if copy_file_range is None:
+        return done
+    try:
+        while done < length:
+            n = copy_file_range(
+                src_fd, dst_fd, length - done,
+                src_offset + done, dst_offset + done,
+            )
+            if n <= 0:
+                break
+            done += n
+    except OSError as e:
+        # e.g. EXDEV across filesystems on old kernels
+        logger.debug("copy_file_range failed, writing instead: %s", e)
+    return done
+
+
+def _copy_range(
+    src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, data: bytes,
+) -> None:
+    """Copy data, which was read from src_offset in src_fd and verified, to
+    dst_offset in dst_fd.  The source may have changed since it was read, so
+    what copy_file_range copied is checked against data, and data is
+    written instead if it differs."""
+    done = _copy_file_range(
+        src_fd, dst_fd, src_offset, dst_offset, len(data),
+    )
+    if done and os.pread(dst_fd, done, dst_offset) != data[:done]:
+        logger.info("source changed while copying, writing verified data")
+        done = 0
+    if done < len(data):
+        os.pwrite(dst_fd, data[done:], dst_offset + done)
+
+
+def _copy_file(src_path: str, dst_path: str) -> None:
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        done = _copy_file_range(src.fileno(), dst.fileno(), 0, 0, size)
+        src.seek(done)
+        dst.seek(done)
+        shutil.copyfileobj(src, dst)
+
+
+async def copy_file(src_path: str, filepath: str) -> None:
+    """
+    Copy a whole file to the incomplete version of another, in an executor.
+    The copy shares its blocks with src_path where the filesystem supports
+    it.
+
+    :param src_path: the file to copy
+    :param filepath: the path of the file to write to, without the extension
+    """
+    filepath += DEFAULT_INCOMPLETE_EXT
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    loop = asyncio.get_event_loop()
+    await write_locks[filepath].acquire()
+    try:
+        await loop.run_in_executor(None, _copy_file, src_path, filepath)
+    finally:
+        write_locks[filepath].release()
+
+
+def _copy_chunks(
+    src_path: str, dst_path: str,
+    copies: Dict[int, Tuple[int, int, int, bytes]],
+) -> Set[int]:
+    copied = set()  # type: Set[int]
+    with open(src_path, 'rb') as src, open(dst_path, 'r+b') as dst:
+        for (chunk_id, (src_offset, dst_offset, length, chunk_hash)) in \
+                sorted(copies.items(), key=lambda item: item[1][1]):
+            data = os.pread(src.fileno(), length, src_offset)
+            if hashlib.sha256(data).digest() != chunk_hash:
+                continue
+            _copy_range(
+                src.fileno(), dst.fileno(), src_offset, dst_offset, data,
+            )
+            copied.add(chunk_id)
+    return copied
+
+
+async def copy_chunks(
+    src_path: str, filepath: str,
+    copies: Dict[int, Tuple[int, int, int, bytes]],
+) -> Set[int]:
+    """
+    Copy chunks from one file into the incomplete version of another, in an
+    executor.  Each chunk is checked against its hash before it is copied,
+    and is shared with the source file where the filesystem supports it.
+
+    :param src_path: the file to copy from
+    :param filepath: the path of the file to write to, without the extension
+    :param copies: chunk id -> (offset in src_path, offset in filepath, \
+    length, hash) of each chunk to copy
+    :return: The chunk ids copied
+    """
+    filepath += DEFAULT_INCOMPLETE_EXT
+    loop = asyncio.get_event_loop()
+    await write_locks[filepath].acquire()
+    try:
+        return await loop.run_in_executor(
+            None, _copy_chunks, src_path, filepath, copies,
+        )
+    finally:
+        write_locks[filepath].release()
 
 
 def mark_file_complete(filepath: str) -> None:
@@ -262,23 +645,25 @@ def walk_with_ignore(
 ) -> Iterator[Tuple[str, str]]:
     """Walks the files in a directory, while filtering anything that should be
     ignored.  Implemented on top of os.walk, but instead returns an iterator
-    over (dirpath, filename)
+    over (dirpath, filename).  Ignored directories are not walked into.
 
     :param path: The path to walk
-    :param ignore: Patterns to ignore
+    :param ignore: Patterns to ignore, besides DEFAULT_IGNORE and the \
+            patterns in the .syncrignore file in path
     :return: An iterator of (dirpath, filename) that are in path but not ignore
     """
-    ignore += DEFAULT_IGNORE
-    for (dirpath, _, filenames) in os.walk(path):
+    matcher = get_ignore_matcher(path, ignore)
+    for (dirpath, dirnames, filenames) in os.walk(path):
         relpath = os.path.relpath(dirpath, path)
-        if any([fnmatch.fnmatch(relpath, i) for i in ignore]):
-            continue
-        if any([relpath.startswith(i) for i in ignore]):
+        if relpath == os.curdir:
+            relpath = ''
+        elif matcher.dir_ignored(relpath):
+            dirnames[:] = []
             continue
+        dirnames[:] = [
+            d for d in dirnames
+            if not matcher.dir_ignored(os.path.join(relpath, d))
+        ]
         for name in filenames:
-            if any([fnmatch.fnmatch(name, i) for i in ignore]):
-                continue
-            full_name = os.path.join(relpath, name)
-            if any([fnmatch.fnmatch(full_name, i) for i in ignore]):
-                continue
-            yield (dirpath, name)
+            if not matcher.file_ignored(relpath, name):
+                yield (dirpath, name)
@@ -0,0 +1,313 @@
+"""A small persistent key/value store, kept in memory and backed by an append
+only journal file"""
+import fcntl
+import json
+import os
+import tempfile
+from typing import Any
+from typing import Dict  # noqa
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from syncr_backend.init.node_init import get_full_init_directory
+from syncr_backend.util.log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+#: Compact the journal once it has this many times more records than keys
+DEFAULT_COMPACT_RATIO = 4
+#: Never compact journals with fewer records than this
+MIN_COMPACT_RECORDS = 64
+
+
+class KeyValueJournal(object):
+    """
+    A dict of string keys to JSON values, persisted as an append only journal
+    of JSON lines.  The whole journal is read into memory on first use, after
+    which lookups never touch the disk.
+
+    Every update appends one line (a ``{"k": key, "v": value}`` record, or a
+    ``{"k": key}`` tombstone) in a single write, which is fsynced before the
+    update returns.  A torn last line, from a crash while writing, is ignored
+    when loading, and the next update starts a new line after it.  Once the
+    journal has many more records than keys, it is compacted by writing the
+    current contents to a temporary file and atomically renaming it over the
+    journal.
+
+    Several processes may share a journal: appends are atomic, and
+    ``refresh`` picks up records written (or compactions done) by others.
+    Appends hold a shared lock on the journal and compactions an exclusive
+    one, so a compaction includes every record appended before it.
+
+    >>> import os, tempfile
+    >>> from syncr_backend.util.journal_util import KeyValueJournal
+    >>> path = os.path.join(tempfile.mkdtemp(), 'journal')
+    >>> journal = KeyValueJournal(path)
+    >>> journal.set('foo', 'bar')
+    >>> journal.set_many([('baz', 1), ('qux', [2, 3])])
+    >>> journal.delete('baz')
+    >>> sorted(KeyValueJournal(path).items())
+    [('foo', 'bar'), ('qux', [2, 3])]
+    """
+
+    def __init__(
+        self, path: str, compact_ratio: int=DEFAULT_COMPACT_RATIO,
+    ) -> None:
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self._data = {}  # type: Dict[str, Any]
+        self._loaded = False
+        self._offset = 0
+        self._records = 0
+        self._inode = None  # type: Optional[int]
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+    def load(self) -> None:
+        """(Re)read the whole journal from disk"""
+        self._data = {}
+        self._offset = 0
+        self._records = 0
+        self._inode = None
+        self._loaded = True
+        self._read_new_records()
+
+    def refresh(self) -> None:
+        """Apply records added to the journal by other processes since it was
+        last read"""
+        if not self._loaded:
+            self.load()
+            return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self.load()
+            return
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            logger.debug("journal %s was replaced, reloading", self.path)
+            self.load()
+        elif st.st_size > self._offset:
+            self._read_new_records()
+
+    def _read_new_records(self, stop: Optional[int]=None) -> None:
+        """Apply the records after the offset, up to stop or the end"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            self._inode = os.fstat(f.fileno()).st_ino
+            f.seek(self._offset)
+            data = f.read(-1 if stop is None else stop - self._offset)
+
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line.decode('utf-8'))
+                key = record['k']
+            except (ValueError, KeyError, TypeError):
+                logger.warning("skipping bad record in %s", self.path)
+                continue
+            self._apply(key, record)
+            self._records += 1
+        self._offset += end
+
+    def _apply(self, key: str, record: Dict[str, Any]) -> None:
+        if 'v' in record:
+            self._data[key] = record['v']
+        else:
+            self._data.pop(key, None)
+
+    def get(self, key: str, default: Any=None) -> Any:
+        """
+        Look up a key
+
+        :param key: The key
+        :param default: Returned if key is not set
+        :return: The value of key, or default
+        """
+        self._ensure_loaded()
+        return self._data.get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        self._ensure_loaded()
+        return key in self._data
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._data)
+
+    def keys(self) -> List[str]:
+        """
+        :return: A list of the keys
+        """
+        self._ensure_loaded()
+        return list(self._data.keys())
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """
+        :return: An iterator over (key, value)
+        """
+        self._ensure_loaded()
+        return iter(list(self._data.items()))
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Set a key, persisting it before returning
+
+        :param key: The key
+        :param value: A JSON serializable value
+        """
+        self.set_many([(key, value)])
+
+    def set_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Set many keys with a single write
+
+        :param items: (key, value) pairs to set
+        """
+        self._append([{'k': k, 'v': v} for (k, v) in items])
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a key, if it is set
+
+        :param key: The key to remove
+        """
+        self._ensure_loaded()
+        if key in self._data:
+            self._append([{'k': key}])
+
+    def _open_locked(self, operation: int) -> int:
+        """
+        Open the journal, creating it if needed, and lock it
+
+        :param operation: fcntl.LOCK_SH or fcntl.LOCK_EX
+        :return: The locked file descriptor, of the file now at path
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        while True:
+            fd = os.open(
+                self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644,
+            )
+            try:
+                fcntl.flock(fd, operation)
+                # a compaction may have replaced the file while we waited
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    def _append(self, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        self.refresh()
+        data = b''.join(
+            json.dumps(r, sort_keys=True).encode('utf-8') + b'\n'
+            for r in records
+        )
+        fd = self._open_locked(fcntl.LOCK_SH)
+        try:
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                # end a torn record left by a crash, or ours would be
+                # glued onto it and lost with it
+                data = b'\n' + data
+            os.write(fd, data)
+            os.fsync(fd)
+            end = os.lseek(fd, 0, os.SEEK_CUR)
+            st = os.fstat(fd)
+        finally:
+            os.close(fd)
+
+        if self._inode not in (None, st.st_ino):
+            # compacted by someone else since the refresh, and the new file
+            # has our records
+            self.load()
+        else:
+            # apply records others appended before ours, then ours, then
+            # any appended after them, reading each record once
+            self._read_new_records(end - len(data))
+            for r in records:
+                self._apply(r['k'], r)
+            self._records += len(records)
+            self._inode = st.st_ino
+            self._offset = end
+            if st.st_size > end:
+                self._read_new_records()
+
+        if self._records >= MIN_COMPACT_RECORDS and \
+                self._records > self.compact_ratio * max(len(self._data), 1):
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the journal with one record per key"""
+        fd = self._open_locked(fcntl.LOCK_EX)
+        try:
+            # nothing can be appended now, so apply what others appended
+            self.refresh()
+            logger.debug(
+                "compacting %s (%s records, %s keys)", self.path,
+                self._records, len(self._data),
+            )
+            data = b''.join(
+                json.dumps({'k': k, 'v': v}, sort_keys=True).encode('utf-8') +
+                b'\n' for (k, v) in self._data.items()
+            )
+            (tmp_fd, tmp_path) = tempfile.mkstemp(
+                prefix=os.path.basename(self.path) + '.',
+                dir=os.path.dirname(self.path),
+            )
+            try:
+                with open(tmp_fd, 'wb') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    inode = os.fstat(f.fileno()).st_ino
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        finally:
+            os.close(fd)
+
+        self._inode = inode
+        self._offset = len(data)
+        self._records = len(self._data)
+
+
+_node_journals = {}  # type: Dict[str, KeyValueJournal]
+
+
+def get_node_journal(file_name: str) -> Optional[KeyValueJournal]:
+    """
+    Get a journal kept in the node init directory.  Journals are shared by
+    everything in this process.
+
+    :param file_name: The journal's file name in the init directory
+    :return: The journal, or None if the node is not initialized
+    """
+    node_info_path = get_full_init_directory(None)
+    if not os.path.isdir(node_info_path):
+        return None
+    path = os.path.join(node_info_path, file_name)
+    journal = _node_journals.get(path)
+    if journal is None:
+        journal = KeyValueJournal(path)
+        _node_journals[path] = journal
+    return journal
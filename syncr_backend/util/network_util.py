@@ -1,20 +1,24 @@
 """Helper functions for communicating with other peers"""
 import asyncio
+import random
 import socket
 from socket import SHUT_WR
 from typing import Any
 from typing import Dict
-
-import bencode  # type: ignore
+from typing import List
+from typing import TypeVar
 
 from syncr_backend.constants import ERR_EXCEPTION
 from syncr_backend.constants import ERR_INCOMPAT
 from syncr_backend.constants import ERR_NEXIST
+from syncr_backend.util import bencode_util
 from syncr_backend.util.log_util import get_logger
 
 
 logger = get_logger(__name__)
 
+T = TypeVar('T')
+
 
 async def send_response(
     writer: asyncio.StreamWriter, response: Dict[Any, Any],
@@ -26,7 +30,7 @@ async def send_response(
     :param response: Dict[Any, Any] response
     :return: None
     """
-    writer.write(bencode.encode(response))
+    writer.write(bencode_util.encode(response))
     writer.write_eof()
     await writer.drain()
 
@@ -39,10 +43,32 @@ def sync_send_response(conn: socket.socket, response: Dict[Any, Any]) -> None:
     :param reponse: Dict[Any, Any] response
     :return: None
     """
-    conn.send(bencode.encode(response))
+    conn.send(bencode_util.encode(response))
     conn.shutdown(SHUT_WR)
 
 
+def select_peers(peers: List[T], limit: int) -> List[T]:
+    """
+    Pick at most limit peers from a list ordered from most to least recently
+    announced.  The freshest half of limit is kept, and the rest is a random
+    sample of the older peers, so that they are still tried sometimes.
+
+    >>> from syncr_backend.util.network_util import select_peers
+    >>> select_peers([1, 2, 3], 4)
+    [1, 2, 3]
+    >>> select_peers(list(range(100)), 4)[:2]
+    [0, 1]
+
+    :param peers: Peers, freshest first
+    :param limit: Most peers to return
+    :return: The picked peers, the fresh ones first
+    """
+    if len(peers) <= limit:
+        return list(peers)
+    fresh = (limit + 1) // 2
+    return peers[:fresh] + random.sample(peers[fresh:], limit - fresh)
+
+
 class SyncrNetworkException(Exception):
     """Base exception for network errors"""
     pass
@@ -68,6 +94,11 @@ class NoPeersException(SyncrNetworkException):
     pass
 
 
+class UnsupportedEncodingException(SyncrNetworkException):
+    """Response is compressed with an unknown encoding, or is corrupt"""
+    pass
+
+
 def raise_network_error(
     errno: int,
 ) -> None:
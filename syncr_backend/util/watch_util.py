@@ -0,0 +1,474 @@
+"""Watch drops for local changes, so they do not have to be rescanned
+
+A watcher keeps the set of paths in a drop that changed since the drop's
+timestamp file was written.  With it, checking a drop for changes only has to
+look at those paths instead of walking the whole drop.  On Linux the watcher
+uses inotify; elsewhere, or if inotify runs out of watches, the drop is
+rescanned in the background every WATCH_POLL_INTERVAL seconds instead.
+
+A watcher is not trusted until a full scan has been done after it started,
+and stops being trusted whenever it may have missed events (an inotify queue
+overflow, or the drop directory itself moving).  Callers should then do a
+full scan again, between :meth:`DropWatcher.begin_scan` and
+:meth:`DropWatcher.end_scan`.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+from abc import ABC
+from abc import abstractmethod
+from typing import Dict  # noqa
+from typing import Iterable
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from syncr_backend.constants import DEFAULT_IGNORE_FILE
+from syncr_backend.constants import WATCH_POLL_INTERVAL
+from syncr_backend.util import fileio_util
+from syncr_backend.util.log_util import get_logger
+
+
+logger = get_logger(__name__)
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR |
+    IN_DONT_FOLLOW
+)
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+_libc = None  # type: Optional[ctypes.CDLL]
+
+
+def _get_libc() -> Optional[ctypes.CDLL]:
+    global _libc
+    if _libc is None and sys.platform.startswith('linux'):
+        try:
+            _libc = ctypes.CDLL(
+                ctypes.util.find_library('c') or None, use_errno=True,
+            )
+        except OSError:
+            return None
+    return _libc
+
+
+def inotify_available() -> bool:
+    """Whether drops can be watched with inotify"""
+    libc = _get_libc()
+    return libc is not None and hasattr(libc, 'inotify_init1')
+
+
+class DropWatcher(ABC):
+    """Keeps the paths in a drop that changed.  Subclasses fill them in."""
+
+    def __init__(self, drop_location: str) -> None:
+        """
+        :param drop_location: The drop's directory
+        """
+        self.drop_location = drop_location
+        #: files that may have changed, relative to the drop
+        self.dirty = set()  # type: Set[str]
+        #: directories whose whole contents may have changed
+        self.dirty_dirs = set()  # type: Set[str]
+        self.trusted = False
+        self._overflows = 0
+        #: Number of walks of the drop running in an executor
+        self._walks = 0
+        self.matcher = fileio_util.get_ignore_matcher(drop_location)
+
+    @abstractmethod
+    async def start(self) -> None:
+        """Start watching the drop
+
+        :raises OSError: If the drop cannot be watched
+        """
+        pass
+
+    @abstractmethod
+    def stop(self) -> None:
+        """Stop watching the drop"""
+        pass
+
+    def mark_overflow(self) -> None:
+        """Note that changes may have been missed"""
+        logger.debug("watcher of %s overflowed", self.drop_location)
+        self.trusted = False
+        self._overflows += 1
+
+    def begin_scan(self, clear: bool=False) -> int:
+        """
+        Call before a full scan of the drop
+
+        :param clear: Forget the changes so far, because the scan will be \
+                written as the new timestamp file
+        :return: Token to pass to end_scan
+        """
+        if clear:
+            self.dirty = set()
+            self.dirty_dirs = set()
+        return self._overflows
+
+    def end_scan(self, token: int, changed: Iterable[str]) -> None:
+        """
+        Call after a full scan of the drop.  The watcher is trusted again if
+        it did not overflow during the scan.
+
+        :param token: What begin_scan returned
+        :param changed: Files the scan found to differ from the timestamp file
+        """
+        self.dirty.update(changed)
+        if token == self._overflows:
+            self.trusted = True
+
+    def changes(self) -> Optional[Tuple[Set[str], Set[str]]]:
+        """
+        Get the paths that changed since the timestamp file was written
+
+        :return: (files, directories) that may have changed, or None if a \
+                full scan is needed
+        """
+        if not self.trusted or self._walks:
+            return None
+        return (set(self.dirty), set(self.dirty_dirs))
+
+    def _ignore_file_changed(self) -> None:
+        """What is ignored changed, so every file may have been added or
+        removed"""
+        self.matcher = fileio_util.get_ignore_matcher(self.drop_location)
+        self.mark_overflow()
+
+
+class InotifyWatcher(DropWatcher):
+    """Watches every directory in a drop with inotify"""
+
+    def __init__(self, drop_location: str) -> None:
+        super().__init__(drop_location)
+        self._fd = -1
+        #: watch descriptor -> directory, relative to the drop
+        self._wds = {}  # type: Dict[int, str]
+
+    async def start(self) -> None:
+        libc = _get_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        loop = asyncio.get_event_loop()
+        try:
+            self._wds.update(
+                await loop.run_in_executor(None, self._watch_tree, ''),
+            )
+        except OSError:
+            os.close(fd)
+            self._fd = -1
+            raise
+        loop.add_reader(fd, self._read_events)
+
+    def stop(self) -> None:
+        if self._fd < 0:
+            return
+        asyncio.get_event_loop().remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = -1
+        self._wds = {}
+
+    def _add_watch(self, rel_dir: str) -> Optional[int]:
+        """Watch a directory, returning the watch descriptor, or None if it
+        is gone"""
+        libc = _get_libc()
+        assert libc is not None
+        path = os.path.join(self.drop_location, rel_dir)
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # it may have been removed while walking
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def _watch_tree(self, rel_dir: str) -> Dict[int, str]:
+        """Watch a directory and every directory under it.  This walks the
+        directory, so it runs in an executor.
+
+        :return: The new watches, for _wds
+        """
+        wds = {}  # type: Dict[int, str]
+        top = os.path.join(self.drop_location, rel_dir)
+        for (dirpath, dirnames, _) in os.walk(top):
+            rel = os.path.relpath(dirpath, self.drop_location)
+            if rel == os.curdir:
+                rel = ''
+            elif self.matcher.dir_ignored(rel):
+                dirnames[:] = []
+                continue
+            wd = self._add_watch(rel)
+            if wd is not None:
+                wds[wd] = rel
+        return wds
+
+    def _watch_tree_later(self, rel_dir: str) -> None:
+        """Watch a directory and every directory under it in an executor.
+        Until that is done, changes in them may be missed, so the watcher is
+        not trusted."""
+        fd = self._fd
+        self._walks += 1
+
+        def done(future: asyncio.Future) -> None:
+            self._walks -= 1
+            if self._fd != fd:
+                # stopped meanwhile
+                return
+            try:
+                self._wds.update(future.result())
+            except OSError as e:
+                logger.warning("cannot watch %s: %s", rel_dir, e)
+                self.mark_overflow()
+
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(
+            None, self._watch_tree, rel_dir,
+        ).add_done_callback(done)
+
+    def _ignore_file_changed(self) -> None:
+        super()._ignore_file_changed()
+        # directories that were ignored may not be anymore
+        self._watch_tree_later('')
+
+    def _unwatch_tree(self, rel_dir: str) -> None:
+        """Stop watching a directory that moved away, and everything in it"""
+        libc = _get_libc()
+        assert libc is not None
+        prefix = rel_dir + os.sep
+        for (wd, rel) in list(self._wds.items()):
+            if rel == rel_dir or rel.startswith(prefix):
+                libc.inotify_rm_watch(self._fd, wd)
+                del self._wds[wd]
+
+    def _read_events(self) -> None:
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.warning("reading inotify events failed: %s", e)
+            self.mark_overflow()
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            (wd, mask, _, length) = _EVENT_HEADER.unpack_from(data, offset)
+            start = offset + _EVENT_HEADER.size
+            name = data[start:start + length].rstrip(b'\0')
+            offset = start + length
+            self._handle_event(wd, mask, os.fsdecode(name))
+
+    def _handle_event(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self.mark_overflow()
+            return
+        rel_dir = self._wds.get(wd)
+        if rel_dir is None:
+            return
+        if mask & IN_IGNORED:
+            del self._wds[wd]
+            return
+        if not name:
+            # events on subdirectories are also reported by their parent
+            if rel_dir == '' and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self.mark_overflow()
+            return
+        rel_path = os.path.join(rel_dir, name)
+        if rel_path == DEFAULT_IGNORE_FILE:
+            self._ignore_file_changed()
+            return
+        if not mask & IN_ISDIR:
+            if not self.matcher.file_ignored(rel_dir, name):
+                self.dirty.add(rel_path)
+            return
+        if self.matcher.dir_ignored(rel_path):
+            return
+        self.dirty_dirs.add(rel_path)
+        if mask & IN_MOVED_FROM:
+            self._unwatch_tree(rel_path)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            self._watch_tree_later(rel_path)
+
+
+class PollingWatcher(DropWatcher):
+    """Rescans a drop every interval seconds, in an executor.  Changes are up
+    to interval seconds late."""
+
+    def __init__(
+        self, drop_location: str, interval: float=WATCH_POLL_INTERVAL,
+    ) -> None:
+        """
+        :param drop_location: The drop's directory
+        :param interval: Seconds between scans
+        """
+        super().__init__(drop_location)
+        self.interval = interval
+        self._files = {}  # type: Dict[str, fileio_util.Fingerprint]
+        self._task = None  # type: Optional[asyncio.Future]
+
+    async def start(self) -> None:
+        loop = asyncio.get_event_loop()
+        self._files = await loop.run_in_executor(
+            None, fileio_util.scan_files, self.drop_location,
+        )
+        self._task = asyncio.ensure_future(self._poll())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _poll(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                files = await loop.run_in_executor(
+                    None, fileio_util.scan_files, self.drop_location,
+                )
+            except OSError as e:
+                logger.warning("scanning %s failed: %s", self.drop_location, e)
+                self.mark_overflow()
+                continue
+            old = self._files
+            self.dirty.update(
+                name for name in set(files) | set(old)
+                if files.get(name) != old.get(name)
+            )
+            self._files = files
+
+
+_watching = False
+_watchers = {}  # type: Dict[str, DropWatcher]
+
+
+def enable_watching() -> None:
+    """Watch drops for changes from now on.  Each drop is watched from the
+    first time it is checked for changes."""
+    global _watching
+    _watching = True
+
+
+def stop_watching() -> None:
+    """Stop every watcher"""
+    global _watching
+    _watching = False
+    for watcher in _watchers.values():
+        watcher.stop()
+    _watchers.clear()
+
+
+async def get_watcher(drop_location: str) -> Optional[DropWatcher]:
+    """
+    Get the watcher of a drop, starting it if needed
+
+    :param drop_location: The drop's directory
+    :return: The watcher, or None if drops are not being watched
+    """
+    if not _watching:
+        return None
+    key = os.path.abspath(drop_location)
+    watcher = _watchers.get(key)
+    if watcher is not None:
+        return watcher
+    if inotify_available():
+        watcher = InotifyWatcher(key)
+        try:
+            await watcher.start()
+        except OSError as e:
+            logger.warning("cannot watch %s with inotify: %s", key, e)
+            watcher = None
+    if watcher is None:
+        watcher = PollingWatcher(key)
+        await watcher.start()
+    # another check may have started one meanwhile
+    if key in _watchers:
+        watcher.stop()
+        return _watchers[key]
+    _watchers[key] = watcher
+    return watcher
+
+
+def unwatch_drop(drop_location: str) -> None:
+    """
+    Stop watching a drop
+
+    :param drop_location: The drop's directory
+    """
+    watcher = _watchers.pop(os.path.abspath(drop_location), None)
+    if watcher is not None:
+        watcher.stop()
+
+
+def expand_changes(
+    drop_location: str, changes: Tuple[Set[str], Set[str]],
+    old_files: Iterable[str],
+) -> Set[str]:
+    """
+    Turn what a watcher saw into the files that need to be looked at
+
+    :param drop_location: The drop's directory
+    :param changes: (files, directories) from DropWatcher.changes
+    :param old_files: Files in the timestamp file
+    :return: Files that may have been added, removed, or changed
+    """
+    (files, dirs) = changes
+    if not dirs:
+        return files
+    prefixes = tuple(d + os.sep for d in dirs)
+    files.update(name for name in old_files if name.startswith(prefixes))
+    for rel_dir in dirs:
+        top = os.path.join(drop_location, rel_dir)
+        for (dirpath, _, filenames) in os.walk(top):
+            rel = os.path.relpath(dirpath, drop_location)
+            files.update(os.path.join(rel, name) for name in filenames)
+    return files
+
+
+async def update_timestamp_file(drop_location: str) -> None:
+    """
+    Scan a drop and write its timestamp file, which later changes are
+    found relative to
+
+    :param drop_location: The drop's directory
+    """
+    watcher = _watchers.get(os.path.abspath(drop_location))
+    token = 0
+    if watcher is not None:
+        token = watcher.begin_scan(clear=True)
+    scanned_files = await fileio_util.scan_current_files(drop_location)
+    await fileio_util.write_timestamp_file(scanned_files, drop_location)
+    if watcher is not None:
+        watcher.end_scan(token, ())
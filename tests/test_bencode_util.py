@@ -0,0 +1,133 @@
+import asyncio
+import random
+from typing import Any
+from typing import Awaitable
+from typing import TypeVar
+
+import bencode  # type: ignore
+import pytest
+
+from syncr_backend.util import bencode_util
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def random_value(rng: random.Random, depth: int=0) -> Any:
+    kind = rng.randrange(7 if depth < 4 else 4)
+    if kind == 0:
+        return rng.randint(-2**70, 2**70)
+    elif kind == 1:
+        return bytes(rng.getrandbits(8) for _ in range(rng.randrange(40)))
+    elif kind == 2:
+        return ''.join(chr(rng.randint(32, 0x2fff)) for _ in range(5))
+    elif kind == 3:
+        return rng.random() < 0.5
+    elif kind == 4:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(5))]
+    return {
+        ''.join(chr(rng.randint(32, 0x2fff)) for _ in range(3)):
+        random_value(rng, depth + 1)
+        for _ in range(rng.randrange(5))
+    }
+
+
+def test_compatible_with_bencode() -> None:
+    rng = random.Random(0)
+    for _ in range(500):
+        value = random_value(rng)
+        encoded = bencode.encode(value)
+        assert bencode_util.encode(value) == encoded
+        decoded = bencode_util.decode(encoded)
+        assert decoded == bencode.decode(encoded)
+        if isinstance(decoded, dict):
+            assert list(decoded) == sorted(decoded)
+
+    # long strings, with a character across the end of the utf-8 probe
+    for value in [
+        b'\xff' * 5000, 'a' * 4095 + '\u20ac' * 10, {'a': [b'\0' * 5000]},
+    ]:
+        encoded = bencode.encode(value)
+        assert bencode_util.decode(encoded) == bencode.decode(encoded)
+
+    # out of order keys are sorted, as bencode.py does
+    assert list(bencode_util.decode(b'd1:bi1e1:ai2ee')) == ['a', 'b']
+    assert bencode_util.encode((1, b'\xff')) == b'li1e1:\xffe'
+    assert bencode_util.encode({b'b': 1, 'a': 2}) == \
+        b'd1:ai2e1:bi1ee'
+
+
+@pytest.mark.parametrize('key', [3, None, 1.5, (1,)])
+def test_encode_bad_key(key: Any) -> None:
+    with pytest.raises(TypeError):
+        bencode_util.encode({key: 1})
+
+
+@pytest.mark.parametrize('data', [
+    b'', b'i1', b'i01e', b'i-0e', b'i+1e', b'ie', b'01:a', b'2:a', b'l',
+    b'di1ei2ee', b'd2:\xff\xffi1ee', b'x', b'i1ei2e', b'e', b'd1:ae',
+])
+def test_decode_errors(data: bytes) -> None:
+    with pytest.raises(bencode_util.BencodeDecodeError):
+        bencode_util.decode(data)
+
+
+@pytest.mark.parametrize(
+    'data', [b'i01e', b'i+1e', b'01:a', b'di1ei2ee', b'e', b'd1:ae'],
+)
+def test_decoder_errors(data: bytes) -> None:
+    decoder = bencode_util.Decoder()
+    decoder.feed(data)
+    with pytest.raises(bencode_util.BencodeDecodeError):
+        decoder.next_value()
+
+
+def test_decoder() -> None:
+    messages = [
+        {'status': 'ok', 'response': b'\xff' * 1000, 'ids': [1, -2, 3]},
+        {'a': {'b': [[], {}]}},
+    ]
+    data = b''.join(bencode_util.encode(m) for m in messages)
+    decoder = bencode_util.Decoder()
+    decoded = []
+    for i in range(len(data)):
+        decoder.feed(data[i:i + 1])
+        (done, value) = decoder.next_value()
+        if done:
+            decoded.append(value)
+    assert decoded == messages
+
+    # values split at random, and more than one in a feed
+    rng = random.Random(0)
+    values = [random_value(rng) for _ in range(200)]
+    data = b''.join(bencode_util.encode(v) for v in values)
+    decoded = []
+    i = 0
+    while i < len(data):
+        n = rng.randrange(1, 100)
+        decoder.feed(data[i:i + n])
+        i += n
+        (done, value) = decoder.next_value()
+        while done:
+            decoded.append(value)
+            (done, value) = decoder.next_value()
+    assert decoded == [bencode_util.decode(bencode.encode(v)) for v in values]
+
+
+def test_read_value() -> None:
+    message = {'status': 'ok', 'response': b'\xff' * 2**20}
+
+    async def read(data: bytes) -> Any:
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await bencode_util.read_value(reader)
+
+    assert run_coro(read(bencode_util.encode(message))) == message
+    with pytest.raises(bencode_util.BencodeDecodeError):
+        run_coro(read(bencode_util.encode(message)[:-1]))
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+from typing import Any
+from typing import Awaitable
+from typing import TypeVar
+from unittest import mock
+
+from syncr_backend.metadata import chunk_index
+from syncr_backend.metadata.file_metadata import FileMetadata
+from syncr_backend.util import drop_util
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def test_bloom_filter() -> None:
+    bloom = chunk_index.BloomFilter(1000, error_rate=0.01)
+    keys = [hashlib.sha256(b'%d' % i).digest() for i in range(2000)]
+    for key in keys[:1000]:
+        bloom.add(key)
+    assert all(key in bloom for key in keys[:1000])
+    assert sum(key in bloom for key in keys[1000:]) < 50
+
+
+def test_chunk_index(tmpdir: Any) -> None:
+    index = chunk_index.ChunkIndex(str(tmpdir.join('chunks.sqlite')))
+    path = str(tmpdir.join('f'))
+    run_coro(index.add_chunks(path, [(b'a' * 32, 0, 4), (b'b' * 32, 4, 4)]))
+    run_coro(index.add_chunks('other', [(b'a' * 32, 8, 4)]))
+
+    found = run_coro(index.lookup([b'a' * 32, b'c' * 32]))
+    assert sorted(found[b'a' * 32]) == [(path, 0, 4), ('other', 8, 4)]
+    assert b'c' * 32 not in found
+
+    run_coro(index.remove_file(path))
+    assert run_coro(index.lookup([b'a' * 32, b'b' * 32])) == {
+        b'a' * 32: [('other', 8, 4)],
+    }
+    index.close()
+
+
+@mock.patch(
+    'syncr_backend.metadata.chunk_index.get_full_init_directory',
+    autospec=True,
+)
+def test_copy_local_chunks(mock_init_dir: mock.Mock, tmpdir: Any) -> None:
+    mock_init_dir.return_value = str(tmpdir.mkdir('init'))
+    chunk_index._chunk_indexes.clear()
+    chunks = [b'aaaa', b'bbbb', b'cccc']
+    file_m = FileMetadata(
+        hashes=[hashlib.sha256(c).digest() for c in chunks],
+        file_id=b'f' * 32, file_length=12, drop_id=b'd' * 64, chunk_size=4,
+    )
+
+    # another drop has the first two chunks, the other way around
+    other = tmpdir.join('other')
+    other.write(b'bbbbaaaa', mode='wb')
+    other_m = FileMetadata(
+        hashes=[file_m.hashes[1], file_m.hashes[0]],
+        file_id=b'o' * 32, file_length=8, drop_id=b'e' * 64, chunk_size=4,
+    )
+    run_coro(chunk_index.index_files({str(other): other_m}))
+
+    path = str(tmpdir.join('f'))
+    tmpdir.join('f.part').write(b'\0' * 12, mode='wb')
+    assert run_coro(
+        drop_util.copy_local_chunks(file_m, path, {0, 1, 2}),
+    ) == {0, 1}
+    assert tmpdir.join('f.part').read(mode='rb') == b'aaaabbbb\0\0\0\0'
+
+    # the copied chunks are recorded, and can be copied from incomplete files
+    other.remove()
+    tmpdir.join('g.part').write(b'\0' * 12, mode='wb')
+    assert run_coro(
+        drop_util.copy_local_chunks(
+            file_m, str(tmpdir.join('g')), {0, 1, 2},
+        ),
+    ) == {0, 1}
+
+    # sources that are gone are forgotten
+    tmpdir.join('f.part').remove()
+    tmpdir.join('g.part').remove()
+    tmpdir.join('h.part').write(b'\0' * 12, mode='wb')
+    assert run_coro(
+        drop_util.copy_local_chunks(
+            file_m, str(tmpdir.join('h')), {0, 1, 2},
+        ),
+    ) == set()
+    index = chunk_index.get_chunk_index()
+    assert index is not None
+    assert run_coro(index.lookup(file_m.hashes)) == {}
+    index.close()
@@ -0,0 +1,38 @@
+import hashlib
+import io
+import random
+from typing import Any
+
+from syncr_backend.util import chunk_util
+
+
+def chunks(data: bytes) -> list:
+    return list(chunk_util.iter_chunks(
+        io.BytesIO(data), min_size=256, avg_size=1024, max_size=4096,
+    ))
+
+
+def test_iter_chunks() -> None:
+    data = bytes(random.Random(1).getrandbits(8) for _ in range(100000))
+    original = chunks(data)
+    assert b''.join(original) == data
+    assert all(256 <= len(c) <= 4096 for c in original[:-1])
+    assert 20 < len(original) < 400
+
+    # only the chunks around an edit change
+    edited = chunks(data[:50000] + b'inserted' + data[50000:])
+    assert len(set(edited) - set(original)) <= 2
+
+    assert chunks(b'') == []
+    assert chunks(b'\0' * 10000) == [b'\0' * 4096] * 2 + [b'\0' * 1808]
+
+
+def test_index_chunks(tmpdir: Any) -> None:
+    tmpdir.join('old').write(b'aaaabbbbcc', mode='wb')
+    index = chunk_util.index_chunks(
+        str(tmpdir.join('old')), [(0, 4), (4, 4), (8, 4)], False,
+    )
+    assert index == {
+        hashlib.sha256(b'aaaa').digest(): (0, 4),
+        hashlib.sha256(b'bbbb').digest(): (4, 4),
+    }
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import zlib
+from typing import Any  # noqa
+from typing import Awaitable
+from typing import List  # noqa
+from typing import TypeVar
+from unittest import mock
+
+import bencode  # type: ignore
+import pytest
+
+from syncr_backend.network import listen_requests
+from syncr_backend.network import send_requests
+from syncr_backend.util import compression_util
+from syncr_backend.util.network_util import UnsupportedEncodingException
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def test_compress() -> None:
+    text = b'time,level,message\n' + b'1,INFO,all good\n' * 10000
+    for encoding in compression_util.accepted_encodings():
+        (data, used) = compression_util.compress(text, [encoding])
+        assert used == encoding
+        assert len(data) < len(text) // 5
+        assert compression_util.decompress(data, used) == text
+
+    # short, incompressible or unaccepted responses are sent as they are
+    random_data = os.urandom(2**20)
+    assert compression_util.compress(b'short', ['zlib']) == (b'short', None)
+    assert compression_util.compress(random_data, ['zlib']) == \
+        (random_data, None)
+    assert compression_util.compress(text, ['brotli']) == (text, None)
+    assert compression_util.compress(text, None) == (text, None)
+
+
+def test_decompress_errors() -> None:
+    with pytest.raises(UnsupportedEncodingException):
+        compression_util.decompress(b'data', 'brotli')
+    with pytest.raises(UnsupportedEncodingException):
+        compression_util.decompress(b'not zlib', 'zlib')
+    with pytest.raises(UnsupportedEncodingException):
+        compression_util.decompress(
+            zlib.compress(b'a' * 1000), 'zlib', max_size=100,
+        )
+
+
+def test_compressed_request() -> None:
+    text = b'a,b,c\n' * 10000
+    encodings = []  # type: List[Any]
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+    ) -> None:
+        request = bencode.decode(await reader.read())
+        response = await listen_requests.ok_response(request, text)
+        encodings.append(response.get('encoding'))
+        await listen_requests.send_response(writer, response)
+
+    async def request(protocol_version: int) -> bytes:
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        message = {'protocol_version': protocol_version}
+        try:
+            response = await send_requests.send_request_to_node(
+                message, '127.0.0.1', port,
+            )
+            # the caller's request is not changed
+            assert message == {'protocol_version': protocol_version}
+            return response
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    assert run_coro(request(2)) == text
+    # older nodes neither ask for nor get compressed responses
+    assert run_coro(request(1)) == text.decode('utf-8')
+    assert encodings == [compression_util.accepted_encodings()[0], None]
+
+
+def test_response_over_decompressed_size() -> None:
+    data = b'\xff' + b'a' * 10000
+    requests = []  # type: List[Any]
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+    ) -> None:
+        request = bencode.decode(await reader.read())
+        requests.append(request)
+        response = await listen_requests.ok_response(request, data)
+        await listen_requests.send_response(writer, response)
+
+    async def run() -> bytes:
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await send_requests.send_request_to_node(
+                {'protocol_version': 2}, '127.0.0.1', port,
+            )
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    # a compressed response just over the limit is asked for again
+    # uncompressed
+    with mock.patch(
+        'syncr_backend.util.compression_util.MAX_DECOMPRESSED_SIZE',
+        len(data) - 1,
+    ):
+        assert run_coro(run()) == data
+    assert [r.get('accept_encoding') for r in requests] == \
+        [compression_util.accepted_encodings(), None]
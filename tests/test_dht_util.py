@@ -0,0 +1,76 @@
+from typing import Any
+from unittest import mock
+
+from syncr_backend.constants import TRACKER_DROP_AVAILABILITY_TTL
+from syncr_backend.external_interface import dht_util
+from syncr_backend.external_interface.dht_util import DropPeerDHTStorage
+from syncr_backend.util import crypto_util
+
+
+@mock.patch('syncr_backend.external_interface.dht_util.time', autospec=True)
+def test_peer_storage(mock_time: mock.Mock) -> None:
+    mock_time.time.return_value = 1000.0
+    storage = DropPeerDHTStorage()
+    peer1 = (b'\xff1', '1.2.3.4', 1)
+    peer2 = (b'\xff2', '2.3.4.5', 2)
+
+    storage[b'drop'] = crypto_util.encode_peerlist([peer1])
+    mock_time.time.return_value = 1100.0
+    storage[b'drop'] = crypto_util.encode_peerlist([peer2])
+    storage[b'other'] = b'not a peerlist'
+    assert crypto_util.decode_peerlist(storage[b'drop']) == [peer2, peer1]
+    assert storage[b'other'] == b'not a peerlist'
+
+    # peer1 expires, then is renewed, then peer2 expires
+    mock_time.time.return_value = 1000.0 + TRACKER_DROP_AVAILABILITY_TTL
+    assert crypto_util.decode_peerlist(storage[b'drop']) == [peer2]
+    storage[b'drop'] = crypto_util.encode_peerlist([peer1])
+    mock_time.time.return_value = 1100.0 + TRACKER_DROP_AVAILABILITY_TTL
+    assert crypto_util.decode_peerlist(storage[b'drop']) == [peer1]
+    assert sorted(storage) == [b'drop', b'other']
+
+    mock_time.time.return_value = 2000.0 + TRACKER_DROP_AVAILABILITY_TTL
+    assert storage.get(b'drop') is None
+    assert [key for (key, _) in storage.items()] == [b'other']
+    assert len(storage._expiry_heap) == 0
+
+
+@mock.patch('syncr_backend.external_interface.dht_util.time', autospec=True)
+def test_peer_storage_cap(mock_time: mock.Mock) -> None:
+    storage = DropPeerDHTStorage(max_peers=3)
+    for i in range(5):
+        mock_time.time.return_value = 1000.0 + i
+        storage[b'drop'] = crypto_util.encode_peerlist(
+            [(b'\xff%d' % i, '1.2.3.4', i)],
+        )
+    peers = crypto_util.decode_peerlist(storage[b'drop'])
+    assert peers is not None
+    assert [port for (_, _, port) in peers] == [4, 3, 2]
+
+
+def test_state_snapshot(tmpdir: Any) -> None:
+    storage = DropPeerDHTStorage()
+    peer = (b'\xff1', '1.2.3.4', 1)
+    storage[b'drop'] = crypto_util.encode_peerlist([peer])
+    storage[b'key'] = b'public key'
+    node = mock.Mock(
+        ksize=20, alpha=3, node=mock.Mock(id=b'node id'), storage=storage,
+    )
+    node.bootstrappableNeighbors.return_value = [('2.3.4.5', 2)]
+    path = str(tmpdir.join('dht.state'))
+
+    assert dht_util.load_dht_state(path) is None
+    dht_util.save_dht_state(node, path)
+    state = dht_util.load_dht_state(path)
+    assert state is not None
+    assert state['id'] == b'node id'
+    assert state['neighbors'] == [('2.3.4.5', 2)]
+
+    restored = DropPeerDHTStorage()
+    restored.restore(state['storage'])
+    assert crypto_util.decode_peerlist(restored[b'drop']) == [peer]
+    assert restored[b'key'] == b'public key'
+    assert restored.peers == storage.peers
+
+    tmpdir.join('dht.state').write(b'garbage', mode='wb')
+    assert dht_util.load_dht_state(path) is None
@@ -5,9 +5,16 @@ from typing import Awaitable
 from typing import TypeVar
 from unittest import mock
 
+import pytest
+
+from syncr_backend.init.node_init import NodeIdentity
+from syncr_backend.metadata import drop_metadata
 from syncr_backend.metadata.drop_metadata import DropMetadata
+from syncr_backend.metadata.drop_metadata import DropVersion
+from syncr_backend.metadata.drop_metadata import gen_drop_id
 from syncr_backend.util import crypto_util
 from syncr_backend.util.crypto_util import load_public_key
+from syncr_backend.util.crypto_util import VerificationException
 
 
 R = TypeVar('R')
@@ -69,3 +76,86 @@ def test_drop_metadata_decode(mock_get_pub_key: mock.Mock) -> None:
     expected_id = b"OnO4z+byMrImwSEPlZszPkd1NGmst1HoRMMffKiIJGChrkmTuO+XyzD"\
                   b"aJUTCYrqWFm2D32JXtnVoQhk82UbvEA=="
     assert base64.b64encode(d.id) == expected_id
+
+
+@mock.patch(
+    'syncr_backend.util.journal_util.get_full_init_directory', autospec=True,
+)
+@mock.patch(
+    'syncr_backend.metadata.drop_metadata.node_init', autospec=True,
+)
+@mock.patch('syncr_backend.metadata.drop_metadata.get_pub_key', autospec=True)
+def test_drop_metadata_decode_verified_cache(
+    mock_get_pub_key: mock.Mock, mock_node_init: mock.Mock,
+    mock_init_dir: mock.Mock, tmpdir: Any,
+) -> None:
+    key = run_coro(crypto_util.generate_private_key())
+    owner = run_coro(crypto_util.node_id_from_private_key(key))
+
+    async def identity() -> NodeIdentity:
+        return NodeIdentity(key, owner)
+
+    async def pub_key(_: Any) -> crypto_util.rsa.RSAPublicKey:
+        return key.public_key()
+
+    mock_init_dir.return_value = str(tmpdir)
+    mock_node_init.get_identity.side_effect = identity
+    mock_get_pub_key.side_effect = pub_key
+
+    b = run_coro(
+        DropMetadata(
+            drop_id=gen_drop_id(owner), name='test', version=DropVersion(1, 2),
+            previous_versions=[], primary_owner=owner, other_owners={},
+            signed_by=owner, files={'a': b'\xff' * 32},
+        ).encode(),
+    )
+
+    run_coro(DropMetadata.decode(b))
+    assert mock_get_pub_key.call_count == 1
+    # verified before, so the signature is not checked again
+    run_coro(DropMetadata.decode(b))
+    assert mock_get_pub_key.call_count == 1
+    run_coro(DropMetadata.decode(b, reverify=True))
+    assert mock_get_pub_key.call_count == 2
+
+    # other bytes with the same version and signature are still verified
+    with pytest.raises(VerificationException):
+        run_coro(DropMetadata.decode(b.replace(b'4:test', b'4:tost')))
+
+
+@mock.patch(
+    'syncr_backend.metadata.drop_metadata._get_public_key_store',
+    autospec=True,
+)
+@mock.patch(
+    'syncr_backend.metadata.drop_metadata.get_full_init_directory',
+    autospec=True,
+)
+def test_get_pub_key_cache(
+    mock_init_dir: mock.Mock, mock_get_pks: mock.Mock, tmpdir: Any,
+) -> None:
+    mock_init_dir.return_value = str(tmpdir)
+    key = run_coro(crypto_util.generate_private_key()).public_key()
+    pks = mock.Mock()
+
+    async def get_pks() -> mock.Mock:
+        return pks
+
+    async def request_key(node_id: bytes) -> Any:
+        if node_id == b'found':
+            return (True, crypto_util.dump_public_key(key).decode('utf-8'))
+        return (False, None)
+
+    mock_get_pks.side_effect = get_pks
+    pks.request_key.side_effect = request_key
+
+    run_coro(drop_metadata.prefetch_pub_keys(b'missing'))
+    with pytest.raises(VerificationException):
+        run_coro(drop_metadata.get_pub_key(b'missing'))
+    assert pks.request_key.call_count == 1
+
+    assert run_coro(drop_metadata.get_pub_key(b'found')).public_numbers() == \
+        key.public_numbers()
+    run_coro(drop_metadata.get_pub_key(b'found'))
+    assert pks.request_key.call_count == 2
+    assert not drop_metadata._pub_key_locks
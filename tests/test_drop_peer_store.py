@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from typing import Any
+from typing import Awaitable
+from typing import List
+from typing import Tuple
+from typing import TypeVar
+from unittest import mock
+
+from syncr_backend.external_interface import drop_peer_store
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def test_spread_offsets() -> None:
+    offsets = drop_peer_store.spread_offsets(10, 100)
+    assert len(offsets) == 10
+    for (i, offset) in enumerate(offsets):
+        assert i * 10 <= offset < (i + 1) * 10
+    assert drop_peer_store.spread_offsets(0, 100) == []
+
+
+class FakePeerStore(drop_peer_store.DropPeerStore):
+    def __init__(self) -> None:
+        self.added = []  # type: List[bytes]
+        self.pending = 0
+        self.max_pending = 0
+
+    async def add_drop_peer(self, drop_id: bytes, ip: str, port: int) -> bool:
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        await asyncio.sleep(0.05)
+        self.pending -= 1
+        self.added.append(drop_id)
+        return True
+
+    async def request_peers(
+        self, drop_id: bytes,
+    ) -> Tuple[bool, List[Tuple[bytes, str, int]]]:
+        return False, []
+
+
+@mock.patch(
+    'syncr_backend.external_interface.drop_peer_store.node_init.get_identity',
+    autospec=True,
+)
+@mock.patch(
+    'syncr_backend.external_interface.drop_peer_store.get_drop_peer_store',
+    autospec=True,
+)
+@mock.patch(
+    'syncr_backend.external_interface.drop_peer_store.list_drops',
+    autospec=True,
+)
+def test_drop_announcer(
+    mock_list_drops: mock.Mock, mock_get_dps: mock.Mock,
+    mock_get_identity: mock.Mock,
+) -> None:
+    dps = FakePeerStore()
+    drops = [b'drop%d' % i for i in range(20)]
+    mock_list_drops.return_value = list(drops)
+
+    async def get_dps(_: bytes) -> drop_peer_store.DropPeerStore:
+        return dps
+
+    async def get_identity(*_: Any) -> Any:
+        return mock.Mock(node_id=b'node')
+
+    mock_get_dps.side_effect = get_dps
+    mock_get_identity.side_effect = get_identity
+
+    async def run() -> None:
+        shutdown_flag = threading.Event()
+        announcer = drop_peer_store.DropAnnouncer('127.0.0.1', 1234, 2)
+        announcer.window = 1
+        task = asyncio.ensure_future(announcer.run(shutdown_flag))
+        await asyncio.sleep(0.01)
+        announcer.announce_soon(b'new')
+        await asyncio.sleep(0.1)
+        assert b'new' in dps.added
+        assert len(dps.added) < len(drops)
+        await asyncio.sleep(1)
+        shutdown_flag.set()
+        task.cancel()
+
+    run_coro(run())
+    assert sorted(set(dps.added)) == sorted(drops + [b'new'])
+    assert dps.max_pending <= 2
@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any
+from typing import Awaitable
+from typing import Optional
+from typing import TypeVar
+from unittest import mock
+
+from syncr_backend.metadata import drop_registry
+from syncr_backend.metadata.drop_metadata import DropMetadata
+from syncr_backend.metadata.drop_metadata import DropVersion
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def make_metadata() -> DropMetadata:
+    return DropMetadata(
+        drop_id=b'drop', name='test', version=DropVersion(1, 2),
+        previous_versions=[], primary_owner=b'owner', other_owners={},
+        signed_by=b'owner', files={'a': b'file_a', 'dir/b': b'file_b'},
+    )
+
+
+@mock.patch(
+    'syncr_backend.metadata.drop_registry.DropMetadata.read_file',
+    autospec=True,
+)
+@mock.patch(
+    'syncr_backend.metadata.drop_registry.get_drop_location', autospec=True,
+)
+def test_get_entry(
+    mock_get_drop_location: mock.Mock, mock_read_file: mock.Mock,
+) -> None:
+    drop_registry.clear()
+
+    async def location(_: Any) -> str:
+        return '/drops/test'
+
+    async def read_file(**_: Any) -> Optional[DropMetadata]:
+        return make_metadata()
+
+    mock_get_drop_location.side_effect = location
+    mock_read_file.side_effect = read_file
+
+    entry = run_coro(drop_registry.get_entry(b'drop'))
+    assert entry is not None
+    assert entry.version == DropVersion(1, 2)
+    assert entry.get_file_path(b'file_b') == '/drops/test/dir/b'
+    assert entry.get_file_path(b'file_c') is None
+
+    # second lookup does not touch the disk
+    assert run_coro(drop_registry.get_entry(b'drop')) is entry
+    assert mock_get_drop_location.call_count == 1
+
+    assert run_coro(drop_registry.refresh(b'drop')) is not entry
+    assert mock_get_drop_location.call_count == 2
+
+    async def no_metadata(**_: Any) -> Optional[DropMetadata]:
+        return None
+
+    drop_registry.remove(b'drop')
+    mock_read_file.side_effect = no_metadata
+    assert run_coro(drop_registry.get_entry(b'drop')) is None
+
+
+@mock.patch(
+    'syncr_backend.metadata.drop_registry.get_drop_location', autospec=True,
+)
+def test_get_entry_not_found(mock_get_drop_location: mock.Mock) -> None:
+    drop_registry.clear()
+    mock_get_drop_location.side_effect = FileNotFoundError()
+
+    assert run_coro(drop_registry.get_entry(b'missing')) is None
@@ -0,0 +1,202 @@
+import asyncio
+from typing import Any
+from typing import Awaitable
+from typing import List
+from typing import TypeVar
+from unittest import mock
+
+import pytest
+
+from syncr_backend.metadata.drop_metadata import DropMetadata
+from syncr_backend.metadata.drop_metadata import DropVersion
+from syncr_backend.util import drop_util
+from syncr_backend.util.crypto_util import VerificationException
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def make_chain(n: int) -> List[DropMetadata]:
+    chain = []  # type: List[DropMetadata]
+    for i in range(1, n + 1):
+        chain.append(
+            DropMetadata(
+                drop_id=b'o' * 32 + b'd' * 32, name='test',
+                version=DropVersion(i, i),
+                previous_versions=[chain[-1].version] if chain else [],
+                primary_owner=b'o' * 32, other_owners={},
+                signed_by=b'o' * 32, files={}, sig=b'sig%d' % i,
+            ),
+        )
+    return chain
+
+
+@mock.patch(
+    'syncr_backend.util.journal_util.get_full_init_directory', autospec=True,
+)
+@mock.patch(
+    'syncr_backend.util.drop_util.DropMetadata.verify_header', autospec=True,
+)
+@mock.patch('syncr_backend.util.drop_util.get_drop_peers', autospec=True)
+@mock.patch('syncr_backend.util.drop_util.get_drop_metadata', autospec=True)
+def test_verify_version(
+    mock_get_drop_metadata: mock.Mock, mock_get_drop_peers: mock.Mock,
+    mock_verify_header: mock.Mock, mock_init_dir: mock.Mock, tmpdir: Any,
+) -> None:
+    mock_init_dir.return_value = str(tmpdir)
+    chain = make_chain(5)
+    by_version = {dm.version: dm for dm in chain}
+
+    async def get_drop_metadata(
+        drop_id: bytes, peers: Any, version: DropVersion, **_: Any
+    ) -> DropMetadata:
+        return by_version[version]
+
+    async def get_drop_peers(_: bytes) -> List[Any]:
+        return [('127.0.0.1', 1234)]
+
+    async def verify_header(_: DropMetadata) -> None:
+        pass
+
+    mock_get_drop_metadata.side_effect = get_drop_metadata
+    mock_get_drop_peers.side_effect = get_drop_peers
+    mock_verify_header.side_effect = verify_header
+
+    run_coro(drop_util.verify_version(chain[3]))
+    assert mock_verify_header.call_count == 4
+    assert mock_get_drop_metadata.call_count == 3
+
+    # only the new version is checked, against its verified parent
+    run_coro(drop_util.verify_version(chain[4]))
+    assert mock_verify_header.call_count == 5
+    assert mock_get_drop_metadata.call_count == 4
+    run_coro(drop_util.verify_version(chain[4]))
+    assert mock_verify_header.call_count == 5
+
+    # a version with a different signature is not in the ledger
+    forged = make_chain(5)[4]
+    forged.sig = b'forged'
+    forged.signed_by = b'x' * 32
+    with pytest.raises(VerificationException):
+        run_coro(drop_util.verify_version(forged))
+
+
+@mock.patch('syncr_backend.util.drop_util.send_requests.get_my_ip')
+@mock.patch('syncr_backend.util.drop_util.fileio_util.load_config_file')
+@mock.patch('syncr_backend.util.drop_util.drop_peer_store.get_drop_peer_store')
+@mock.patch('syncr_backend.util.drop_util.node_init.get_identity')
+def test_get_drop_peers(
+    mock_get_identity: mock.Mock, mock_get_dps: mock.Mock,
+    mock_load_config: mock.Mock, mock_get_my_ip: mock.Mock,
+) -> None:
+    async def get_identity() -> Any:
+        return mock.Mock(node_id=b'node')
+
+    async def load_config() -> Any:
+        return {'max_returned_peers': 4}
+
+    async def request_peers(_: bytes) -> Any:
+        return True, [
+            [b'n%d' % i, '10.0.0.%d' % i, 1000 + i, i] for i in range(10)
+        ]
+
+    async def get_dps(_: bytes) -> Any:
+        return mock.Mock(request_peers=request_peers)
+
+    mock_get_identity.side_effect = get_identity
+    mock_load_config.side_effect = load_config
+    mock_get_dps.side_effect = get_dps
+    mock_get_my_ip.return_value = ('10.0.0.9', 1009)
+
+    peers = run_coro(drop_util.get_drop_peers(b'drop'))
+    assert len(peers) == 4
+    assert peers[:2] == [('10.0.0.8', 1008), ('10.0.0.7', 1007)]
+
+
+def test_diff_timestamps() -> None:
+    old_files = {name: (1, 10**9, 1) for name in 'abcd'}
+    current_files = {
+        'a': (1, 10**9, 1), 'b': (2, 10**9, 1), 'e': (1, 10**9, 2),
+    }
+    status = drop_util.diff_timestamps(old_files, current_files)
+    assert status == drop_util.FileUpdateStatus(
+        added={'e'}, removed={'c', 'd'}, changed={'b'}, unchanged={'a'},
+    )
+
+    # only b, c and e were looked at
+    status = drop_util.diff_timestamps(
+        old_files, {'b': (2, 10**9, 1), 'e': (1, 10**9, 2)}, {'b', 'c', 'e'},
+    )
+    assert status == drop_util.FileUpdateStatus(
+        added={'e'}, removed={'c'}, changed={'b'}, unchanged={'a', 'd'},
+    )
+
+    # old timestamp files only have whole seconds
+    status = drop_util.diff_timestamps(
+        {'a': (-1, 10**9, -1), 'b': (-1, 10**9, -1)},
+        {'a': (1, 10**9 + 5, 1), 'b': (1, 2 * 10**9, 1)},
+    )
+    assert status.unchanged == {'a'} and status.changed == {'b'}
+
+
+def test_reuse_local_files(tmpdir: Any) -> None:
+    (old, new) = make_chain(2)
+    old.files = {'a': b'1' * 32, 'b': b'2' * 32, 'c': b'3' * 32}
+    # a was renamed, b was duplicated, c is unchanged and d is new
+    new.files = {
+        'sub/moved': b'1' * 32, 'b': b'2' * 32, 'b2': b'2' * 32,
+        'c': b'3' * 32, 'd': b'4' * 32,
+    }
+    for name in ('a', 'b', 'c'):
+        tmpdir.join(name).write(name)
+
+    assert run_coro(drop_util.reuse_local_files(old, new, str(tmpdir))) == 2
+    assert not tmpdir.join('a').exists()
+    assert tmpdir.join('sub', 'moved').read() == 'a'
+    assert tmpdir.join('b').read() == 'b'
+    assert tmpdir.join('b2.part').read() == 'b'
+    assert not tmpdir.join('d').exists()
+    assert not tmpdir.join('d.part').exists()
+
+    assert run_coro(drop_util.reuse_local_files(None, new, str(tmpdir))) == 0
+
+
+@mock.patch(
+    'syncr_backend.util.journal_util.get_full_init_directory', autospec=True,
+)
+@mock.patch('syncr_backend.util.drop_util.check_for_changes', autospec=True)
+def test_find_unchanged_files(
+    mock_check_for_changes: mock.Mock, mock_init_dir: mock.Mock, tmpdir: Any,
+) -> None:
+    mock_init_dir.return_value = str(tmpdir.mkdir('init'))
+    drop = tmpdir.mkdir('drop')
+    drop.mkdir('.5yncr').join('timestamp').write('')
+    (old, new) = make_chain(2)
+    old.files = {'a': b'1', 'b': b'2', 'c': b'3', 'd': b'4'}
+    new.files = {'a': b'1', 'b': b'2', 'c': b'5', 'e': b'6'}
+
+    async def check_for_changes(_: bytes) -> drop_util.FileUpdateStatus:
+        return drop_util.FileUpdateStatus(
+            added=set(), removed=set(), changed={'b'}, unchanged={'a', 'c'},
+        )
+    mock_check_for_changes.side_effect = check_for_changes
+
+    # the old version was never completely synced
+    assert run_coro(
+        drop_util.find_unchanged_files(old, new, str(drop)),
+    ) == set()
+
+    drop_util.mark_version_synced(old)
+    assert drop_util.is_version_synced(old)
+    assert not drop_util.is_version_synced(new)
+    assert run_coro(
+        drop_util.find_unchanged_files(old, new, str(drop)),
+    ) == {'a'}
+    assert run_coro(
+        drop_util.find_unchanged_files(None, new, str(drop)),
+    ) == set()
@@ -1,3 +1,6 @@
+import pytest
+
+from syncr_backend.constants import CDC_PROTOCOL_VERSION
 from syncr_backend.metadata.file_metadata import DEFAULT_CHUNK_SIZE
 from syncr_backend.metadata.file_metadata import FileMetadata
 
@@ -20,3 +23,25 @@ def test_file_metadata_encode() -> None:
     f = FileMetadata([b'0123', b'1234'], b'0000', 100, b'foo')
 
     assert f.encode() == i
+
+
+def test_file_metadata_chunk_lengths() -> None:
+    f = FileMetadata(
+        [b'0123', b'1234', b'2345'], b'0000', 100, b'foo',
+        protocol_version=CDC_PROTOCOL_VERSION, chunk_lengths=[30, 60, 10],
+    )
+    assert f.num_chunks == 3
+    assert [f.chunk_range(i) for i in range(3)] == \
+        [(0, 30), (30, 60), (90, 10)]
+
+    decoded = FileMetadata.decode(f.encode())
+    assert decoded.chunk_lengths == [30, 60, 10]
+    assert decoded.chunk_range(2) == (90, 10)
+
+    assert FileMetadata([b'0123'], b'0000', 100, b'foo').chunk_range(0) \
+        == (0, 100)
+    with pytest.raises(ValueError):
+        FileMetadata(
+            [b'0123'], b'0000', 100, b'foo',
+            protocol_version=CDC_PROTOCOL_VERSION, chunk_lengths=[30],
+        )
@@ -0,0 +1,133 @@
+import asyncio
+import fcntl
+import os
+import threading
+from typing import Any
+from unittest import mock
+
+from syncr_backend.metadata import drop_metadata
+from syncr_backend.util import crypto_util
+from syncr_backend.util.journal_util import KeyValueJournal
+
+
+def test_journal_reload(tmpdir: Any) -> None:
+    path = str(tmpdir.join('journal'))
+    journal = KeyValueJournal(path)
+    assert journal.get('foo') is None
+    journal.set('foo', 'bar')
+    journal.set('foo', 'baz')
+    journal.set_many([('a', 1), ('b', 2)])
+    journal.delete('a')
+
+    reloaded = KeyValueJournal(path)
+    assert sorted(reloaded.items()) == [('b', 2), ('foo', 'baz')]
+
+    # a torn last record is ignored
+    with open(path, 'ab') as f:
+        f.write(b'{"k": "c", "v"')
+    assert sorted(KeyValueJournal(path).keys()) == ['b', 'foo']
+
+    # and does not swallow the next record
+    KeyValueJournal(path).set('d', 3)
+    assert sorted(KeyValueJournal(path).items()) == \
+        [('b', 2), ('d', 3), ('foo', 'baz')]
+
+
+def test_journal_refresh_and_compact(tmpdir: Any) -> None:
+    path = str(tmpdir.join('journal'))
+    journal = KeyValueJournal(path)
+    other = KeyValueJournal(path)
+    journal.set('foo', 0)
+    assert other.get('foo') == 0
+
+    for i in range(100):
+        other.set('foo', i)
+    # other compacted the journal, so it was replaced
+    with open(path, 'rb') as f:
+        assert len(f.readlines()) < 100
+    journal.refresh()
+    assert journal.get('foo') == 99
+    assert len(journal) == 1
+
+
+def test_journal_concurrent_append(tmpdir: Any) -> None:
+    path = str(tmpdir.join('journal'))
+    journal = KeyValueJournal(path)
+    other = KeyValueJournal(path)
+    journal.set('a', 1)
+    # other appends after journal refreshed, before journal writes
+    with mock.patch.object(
+        journal, 'refresh', autospec=True,
+        side_effect=lambda: other.set('b', 2),
+    ):
+        journal.set('c', 3)
+    assert sorted(journal.items()) == [('a', 1), ('b', 2), ('c', 3)]
+    assert journal._records == 3
+    journal.refresh()
+    assert journal._records == 3
+
+
+def test_journal_compact_shared(tmpdir: Any) -> None:
+    path = str(tmpdir.join('journal'))
+    a = KeyValueJournal(path)
+    b = KeyValueJournal(path)
+    a.set('x', 1)
+    b.set('y', 2)
+    # a has not read y, but its compaction keeps it
+    a.compact()
+    assert sorted(KeyValueJournal(path).items()) == [('x', 1), ('y', 2)]
+    b.set('z', 3)
+    b.compact()
+    a.refresh()
+    assert sorted(a.items()) == [('x', 1), ('y', 2), ('z', 3)]
+    assert os.listdir(str(tmpdir)) == ['journal']
+
+    # an append waiting for a compaction goes to the compacted journal
+    fd = os.open(path, os.O_RDONLY)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    waiting = threading.Event()
+    flock = fcntl.flock
+
+    def wait_for_lock(lock_fd: int, operation: int) -> None:
+        waiting.set()
+        flock(lock_fd, operation)
+
+    with mock.patch(
+        'syncr_backend.util.journal_util.fcntl.flock', autospec=True,
+        side_effect=wait_for_lock,
+    ) as mock_flock:
+        appender = threading.Thread(target=lambda: b.set('w', 4))
+        appender.start()
+        waiting.wait()
+        with open(path + '.new', 'wb') as f:
+            f.write(b'{"k": "x", "v": 1}\n')
+        os.replace(path + '.new', path)
+        os.close(fd)
+        appender.join()
+    # the old journal was locked, then the new one
+    assert mock_flock.call_count == 2
+    assert sorted(KeyValueJournal(path).items()) == [('w', 4), ('x', 1)]
+
+
+@mock.patch(
+    'syncr_backend.metadata.drop_metadata.node_init.get_full_init_directory',
+    autospec=True,
+)
+def test_drop_location_migration(
+    mock_init_dir: mock.Mock, tmpdir: Any,
+) -> None:
+    mock_init_dir.return_value = str(tmpdir)
+    old_dir = tmpdir.mkdir('drops')
+    drop_id = b'\x00' * 64
+    old_dir.join(crypto_util.b64encode(drop_id).decode('utf-8')).write('/foo')
+
+    loop = asyncio.get_event_loop()
+    assert drop_metadata.list_drops() == [drop_id]
+    assert loop.run_until_complete(
+        drop_metadata.get_drop_location(drop_id),
+    ) == '/foo'
+    assert not os.path.exists(str(old_dir))
+
+    loop.run_until_complete(drop_metadata.save_drop_location(b'1' * 64, '/b'))
+    drop_metadata.remove_drop_location(drop_id)
+    assert drop_metadata.list_drops() == [b'1' * 64]
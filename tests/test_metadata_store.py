@@ -0,0 +1,87 @@
+import asyncio
+import os
+from typing import Any
+from typing import Awaitable
+from typing import TypeVar
+from unittest import mock
+
+import pytest
+
+from syncr_backend.metadata import metadata_store
+from syncr_backend.metadata.file_metadata import FileMetadata
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+@pytest.mark.parametrize('store_type', sorted(metadata_store.STORE_TYPES))
+def test_store(store_type: str, tmpdir: Any) -> None:
+    store = metadata_store.make_metadata_store(str(tmpdir), store_type)
+    drop_id = b'd' * 64
+
+    assert run_coro(store.read_drop_metadata(drop_id, (1, 2))) is None
+    assert run_coro(store.read_pointer(drop_id, metadata_store.CURRENT)) \
+        is None
+    run_coro(store.write_drop_metadata(drop_id, (1, 2), b'v1'))
+    run_coro(
+        store.write_drop_metadata(
+            drop_id, (2, 3), b'v2', is_current=True, is_latest=True,
+        ),
+    )
+    run_coro(store.write_pointer(drop_id, metadata_store.CURRENT, (1, 2)))
+    assert run_coro(store.read_drop_metadata(drop_id, (1, 2))) == b'v1'
+    assert run_coro(store.read_pointer(drop_id, metadata_store.CURRENT)) \
+        == (1, 2)
+    assert run_coro(store.read_pointer(drop_id, metadata_store.LATEST)) \
+        == (2, 3)
+
+    run_coro(store.write_file_metadata([(b'a', b'fa'), (b'b', b'fb')]))
+    run_coro(store.write_file_metadata([(b'c', b'fc')], replace=True))
+    assert run_coro(store.read_file_metadata(b'a')) is None
+    assert run_coro(store.read_file_metadata(b'c')) == b'fc'
+
+    copy_type = ({metadata_store.FILE_STORE, metadata_store.SQLITE_STORE} -
+                 {store_type}).pop()
+    copy = metadata_store.make_metadata_store(str(tmpdir), copy_type)
+    assert run_coro(metadata_store.copy_metadata(store, copy)) == 5
+    assert sorted(run_coro(copy.list_drop_metadata())) == \
+        [(drop_id, (1, 2)), (drop_id, (2, 3))]
+    assert sorted(run_coro(copy.list_pointers())) == [
+        (drop_id, metadata_store.CURRENT, (1, 2)),
+        (drop_id, metadata_store.LATEST, (2, 3)),
+    ]
+    assert run_coro(copy.list_file_metadata()) == [b'c']
+    store.close()
+    copy.close()
+
+
+@mock.patch(
+    'syncr_backend.metadata.metadata_store.get_full_init_directory',
+    autospec=True,
+)
+def test_file_metadata_sqlite(mock_init_dir: mock.Mock, tmpdir: Any) -> None:
+    mock_init_dir.return_value = str(tmpdir.mkdir('node'))
+    metadata_store.set_store_type(metadata_store.SQLITE_STORE)
+    location = str(tmpdir.join('drop', '.5yncr', 'files'))
+
+    f_m = FileMetadata(
+        [b'\xff1', b'\xff2'], b'file', 10, b'drop', chunk_size=8,
+    )
+    run_coro(FileMetadata.write_files(location, [f_m]))
+    read = run_coro(FileMetadata.read_file.__wrapped__(  # type: ignore
+        file_id=b'file', metadata_location=location, file_name='',
+    ))
+    assert read.hashes == f_m.hashes
+    assert os.path.isfile(
+        str(tmpdir.join('drop', '.5yncr', 'metadata.sqlite')),
+    )
+    assert not os.path.exists(location)
+
+    os.remove(metadata_store.get_config_path())
+    metadata_store.reset()
+    assert metadata_store.get_store_type() == metadata_store.FILE_STORE
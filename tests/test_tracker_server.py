@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+from typing import Awaitable
+from typing import cast
+from typing import TypeVar
+
+from syncr_backend.constants import TrackerRequest
+from syncr_backend.external_interface.drop_peer_store import TrackerPeerStore
+from syncr_backend.external_interface.public_key_store import TrackerKeyStore
+from syncr_backend.external_interface.tracker_server import \
+    start_tracker_server
+from syncr_backend.external_interface.tracker_server import TrackerStorage
+from syncr_backend.external_interface.tracker_util import \
+    send_request_to_tracker
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def test_tracker_storage() -> None:
+    storage = TrackerStorage(ttl=10, max_peers=2)
+    peers = [(b'\xff%d' % i, '1.2.3.4', i) for i in range(3)]
+    for (i, peer) in enumerate(peers):
+        storage.add_peer(b'drop', peer, 100 + i)
+    assert storage.get_peers(b'drop', 105) == [
+        [b'\xff2', '1.2.3.4', 2, 102], [b'\xff1', '1.2.3.4', 1, 101],
+    ]
+    storage.add_peer(b'drop', peers[1], 108)
+    assert [p[2] for p in storage.get_peers(b'drop', 112)] == [1]
+    assert storage.get_peers(b'drop', 118) == []
+    assert storage.peers == {}
+
+
+def test_tracker_server() -> None:
+    key = b'-----BEGIN PUBLIC KEY-----\xff'
+    node_id = hashlib.sha256(key).digest()
+    drop_ids = [b'\xffdrop%d' % i for i in range(5)]
+
+    async def run() -> None:
+        server = cast(
+            asyncio.base_events.Server,
+            await start_tracker_server('127.0.0.1', 0, TrackerStorage()),
+        )
+        port = server.sockets[0].getsockname()[1]
+
+        key_store = TrackerKeyStore(node_id, '127.0.0.1', port)
+        assert await key_store.set_key(key)
+        assert await key_store.request_key(node_id) == (True, key)
+        assert not await TrackerKeyStore(b'\xffbad', '127.0.0.1', port) \
+            .set_key(key)
+
+        peer_store = TrackerPeerStore(node_id, '127.0.0.1', port)
+        assert await peer_store.add_drop_peers(drop_ids, '10.0.0.1', 1234) \
+            == 5
+        (success, peers) = await peer_store.request_peers(drop_ids[3])
+        assert success
+        assert [p[:3] for p in peers] == [[node_id, '10.0.0.1', 1234]]
+        assert peer_store.client.persistent
+
+        # one request per connection still works
+        response = await send_request_to_tracker(
+            {
+                'request_type': int(TrackerRequest.GET_PEERS),
+                'drop_id': b'\xffmissing',
+            },
+            '127.0.0.1', port,
+        )
+        assert response['result'] == 'ERROR'
+
+        peer_store.client.close()
+        server.close()
+        await server.wait_closed()
+
+    run_coro(run())
@@ -0,0 +1,118 @@
+import asyncio
+import socket
+from typing import Any
+from typing import Awaitable
+from typing import Dict
+from typing import List
+from typing import TypeVar
+
+import bencode  # type: ignore
+import pytest
+
+from syncr_backend.external_interface import tracker_util
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def test_pipelined_requests() -> None:
+    connections = []  # type: List[int]
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+    ) -> None:
+        connections.append(1)
+        while True:
+            request = await tracker_util.read_frame(reader)
+            if request is None:
+                break
+            writer.write(
+                tracker_util.encode_frame(
+                    {'result': 'OK', 'data': request['n']},
+                ),
+            )
+        writer.close()
+
+    async def run() -> List[Dict[str, Any]]:
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = tracker_util.TrackerClient('127.0.0.1', port)
+        responses = await asyncio.gather(
+            *[client.request({'n': n}) for n in range(20)]
+        )
+        assert client.persistent
+        client.close()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    responses = run_coro(run())
+    assert [r['data'] for r in responses] == list(range(20))
+    assert len(connections) == 1
+
+
+def test_one_shot_fallback() -> None:
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+    ) -> None:
+        data = await reader.read(1)
+        if data != b'd':
+            writer.close()
+            return
+        request = bencode.decode(data + await reader.read())
+        writer.write(bencode.encode({'result': 'OK', 'data': request['n']}))
+        writer.write_eof()
+        writer.close()
+
+    async def run() -> List[Dict[str, Any]]:
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = tracker_util.TrackerClient('127.0.0.1', port)
+        responses = [await client.request({'n': n}) for n in range(3)]
+        assert client.persistent is False
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    assert [r['data'] for r in run_coro(run())] == [0, 1, 2]
+
+
+def test_tracker_down_at_start() -> None:
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+    ) -> None:
+        while True:
+            request = await tracker_util.read_frame(reader)
+            if request is None:
+                break
+            writer.write(
+                tracker_util.encode_frame(
+                    {'result': 'OK', 'data': request['n']},
+                ),
+            )
+        writer.close()
+
+    async def run() -> None:
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = tracker_util.TrackerClient('127.0.0.1', port)
+        with pytest.raises(OSError):
+            await client.request({'n': 0})
+        # a tracker that could not be reached may still be persistent
+        assert client.persistent is None
+
+        server = await asyncio.start_server(handle, '127.0.0.1', port)
+        assert (await client.request({'n': 1}))['data'] == 1
+        assert client.persistent
+        client.close()
+        server.close()
+        await server.wait_closed()
+
+    run_coro(run())
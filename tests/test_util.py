@@ -1,5 +1,19 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any
 from unittest import mock
 
+import pytest
+
+from syncr_backend.constants import DEFAULT_DPS_CONFIG_FILE
+from syncr_backend.external_interface.drop_peer_store import \
+    get_drop_peer_store
+from syncr_backend.external_interface.store_exceptions import \
+    MissingConfigError
+from syncr_backend.util import fileio_util
+from syncr_backend.util.fileio_util import load_config_file
 from syncr_backend.util.fileio_util import walk_with_ignore
 
 
@@ -48,3 +62,122 @@ def test_walk_with_ignore(
     assert list(
         walk_with_ignore('/foo/bar/123', ignore=['wfoo', 'abc']),
     ) == [('foo', 'qux')]
+
+
+@mock.patch(
+    'syncr_backend.util.fileio_util.get_full_init_directory', autospec=True,
+)
+def test_load_config_file(mock_init_dir: mock.Mock, tmpdir: Any) -> None:
+    mock_init_dir.return_value = str(tmpdir)
+    loop = asyncio.get_event_loop()
+    with pytest.raises(MissingConfigError):
+        loop.run_until_complete(load_config_file())
+
+    config_path = tmpdir.join(DEFAULT_DPS_CONFIG_FILE)
+    config_path.write(json.dumps({'type': 'tracker', 'ip': 'a', 'port': 1}))
+    config = loop.run_until_complete(load_config_file())
+    assert config['ip'] == 'a'
+    dps = loop.run_until_complete(get_drop_peer_store(b'node'))
+    # not changed, so not read again
+    assert loop.run_until_complete(load_config_file()) is config
+    assert loop.run_until_complete(get_drop_peer_store(b'node')) is dps
+
+    config_path.write(json.dumps({'type': 'tracker', 'ip': 'bc', 'port': 1}))
+    assert loop.run_until_complete(load_config_file())['ip'] == 'bc'
+    new_dps = loop.run_until_complete(get_drop_peer_store(b'node'))
+    assert new_dps is not dps
+    assert new_dps.tracker_ip == 'bc'  # type: ignore
+
+
+def test_scan_files(tmpdir: Any) -> None:
+    tmpdir.join('a').write('a')
+    tmpdir.mkdir('sub').mkdir('deeper').join('b').write('bb')
+    tmpdir.mkdir('.5yncr').join('timestamp').write('')
+    drop = str(tmpdir)
+
+    files = fileio_util.scan_files(drop, workers=1)
+    assert sorted(files) == ['a', os.path.join('sub', 'deeper', 'b')]
+    assert fileio_util.scan_files(drop, workers=4) == files
+    st = os.stat(os.path.join(drop, 'a'))
+    assert files['a'] == (1, st.st_mtime_ns, st.st_ino)
+    assert fileio_util.get_file_fingerprints(
+        drop, ['a', 'missing', os.path.join('.5yncr', 'timestamp')],
+    ) == {'a': files['a']}
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(fileio_util.write_timestamp_file(files, drop))
+    assert loop.run_until_complete(
+        fileio_util.read_timestamp_file(drop),
+    ) == files
+
+    # timestamp files used to only have the mtime
+    tmpdir.join('.5yncr', 'timestamp').write(b'd1:ai5ee', mode='wb')
+    assert loop.run_until_complete(
+        fileio_util.read_timestamp_file(drop),
+    ) == {'a': (-1, 5 * 10**9, -1)}
+
+
+def test_syncrignore(tmpdir: Any) -> None:
+    tmpdir.join('a').write('a')
+    tmpdir.join('a.log').write('log')
+    tmpdir.mkdir('src').mkdir('build').join('b').write('b')
+    tmpdir.join('.syncrignore').write('# comment\n\n*.log\nbuild/\n')
+    drop = str(tmpdir)
+
+    expected = ['.syncrignore', 'a']
+    assert sorted(fileio_util.scan_files(drop)) == expected
+    assert sorted(
+        name for (_, name) in walk_with_ignore(drop, ignore=[])
+    ) == expected
+    assert sorted(
+        name for (_, name) in walk_with_ignore(drop, ignore=['a'])
+    ) == ['.syncrignore']
+
+    # the matcher is made again when the file changes
+    tmpdir.join('.syncrignore').write('# nothing\n')
+    os.utime(str(tmpdir.join('.syncrignore')), ns=(0, 0))
+    assert sorted(fileio_util.scan_files(drop)) == [
+        '.syncrignore', 'a', 'a.log', os.path.join('src', 'build', 'b'),
+    ]
+
+
+def test_copy_chunks(tmpdir: Any) -> None:
+    path = str(tmpdir.join('f'))
+    old_path = str(tmpdir.join('old', 'f'))
+    tmpdir.join('f').write(b'aaaabbbbcccc', mode='wb')
+    loop = asyncio.get_event_loop()
+
+    assert loop.run_until_complete(fileio_util.create_file(path, 8, old_path))
+    assert tmpdir.join('old', 'f').read() == 'aaaabbbbcccc'
+    assert os.path.getsize(path + '.part') == 8
+
+    # bbbb moved to the start, cccc is claimed with the wrong hash
+    copies = {
+        0: (4, 0, 4, hashlib.sha256(b'bbbb').digest()),
+        1: (8, 4, 4, hashlib.sha256(b'dddd').digest()),
+    }
+    assert loop.run_until_complete(
+        fileio_util.copy_chunks(old_path, path, copies),
+    ) == {0}
+    assert tmpdir.join('f.part').read(mode='rb') == b'bbbb\0\0\0\0'
+
+    # the source changes after the chunk is verified, before it is copied
+    copy_file_range = fileio_util._copy_file_range
+
+    def change_source(*args: Any) -> int:
+        with open(old_path, 'r+b') as f:
+            f.write(b'xxxx')
+        return copy_file_range(*args)
+
+    with mock.patch(
+        'syncr_backend.util.fileio_util._copy_file_range', autospec=True,
+        side_effect=change_source,
+    ):
+        assert loop.run_until_complete(fileio_util.copy_chunks(
+            old_path, path, {1: (0, 4, 4, hashlib.sha256(b'aaaa').digest())},
+        )) == {1}
+    assert tmpdir.join('f.part').read(mode='rb') == b'bbbbaaaa'
+
+    assert not loop.run_until_complete(
+        fileio_util.create_file(str(tmpdir.join('g')), 1),
+    )
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import threading
+from typing import Any
+from typing import Awaitable
+from typing import Dict
+from typing import TypeVar
+from unittest import mock
+
+import pytest
+
+from syncr_backend.util import watch_util
+
+
+R = TypeVar('R')
+
+
+def run_coro(f: Awaitable[R]) -> R:
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(f)
+
+
+def make_drop(tmpdir: Any) -> str:
+    tmpdir.join('a').write('a')
+    tmpdir.join('gone').write('gone')
+    tmpdir.mkdir('sub').join('b').write('b')
+    tmpdir.mkdir('.5yncr').join('timestamp').write('')
+    return str(tmpdir)
+
+
+def change_drop(drop: str) -> None:
+    with open(os.path.join(drop, 'a'), 'w') as f:
+        f.write('changed')
+    os.remove(os.path.join(drop, 'gone'))
+    os.mkdir(os.path.join(drop, 'new'))
+    with open(os.path.join(drop, 'new', 'c'), 'w') as f:
+        f.write('c')
+    with open(os.path.join(drop, '.5yncr', 'timestamp'), 'w') as f:
+        f.write('ignored')
+
+
+@pytest.mark.skipif(
+    not watch_util.inotify_available(), reason="inotify is not available",
+)
+def test_inotify_watcher(tmpdir: Any) -> None:
+    drop = make_drop(tmpdir)
+
+    async def run() -> None:
+        watcher = watch_util.InotifyWatcher(drop)
+        await watcher.start()
+        assert watcher.changes() is None
+        watcher.end_scan(watcher.begin_scan(), [])
+        assert watcher.changes() == (set(), set())
+
+        change_drop(drop)
+        await asyncio.sleep(0.1)
+        changes = watcher.changes()
+        assert changes == ({'a', 'gone'}, {'new'})
+        old_files = ['a', 'gone', os.path.join('sub', 'b')]
+        assert watch_util.expand_changes(drop, changes, old_files) == {
+            'a', 'gone', os.path.join('new', 'c'),
+        }
+
+        # files in new directories are watched too
+        with open(os.path.join(drop, 'new', 'd'), 'w') as f:
+            f.write('d')
+        await asyncio.sleep(0.1)
+        assert os.path.join('new', 'd') in watcher.dirty
+
+        # new directories are walked in an executor, and until that is done
+        # the watcher is not trusted
+        walked = threading.Event()
+        watch_tree = watcher._watch_tree
+
+        def slow_watch_tree(rel_dir: str) -> Dict[int, str]:
+            walked.wait()
+            return watch_tree(rel_dir)
+
+        with mock.patch.object(
+            watcher, '_watch_tree', autospec=True, side_effect=slow_watch_tree,
+        ):
+            os.makedirs(os.path.join(drop, 'newer', 'sub'))
+            await asyncio.sleep(0.1)
+            assert watcher.changes() is None
+            walked.set()
+            await asyncio.sleep(0.1)
+        assert watcher.changes() is not None
+        with open(os.path.join(drop, 'newer', 'sub', 'e'), 'w') as f:
+            f.write('e')
+        await asyncio.sleep(0.1)
+        assert os.path.join('newer', 'sub', 'e') in watcher.dirty
+
+        watcher.mark_overflow()
+        assert watcher.changes() is None
+        watcher.stop()
+
+    run_coro(run())
+
+
+def test_polling_watcher(tmpdir: Any) -> None:
+    drop = make_drop(tmpdir)
+
+    async def run() -> None:
+        watcher = watch_util.PollingWatcher(drop, interval=0.01)
+        await watcher.start()
+        watcher.end_scan(watcher.begin_scan(), [])
+        change_drop(drop)
+        # the scan only sees whole seconds
+        os.utime(os.path.join(drop, 'a'), (0, 0))
+        await asyncio.sleep(0.2)
+        assert watcher.changes() == (
+            {'a', 'gone', os.path.join('new', 'c')}, set(),
+        )
+        watcher.end_scan(watcher.begin_scan(clear=True), [])
+        assert watcher.changes() == (set(), set())
+        watcher.stop()
+
+    run_coro(run())